@@ -123,7 +123,8 @@ def _accumulated_moments_for_inference(mean, variance, is_training):
   """Use accumulated statistics for moments during inference.
 
   After training the user is responsible for filling the accumulators with the
-  actual values. See _UpdateBnAccumulators() in eval_gan_lib.py for an example.
+  actual values. See _update_bn_accumulators() in eval_gan_lib.py for an
+  example.
 
   Args:
     mean: Tensor of shape [num_channels] with the mean of the current batch.
@@ -128,6 +128,11 @@ class ImageDatasetV2(object):
       return 100
     return self._eval_test_sample
 
+  @property
+  def eval_split(self):
+    """Name of the split used for evaluation."""
+    return self._eval_split
+
   @property
   def image_shape(self):
     """Returns a tuple with the image shape."""
@@ -243,7 +248,7 @@ class ImageDatasetV2(object):
         data_dir=FLAGS.tfds_data_dir,
         as_dataset_kwargs={"shuffle_files": False})
     ds = self._replace_labels(split, ds)
-    ds = ds.map(self._parse_fn)
+    ds = ds.map(self._parse_fn, num_parallel_calls=tf.contrib.data.AUTOTUNE)
     return ds.prefetch(tf.contrib.data.AUTOTUNE)
 
   def _train_filter_fn(self, image, label):
@@ -311,7 +316,8 @@ class ImageDatasetV2(object):
 
     ds = self._load_dataset(split=split)
     # No filter, no rpeat.
-    ds = ds.map(functools.partial(self._eval_transform_fn, seed=seed))
+    ds = ds.map(functools.partial(self._eval_transform_fn, seed=seed),
+                num_parallel_calls=tf.contrib.data.AUTOTUNE)
     # No shuffle.
     if "batch_size" in params:
       ds = ds.batch(params["batch_size"], drop_remainder=True)
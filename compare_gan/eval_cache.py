@@ -0,0 +1,203 @@
+# coding=utf-8
+# Copyright 2018 Google LLC & Hwalsuk Lee.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Persistent on-disk cache for data that is shared between evaluations.
+
+Every evaluated checkpoint is compared against the same real data. Decoding
+the real images and computing their Inception features is expensive (50k
+images for ImageNet), so we compute it once and store it on disk.
+
+Entries are content addressed: the key is a hash over all the values that
+influence the cached arrays (e.g. dataset name, split, number of examples and
+the hash of the Inception graph). Arrays are stored as .npy files and loaded
+with `mmap_mode="r"` so that concurrent evaluation processes share the pages
+instead of each holding a private copy.
+
+Creating an entry is guarded by an exclusive file lock on the entry. Other
+processes requesting the same entry wait for the lock and then read the
+result instead of computing it again. The cache directory must be on a local
+or POSIX file system (e.g. NFS) that supports flock() and mmap().
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import contextlib
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from absl import logging
+
+import gin
+import numpy as np
+import six
+
+
+_METADATA_FILENAME = "metadata.json"
+
+
+@gin.configurable("eval_cache", whitelist=["cache_dir"])
+def get_eval_cache(cache_dir=None):
+  """Returns the `EvalCache` for evaluations or None if caching is disabled.
+
+  Args:
+    cache_dir: Directory for the cache. Can be shared by all runs of a sweep.
+      If None caching is disabled.
+
+  Returns:
+    `EvalCache` object or None.
+  """
+  if not cache_dir:
+    return None
+  return EvalCache(cache_dir)
+
+
+def get_gin_bindings(binding_keys):
+  """Returns a dictionary with the values bound to the given Gin parameters.
+
+  Parameters without a bound value are not included. Use this to add Gin
+  bindings that affect the cached data to the cache key.
+
+  Args:
+    binding_keys: List of Gin binding keys, e.g. "module.fn.param".
+
+  Returns:
+    Dictionary mapping binding keys to the string representation of the value.
+  """
+  bindings = {}
+  for binding_key in binding_keys:
+    try:
+      bindings[binding_key] = str(gin.query_parameter(binding_key))
+    except ValueError:
+      # Nothing bound, the default value is used.
+      pass
+  return bindings
+
+
+class EvalCache(object):
+  """Content addressed cache of NumPy arrays in a (shared) directory."""
+
+  def __init__(self, cache_dir):
+    self._cache_dir = cache_dir
+    if not os.path.isdir(cache_dir):
+      try:
+        os.makedirs(cache_dir)
+      except OSError as e:
+        # Another process might have created the directory in the meantime.
+        if e.errno != errno.EEXIST:
+          raise
+
+  @property
+  def cache_dir(self):
+    return self._cache_dir
+
+  def key(self, **kwargs):
+    """Returns the cache key for the given values.
+
+    Args:
+      **kwargs: Values that define the cache entry. Must be JSON serializable.
+
+    Returns:
+      Hexadecimal string.
+    """
+    serialized = json.dumps(kwargs, sort_keys=True)
+    return hashlib.sha1(serialized.encode("utf-8")).hexdigest()
+
+  def _entry_dir(self, key):
+    return os.path.join(self._cache_dir, key)
+
+  @contextlib.contextmanager
+  def lock(self, key):
+    """Context manager holding an exclusive lock for the entry `key`."""
+    lock_path = os.path.join(self._cache_dir, key + ".lock")
+    with open(lock_path, "a") as lock_file:
+      fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+      try:
+        yield
+      finally:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+  def contains(self, key):
+    return os.path.exists(
+        os.path.join(self._entry_dir(key), _METADATA_FILENAME))
+
+  def load(self, key):
+    """Returns the arrays of the entry `key` as read-only memory maps.
+
+    Args:
+      key: Cache key as returned by `key()`.
+
+    Returns:
+      Dictionary mapping names to NumPy arrays.
+    """
+    entry_dir = self._entry_dir(key)
+    with open(os.path.join(entry_dir, _METADATA_FILENAME)) as f:
+      metadata = json.load(f)
+    return {name: np.load(os.path.join(entry_dir, name + ".npy"),
+                          mmap_mode="r")
+            for name in metadata["arrays"]}
+
+  def save(self, key, arrays, metadata=None):
+    """Stores the arrays as entry `key`.
+
+    The arrays are first written to a temporary directory which is then
+    renamed. Readers will never see a partially written entry.
+
+    Args:
+      key: Cache key as returned by `key()`.
+      arrays: Dictionary mapping names to NumPy arrays.
+      metadata: Optional JSON serializable dictionary stored with the entry.
+    """
+    tmp_dir = tempfile.mkdtemp(prefix=key + ".tmp", dir=self._cache_dir)
+    try:
+      for name, value in six.iteritems(arrays):
+        np.save(os.path.join(tmp_dir, name + ".npy"), value)
+      with open(os.path.join(tmp_dir, _METADATA_FILENAME), "w") as f:
+        json.dump({"arrays": sorted(arrays), "metadata": metadata or {}}, f)
+      os.rename(tmp_dir, self._entry_dir(key))
+    except Exception:  # pylint: disable=broad-except
+      shutil.rmtree(tmp_dir, ignore_errors=True)
+      raise
+
+  def get_or_create(self, key, create_fn, metadata=None):
+    """Returns the entry `key`. Calls `create_fn` if the entry doesn't exist.
+
+    Args:
+      key: Cache key as returned by `key()`.
+      create_fn: Function without arguments that returns a dictionary
+        mapping names to NumPy arrays.
+      metadata: Optional JSON serializable dictionary stored with the entry.
+
+    Returns:
+      Dictionary mapping names to NumPy arrays (read-only memory maps).
+    """
+    if self.contains(key):
+      logging.info("Found entry %s in evaluation cache %s.", key,
+                   self._cache_dir)
+      return self.load(key)
+    with self.lock(key):
+      # Check again, another process might have created the entry while we
+      # were waiting for the lock.
+      if not self.contains(key):
+        logging.info("Creating entry %s in evaluation cache %s.", key,
+                     self._cache_dir)
+        self.save(key, create_fn(), metadata=metadata)
+    return self.load(key)
@@ -0,0 +1,74 @@
+# coding=utf-8
+# Copyright 2018 Google LLC & Hwalsuk Lee.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the evaluation cache."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+from compare_gan import eval_cache
+
+import gin
+import numpy as np
+import tensorflow as tf
+
+
+class EvalCacheTest(tf.test.TestCase):
+
+  def setUp(self):
+    super(EvalCacheTest, self).setUp()
+    gin.clear_config()
+    self.cache_dir = os.path.join(self.get_temp_dir(), self.id())
+
+  def testDisabledByDefault(self):
+    self.assertIsNone(eval_cache.get_eval_cache())
+
+  def testKeyIsIndependentOfArgumentOrder(self):
+    cache = eval_cache.EvalCache(self.cache_dir)
+    self.assertEqual(cache.key(a=1, b="x"), cache.key(b="x", a=1))
+    self.assertNotEqual(cache.key(a=1, b="x"), cache.key(a=2, b="x"))
+
+  def testGetOrCreateComputesOnce(self):
+    gin.bind_parameter("eval_cache.cache_dir", self.cache_dir)
+    cache = eval_cache.get_eval_cache()
+    calls = []
+    def create_fn():
+      calls.append(1)
+      return {"activations": np.arange(12, dtype=np.float32).reshape(3, 4)}
+    key = cache.key(dataset="cifar10", num_examples=3)
+    for _ in range(2):
+      entry = cache.get_or_create(key, create_fn)
+      self.assertAllEqual(entry["activations"],
+                          np.arange(12).reshape(3, 4))
+      self.assertIsInstance(entry["activations"], np.memmap)
+    self.assertEqual(len(calls), 1)
+    # A new cache object for the same directory also finds the entry.
+    self.assertTrue(eval_cache.EvalCache(self.cache_dir).contains(key))
+
+  def testFailedCreateDoesNotLeaveEntry(self):
+    cache = eval_cache.EvalCache(self.cache_dir)
+    key = cache.key(dataset="cifar10")
+    def create_fn():
+      raise ValueError("Failed to compute features.")
+    with self.assertRaises(ValueError):
+      cache.get_or_create(key, create_fn)
+    self.assertFalse(cache.contains(key))
+
+
+if __name__ == "__main__":
+  tf.test.main()
@@ -19,16 +19,24 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
+import multiprocessing.pool
 import os
+import time
+
 from absl import flags
 from absl import logging
 
 from compare_gan import datasets
+from compare_gan import eval_cache
+from compare_gan import eval_telemetry
 from compare_gan import eval_utils
 from compare_gan import utils
+from compare_gan.metrics import eval_task
 
 import gin
 import numpy as np
+import six
 from six.moves import range
 import tensorflow as tf
 
@@ -39,10 +47,19 @@ FLAGS = flags.FLAGS
 # Special value returned when a fake image generated by a GAN has NaNs.
 NAN_DETECTED = 31337.0
 
+# Gin bindings that change the real images used for evaluation. Their values
+# are part of the cache key for Inception features of the real images.
+_REAL_DATA_GIN_BINDINGS = ("eval_imagenet_transform.crop_method",)
+
+# Seeds of the stateless random ops for the latent variables and labels of the
+# generator. See `GeneratorEvaluator._build_graph()`.
+_Z_SEED = 42
+_LABELS_SEED = 43
+
 
-@gin.configurable("eval_z", blacklist=["shape", "name"])
+@gin.configurable("eval_z", blacklist=["shape", "seed", "name"])
 def z_generator(shape, distribution_fn=tf.random.uniform,
-                minval=-1.0, maxval=1.0, stddev=1.0, name=None):
+                minval=-1.0, maxval=1.0, stddev=1.0, seed=None, name=None):
   """Random noise distributions as TF op.
 
   Args:
@@ -52,161 +69,852 @@ def z_generator(shape, distribution_fn=tf.random.uniform,
     minval: The lower bound on the range of random values to generate.
     maxval: The upper bound on the range of random values to generate.
     stddev: The standard deviation of a normal distribution.
+    seed: Optional int64 Tensor with shape [2]. If set the noise only depends
+      on the seed (using the stateless version of `distribution_fn`). This is
+      supported for tf.random.uniform and tf.random.normal.
     name: A name for the operation.
 
   Returns:
     Tensor with the given shape and dtype tf.float32.
   """
+  if seed is not None:
+    if distribution_fn is tf.random.uniform:
+      return tf.add(minval, (maxval - minval) *
+                    tf.random.stateless_uniform(shape, seed), name=name)
+    if distribution_fn is tf.random.normal:
+      return tf.multiply(stddev, tf.random.stateless_normal(shape, seed),
+                         name=name)
+    logging.warning("%s has no stateless version. The noise is different for "
+                    "every evaluation.", distribution_fn)
   return utils.call_with_accepted_args(
       distribution_fn, shape=shape, minval=minval, maxval=maxval,
       stddev=stddev, name=name)
 
 
-def _update_bn_accumulators(sess, generated, num_accu_examples):
+def _get_bn_accumulator_switches():
+  return [v for v in tf.global_variables() if "accu/update_accus" in v.name]
+
+
+def _get_bn_accumulator_variables():
+  return [v for v in tf.global_variables() if "accu/accu_" in v.name]
+
+
+def _build_bn_accumulation_loop(sample_fn):
+  """Creates an in-graph loop that samples from the generator repeatedly.
+
+  Running the loop while the accumulators are switched on fills the
+  accumulators for `num_steps` batches with a single session run.
+
+  Args:
+    sample_fn: Function without arguments that creates the graph for sampling
+      a batch from the generator. Must not create any variables.
+
+  Returns:
+    Tuple (num_steps, loop). `num_steps` is a scalar int32 placeholder for the
+    number of batches and `loop` the output tensor of the loop.
+  """
+  num_steps = tf.placeholder(tf.int32, shape=[], name="num_accu_steps")
+  def body(i):
+    generated = sample_fn()
+    with tf.control_dependencies([generated]):
+      return i + 1
+  loop = tf.while_loop(
+      lambda i: i < num_steps, body, [tf.constant(0)],
+      parallel_iterations=1, back_prop=False)
+  return num_steps, loop
+
+
+def _update_bn_accumulators(sess, generated, num_accu_examples,
+                            accumulation_loop=None, examples_per_run=6400):
   """Returns True if the accumlators for batch norm were updated.
 
   Args:
     sess: `tf.Session` object. Checkpoint should already be loaded.
     generated: Output tensor of the generator.
     num_accu_examples: How many examples should be used to update accumulators.
+    accumulation_loop: Optional tuple as returned by
+      `_build_bn_accumulation_loop()`. If None `generated` is evaluated once
+      per batch.
+    examples_per_run: Number of examples per session run when using
+      `accumulation_loop`.
 
   Returns:
     True if there were accumlators.
   """
   # Create update ops for batch statistic updates for each batch normalization
   # with accumlators.
-  update_accu_switches = [v for v in tf.global_variables()
-                          if "accu/update_accus" in v.name]
+  update_accu_switches = _get_bn_accumulator_switches()
   logging.info("update_accu_switches: %s", update_accu_switches)
   if not update_accu_switches:
     return False
   sess.run([tf.assign(v, 1) for v in update_accu_switches])
   batch_size = generated.shape[0].value
   num_batches = num_accu_examples // batch_size
-  for i in range(num_batches):
-    if i % 500 == 0:
+  if accumulation_loop is None:
+    for i in range(num_batches):
+      if i % 500 == 0:
+        logging.info("Updating BN accumulators %d/%d steps.", i, num_batches)
+      sess.run(generated)
+  else:
+    num_steps, loop = accumulation_loop
+    steps_per_run = max(1, examples_per_run // batch_size)
+    for i in range(0, num_batches, steps_per_run):
       logging.info("Updating BN accumulators %d/%d steps.", i, num_batches)
-    sess.run(generated)
+      sess.run(loop, {num_steps: min(steps_per_run, num_batches - i)})
   sess.run([tf.assign(v, 0) for v in update_accu_switches])
   logging.info("Done updating BN accumulators.")
   return True
 
 
-def evaluate_tfhub_module(module_spec, eval_tasks, use_tpu,
-                          num_averaging_runs):
-  """Evaluate model at given checkpoint_path.
+def _save_bn_accumulators(sess, path):
+  """Writes the values of all batch norm accumulators to `path`."""
+  variables = _get_bn_accumulator_variables()
+  values = sess.run(variables)
+  arrays = {"names": np.array([v.op.name for v in variables])}
+  for i, value in enumerate(values):
+    arrays["value_{}".format(i)] = value
+  buf = six.BytesIO()
+  np.savez(buf, **arrays)
+  tmp_path = "{}.tmp{}".format(path, os.getpid())
+  with tf.gfile.Open(tmp_path, "wb") as f:
+    f.write(buf.getvalue())
+  tf.gfile.Rename(tmp_path, path, overwrite=True)
+  logging.info("Saved %d batch norm accumulators to %s.", len(variables), path)
+
+
+def _load_bn_accumulators(sess, path):
+  """Loads the batch norm accumulators written by `_save_bn_accumulators()`."""
+  with tf.gfile.Open(path, "rb") as f:
+    arrays = np.load(six.BytesIO(f.read()))
+    names = [str(name) for name in arrays["names"]]
+    values = [arrays["value_{}".format(i)] for i in range(len(names))]
+  variables = {v.op.name: v for v in _get_bn_accumulator_variables()}
+  if sorted(names) != sorted(variables):
+    raise ValueError("Batch norm accumulators in %s don't match the graph: "
+                     "%s vs. %s" % (path, names, sorted(variables)))
+  for name, value in zip(names, values):
+    variables[name].load(value, sess)
+  logging.info("Loaded %d batch norm accumulators from %s.", len(names), path)
+
+
+@gin.configurable("bn_accumulators",
+                  whitelist=["num_accu_examples", "examples_per_run"])
+def _prepare_bn_accumulators(sess, generated, accumulation_loop, sidecar_prefix,
+                             num_accu_examples=204800, examples_per_run=6400,
+                             telemetry=None):
+  """Fills the batch norm accumulators of the generator (if it has any).
+
+  The accumulated moments are stored in a small sidecar file next to the
+  checkpoint (or module). Later evaluations of the same checkpoint load them
+  instead of running the generator again.
+
+  Args:
+    sess: `tf.Session` object. Checkpoint should already be loaded.
+    generated: Output tensor of the generator.
+    accumulation_loop: See `_update_bn_accumulators()`.
+    sidecar_prefix: Path prefix for the sidecar file. If None the accumulators
+      are always recomputed.
+    num_accu_examples: How many examples should be used to update accumulators.
+    examples_per_run: Number of examples per session run when using an
+      in-graph loop.
+    telemetry: Optional `EvalTelemetry` to record the time as stage
+      "bn_accumulation".
+
+  Returns:
+    True if there were accumlators.
+  """
+  if not _get_bn_accumulator_switches():
+    return False
+  with eval_telemetry.stage(telemetry, "bn_accumulation"):
+    _fill_bn_accumulators(sess, generated, accumulation_loop, sidecar_prefix,
+                          num_accu_examples, examples_per_run)
+  return True
+
+
+def _fill_bn_accumulators(sess, generated, accumulation_loop, sidecar_prefix,
+                          num_accu_examples, examples_per_run):
+  """Loads or computes the accumulators. See `_prepare_bn_accumulators()`."""
+  sidecar_path = None
+  if sidecar_prefix is not None:
+    sidecar_path = "{}-{}.npz".format(sidecar_prefix, num_accu_examples)
+    if tf.gfile.Exists(sidecar_path):
+      _load_bn_accumulators(sess, sidecar_path)
+      return
+  _update_bn_accumulators(
+      sess, generated, num_accu_examples=num_accu_examples,
+      accumulation_loop=accumulation_loop, examples_per_run=examples_per_run)
+  if sidecar_path is not None:
+    _save_bn_accumulators(sess, sidecar_path)
+
+
+def _compute_real_features(dataset, num_examples, batch_size,
+                           dtype=np.float32):
+  """Returns a dictionary with Inception features for real images."""
+  images = eval_utils.get_real_images(
+      dataset=dataset, num_examples=num_examples, dtype=dtype)
+  logging.info("Getting Inception features for real images.")
+  activations, logits = eval_utils.inception_transform_np(images, batch_size)
+  activations64 = activations.astype(np.float64)
+  return {
+      "activations": activations,
+      "logits": logits,
+      "mean": np.mean(activations64, axis=0),
+      "cov": np.cov(activations64, rowvar=False),
+  }
+
+
+def _get_real_dset(dataset, num_examples, batch_size, dtype=np.float32,
+                   keep_images=False, keep_activations=True, keep_logits=True):
+  """Returns an `EvalDataSample` with Inception features for real images.
+
+  If the evaluation cache is enabled the features are read from the cache
+  (and computed once if missing). The moments of the activations are always
+  set.
+
+  Args:
+    dataset: `ImageDataset` object.
+    num_examples: Number of real images to use.
+    batch_size: Batch size for computing the Inception features.
+    dtype: Data type of the real images, np.float32 or np.uint8.
+    keep_images: Whether the sample should contain the real images.
+    keep_activations: Whether the sample should contain the Inception
+      activations of all real images.
+    keep_logits: Whether the sample should contain the Inception logits of all
+      real images.
+
+  Returns:
+    `EvalDataSample` for the real images.
+  """
+  cache = eval_cache.get_eval_cache()
+  if cache is None:
+    images = eval_utils.get_real_images(
+        dataset=dataset, num_examples=num_examples, dtype=dtype)
+    logging.info("Getting Inception features for real images.")
+    real_dset = eval_utils.build_eval_data_sample(
+        eval_utils.inception_transform_batches(
+            images[start:start + batch_size]
+            for start in range(0, num_examples, batch_size)),
+        num_examples=num_examples,
+        max_images=0,
+        keep_features=keep_activations,
+        keep_logits=keep_logits)
+    if keep_images:
+      real_dset.images = images
+    return real_dset
+
+  key_values = dict(
+      kind="real_inception_features",
+      dataset=dataset.name,
+      split=str(dataset.eval_split),
+      num_examples=num_examples,
+      gin_bindings=eval_cache.get_gin_bindings(_REAL_DATA_GIN_BINDINGS),
+      inception_graph=eval_utils.get_inception_graph_hash())
+  if dtype != np.float32:
+    # Keep the keys of existing float32 entries unchanged.
+    key_values["dtype"] = np.dtype(dtype).name
+  key = cache.key(**key_values)
+  entry = cache.get_or_create(
+      key,
+      lambda: _compute_real_features(dataset, num_examples, batch_size, dtype),
+      metadata=key_values)
+  real_dset = eval_utils.EvalDataSample(None)
+  if keep_images:
+    real_dset.images = eval_utils.get_real_images(
+        dataset=dataset, num_examples=num_examples, dtype=dtype)
+  real_dset.set_inception_features(
+      activations=entry["activations"] if keep_activations else None,
+      logits=entry["logits"] if keep_logits else None)
+  real_dset.set_moments(mean=entry["mean"], cov=entry["cov"])
+  real_dset.set_num_examples(num_examples)
+  return real_dset
+
+
+# What `GeneratorEvaluator` samples, featurizes and keeps for a list of tasks.
+#   num_averaging_runs: Number of fake data sets.
+#   num_examples: Number of examples per fake data set and of real examples.
+#   max_fake_images: Number of generated images kept for the first fake data
+#     set, None for all and 0 for none. The other fake data sets keep no
+#     images.
+#   keep_fake_activations: Whether the fake data sets keep the activations.
+#   keep_fake_logits: Whether the fake data sets keep the logits.
+#   keep_real_images: Whether the real data set keeps the images.
+#   keep_real_activations: Whether the real data set keeps the activations.
+#   keep_real_logits: Whether the real data set keeps the logits.
+EvalPlan = collections.namedtuple("EvalPlan", [
+    "num_averaging_runs", "num_examples", "max_fake_images",
+    "keep_fake_activations", "keep_fake_logits", "keep_real_images",
+    "keep_real_activations", "keep_real_logits"])
+
+
+def plan_evaluation(eval_tasks, num_averaging_runs, num_examples,
+                    max_fake_images=None):
+  """Returns the minimal `EvalPlan` for the requirements of `eval_tasks`.
 
   Args:
-    module_spec: string, path to a TF hub module.
     eval_tasks: List of objects that inherit from EvalTask.
-    use_tpu: Whether to use TPUs.
-    num_averaging_runs: Determines how many times each metric is computed.
+    num_averaging_runs: Number of fake data sets.
+    num_examples: Number of examples per data set.
+    max_fake_images: Optional upper bound for the number of generated images
+      that are kept.
 
   Returns:
-    Dict[Text, float] with all the computed results.
+    `EvalPlan`.
 
   Raises:
-    NanFoundError: If generator output has any NaNs.
+    ValueError: If a task needs the generator in a session.
   """
-  # Make sure that the same latent variables are used for each evaluation.
-  np.random.seed(42)
-  dataset = datasets.get_dataset()
-  num_test_examples = dataset.eval_test_samples
+  in_session_tasks = [t for t in eval_tasks if t.requirements().in_session]
+  if in_session_tasks:
+    raise ValueError("Tasks that run in the session of the generator are not "
+                     "supported: %s" % in_session_tasks)
+  requirements = eval_task.combine_requirements(
+      t.requirements() for t in eval_tasks)
+  if requirements.fake_images:
+    num_images = [n for n in [requirements.num_fake_images, max_fake_images]
+                  if n is not None]
+    max_fake_images = min(num_images) if num_images else None
+  else:
+    max_fake_images = 0
+  return EvalPlan(
+      num_averaging_runs=num_averaging_runs,
+      num_examples=num_examples,
+      max_fake_images=max_fake_images,
+      keep_fake_activations=requirements.fake_activations,
+      keep_fake_logits=requirements.fake_logits,
+      keep_real_images=requirements.real_images,
+      keep_real_activations=requirements.real_activations,
+      keep_real_logits=requirements.real_logits)
 
-  batch_size = 64
-  num_batches = int(np.ceil(num_test_examples / batch_size))
 
-  # Load and update the generator.
-  result_dict = {}
-  fake_dsets = []
-  with tf.Graph().as_default():
-    tf.set_random_seed(42)
-    with tf.Session() as sess:
-      if use_tpu:
-        sess.run(tf.contrib.tpu.initialize_system())
-      def sample_from_generator():
-        """Create graph for sampling images."""
-        generator = hub.Module(
-            module_spec,
-            name="gen_module",
-            tags={"gen", "bs{}".format(batch_size)})
-        logging.info("Generator inputs: %s", generator.get_input_info_dict())
-        z_dim = generator.get_input_info_dict()["z"].get_shape()[1].value
-        z = z_generator(shape=[batch_size, z_dim])
-        if "labels" in generator.get_input_info_dict():
-          # Conditional GAN.
-          assert dataset.num_classes
-          labels = tf.random.uniform(
-              [batch_size], maxval=dataset.num_classes, dtype=tf.int32)
-          inputs = dict(z=z, labels=labels)
-        else:
-          # Unconditional GAN.
-          assert "labels" not in generator.get_input_info_dict()
-          inputs = dict(z=z)
-        return generator(inputs=inputs, as_dict=True)["generated"]
-      if use_tpu:
-
-        generated = tf.contrib.tpu.rewrite(sample_from_generator)
-      else:
-        generated = sample_from_generator()
-
-      tf.global_variables_initializer().run()
-
-
-      if _update_bn_accumulators(sess, generated, num_accu_examples=204800):
-        saver = tf.train.Saver()
-        save_path = os.path.join(module_spec, "model-with-accu.ckpt")
-        checkpoint_path = saver.save(
-            sess,
-            save_path=save_path)
-        logging.info("Exported generator with accumulated batch stats to "
-                     "%s.", checkpoint_path)
-      if not eval_tasks:
-        logging.error("Task list is empty, returning.")
+def _log_plan(plan, eval_tasks):
+  """Logs what will be computed and kept for `plan`."""
+  if plan.max_fake_images is None:
+    fake_images = "all"
+  else:
+    fake_images = str(plan.max_fake_images)
+  def kept(keep):
+    return "kept" if keep else "statistics only"
+  logging.info(
+      "Evaluation plan for tasks %s:\n"
+      "  fake data sets: %d x %d examples\n"
+      "  fake images kept (first data set): %s\n"
+      "  fake activations: %s\n"
+      "  fake logits: %s\n"
+      "  real images: %s\n"
+      "  real activations: %s\n"
+      "  real logits: %s",
+      eval_tasks, plan.num_averaging_runs, plan.num_examples, fake_images,
+      kept(plan.keep_fake_activations), kept(plan.keep_fake_logits),
+      "kept" if plan.keep_real_images else "not kept",
+      kept(plan.keep_real_activations), kept(plan.keep_real_logits))
+
+
+@gin.configurable("evaluate",
+                  whitelist=["streaming", "fused", "max_fake_images",
+                             "uint8_images", "adaptive_chunk_size",
+                             "adaptive_tolerance",
+                             "adaptive_time_budget_secs"])
+class GeneratorEvaluator(object):
+  """Computes the metrics of evaluation tasks for a generator.
+
+  The graph with the generator (including the EMA variables) and, if `fused`
+  is True, Inception is built once. `restore()` loads the weights of a
+  training checkpoint into the existing session. This allows to evaluate many
+  checkpoints without exporting a TF Hub module for each of them and without
+  rebuilding the graph.
+
+  With `adaptive_chunk_size` each fake data set grows in chunks until the
+  estimates of the tasks' convergence metrics (FID, IS and KID) converged,
+  the time budget is used up or `dataset.eval_test_samples` examples were
+  sampled. Checkpoints early in training are far from converged in quality
+  but their estimates converge quickly, so they are cheap to score. Scores of
+  adaptive evaluations are based on different numbers of examples. The number
+  of examples and the estimates extrapolated to infinitely many examples are
+  logged.
+  """
+
+  def __init__(self, module_spec, use_tpu, streaming=False, fused=False,
+               max_fake_images=None, uint8_images=False,
+               adaptive_chunk_size=None, adaptive_tolerance=0.01,
+               adaptive_time_budget_secs=None, telemetry=None):
+    """Creates a new `GeneratorEvaluator`.
+
+    Args:
+      module_spec: Path to a TF Hub module or a `hub.ModuleSpec`. If this is
+        a `hub.ModuleSpec` that was not exported the weights must be loaded
+        with `restore()` before calling `evaluate()`.
+      use_tpu: Whether to use TPUs.
+      streaming: If True compute the Inception features for each generated
+        batch right away instead of first materializing all fake images.
+        Generated images and Inception features are only kept if a task
+        requires them. Otherwise only their moments and Inception Score
+        statistics are accumulated.
+      fused: If True add the Inception network to the graph of the generator.
+        Each step only copies the Inception features (and the images if a task
+        requires them) to the host. Implies `streaming`.
+      max_fake_images: Only used if `streaming` is True. If not None keep at
+        most this many generated images (a uniform random sample). This bounds
+        the memory used for images independently of the number of samples.
+        Tasks can lower the bound further (see `EvalTask.requirements()`).
+      uint8_images: If True generated images are rounded to uint8 on the
+        device before they are copied to the host, and real and fake images
+        are kept as uint8. This needs 4x less host transfer and memory. The
+        Inception features are computed from the rounded images.
+      adaptive_chunk_size: If not None sample fake data sets adaptively and
+        check for convergence after every `adaptive_chunk_size` examples.
+        Implies `streaming`.
+      adaptive_tolerance: Relative tolerance for the error of the monitored
+        estimates (see `eval_utils.ConvergenceMonitor`).
+      adaptive_time_budget_secs: Optional time budget for sampling each fake
+        data set adaptively. Sampling stops after the first chunk that
+        exceeds it.
+      telemetry: Optional `EvalTelemetry` for building the graph and
+        preparing the batch norm accumulators of an exported module.
+    """
+    self._dataset = datasets.get_dataset()
+    self._use_tpu = use_tpu
+    self._adaptive_chunk_size = adaptive_chunk_size
+    self._adaptive_tolerance = adaptive_tolerance
+    self._adaptive_time_budget_secs = adaptive_time_budget_secs
+    self._streaming = streaming or fused or adaptive_chunk_size is not None
+    self._fused = fused
+    self._max_fake_images = max_fake_images
+    self._images_dtype = np.uint8 if uint8_images else np.float32
+    self._batch_size = 64
+    self._real_dset = None
+    self._real_dset_plan = None
+
+    self._graph = tf.Graph()
+    with self._graph.as_default():
+      with eval_telemetry.stage(telemetry, "build_graph"):
+        tf.set_random_seed(42)
+        self._sess = tf.Session()
+        if use_tpu:
+          self._sess.run(tf.contrib.tpu.initialize_system())
+        self._build_graph(module_spec)
+        self._sess.run(tf.global_variables_initializer())
+      if isinstance(module_spec, six.string_types):
+        self._reset_latents()
+        _prepare_bn_accumulators(
+            self._sess, self._generated, self._accumulation_loop,
+            sidecar_prefix=os.path.join(module_spec, "bn_accumulators"),
+            telemetry=telemetry)
+
+  def _build_graph(self, module_spec):
+    """Creates the ops for sampling from the generator."""
+    batch_size = self._batch_size
+    dataset = self._dataset
+    tags = {"gen", "bs{}".format(batch_size)}
+    if isinstance(module_spec, six.string_types):
+      module_spec = hub.load_module_spec(module_spec)
+    input_info = module_spec.get_input_info_dict(tags=tags)
+    z_dim = input_info["z"].get_shape()[1].value
+    conditional = "labels" in input_info
+    if conditional:
+      assert dataset.num_classes
+    # The latent variables and labels of the i-th batch only depend on i. The
+    # counter is reset before each evaluation (see `_reset_latents()`), so all
+    # checkpoints are evaluated with the same latent variables.
+    sample_counter = tf.Variable(
+        0, dtype=tf.int64, trainable=False, name="eval_sample_counter")
+    self._reset_latents_op = tf.assign(sample_counter, 0)
+    def sample_latents():
+      """Returns the inputs for the generator for the next batch."""
+      step = tf.assign_add(sample_counter, 1)
+      z = z_generator(shape=[batch_size, z_dim],
+                      seed=tf.stack([tf.constant(_Z_SEED, tf.int64), step]))
+      if not conditional:
+        return [z]
+      uniform = tf.random.stateless_uniform(
+          [batch_size], tf.stack([tf.constant(_LABELS_SEED, tf.int64), step]))
+      labels = tf.minimum(tf.cast(uniform * dataset.num_classes, tf.int32),
+                          dataset.num_classes - 1)
+      return [z, labels]
+    generators = []
+    def create_generator():
+      generator = hub.Module(module_spec, name="gen_module", tags=tags)
+      logging.info("Generator inputs: %s", generator.get_input_info_dict())
+      generators.append(generator)
+      return generator
+    def sample_from_generator(generator, latents):
+      """Create graph for sampling images."""
+      inputs = dict(zip(["z", "labels"], latents))
+      return generator(inputs=inputs, as_dict=True)["generated"]
+    self._accumulation_loop = None
+    if self._use_tpu:
+      # The latent variables are sampled on the host. The accumulators are
+      # updated by sampling batch by batch.
+      self._generated = tf.contrib.tpu.rewrite(
+          lambda *latents: sample_from_generator(create_generator(), latents),
+          inputs=sample_latents())
+    else:
+      generator = create_generator()
+      self._generated = sample_from_generator(generator, sample_latents())
+      if _get_bn_accumulator_switches():
+        self._accumulation_loop = _build_bn_accumulation_loop(
+            lambda: sample_from_generator(generator, sample_latents()))
+    generated = (self._generated[0] if isinstance(self._generated, list)
+                 else self._generated)
+    uint8_images = self._images_dtype == np.uint8
+    self._fused_outputs = None
+    if self._fused:
+      # With TPUs only the generator runs on the TPU, Inception on the host.
+      self._fused_outputs = eval_utils.inception_transform_generated(
+          generated, quantize=uint8_images)
+    self._quantized = None
+    if uint8_images and not self._fused:
+      self._quantized = eval_utils.quantize_generated(generated)
+    # Variables of the generator (including EMA variables) as named in the
+    # training checkpoints.
+    self._saver = tf.train.Saver(var_list=generators[0].variable_map)
+
+  def _reset_latents(self):
+    """Starts the sequence of latent variables and labels from the beginning."""
+    self._sess.run(self._reset_latents_op)
+
+  def restore(self, checkpoint_path, telemetry=None):
+    """Loads the generator weights from a training checkpoint.
+
+    The batch norm accumulators are filled afterwards (or loaded from a sidecar
+    file next to the checkpoint).
+
+    Args:
+      checkpoint_path: Path to a checkpoint written during training.
+      telemetry: Optional `EvalTelemetry` to record the stages.
+    """
+    with self._graph.as_default():
+      logging.info("Restoring generator weights from %s.", checkpoint_path)
+      with eval_telemetry.stage(telemetry, "restore"):
+        self._saver.restore(self._sess, checkpoint_path)
+      self._reset_latents()
+      _prepare_bn_accumulators(
+          self._sess, self._generated, self._accumulation_loop,
+          sidecar_prefix=checkpoint_path + ".bn_accumulators",
+          telemetry=telemetry)
+
+  def _sample_adaptively(self, featurized_batches, builder, eval_tasks,
+                         real_dset):
+    """Adds featurized batches to `builder` until the estimates converged.
+
+    Args:
+      featurized_batches: Iterable of tuples (images, activations, logits).
+      builder: `EvalDataSampleBuilder` for the fake data set.
+      eval_tasks: List of objects that inherit from EvalTask. Tasks with a
+        convergence metric are monitored.
+      real_dset: `EvalDataSample` with real images.
+    """
+    monitors = [(task, eval_utils.ConvergenceMonitor(self._adaptive_tolerance))
+                for task in eval_tasks if task.convergence_metric() is not None]
+    if not monitors:
+      logging.warning("No task has a convergence metric. Sampling all "
+                      "examples.")
+    start_time = time.time()
+    next_check = self._adaptive_chunk_size
+    for batch in featurized_batches:
+      builder.add(*batch)
+      if builder.is_full:
+        logging.info("Sampled all %d examples.", builder.num_examples)
+        return
+      if not monitors or builder.num_examples < next_check:
+        continue
+      next_check += self._adaptive_chunk_size
+      snapshot = builder.snapshot()
+      for task, monitor in monitors:
+        if builder.num_examples < task.convergence_min_examples(real_dset):
+          continue
+        metric = task.convergence_metric()
+        monitor.add(builder.num_examples,
+                    task.run_after_session(snapshot, real_dset)[metric])
+        logging.info("Adaptive estimate of %s after %d examples: %s "
+                     "(extrapolated: %s, error: %s).", metric,
+                     builder.num_examples, monitor.value,
+                     monitor.extrapolated_value, monitor.error)
+      if all(monitor.has_converged() for _, monitor in monitors):
+        logging.info("Estimates converged after %d examples.",
+                     builder.num_examples)
         return
-      for i in range(num_averaging_runs):
-        logging.info("Generating fake data set %d/%d.", i+1, num_averaging_runs)
-        fake_dset = eval_utils.EvalDataSample(
-            eval_utils.sample_fake_dataset(sess, generated, num_batches))
+      elapsed_secs = time.time() - start_time
+      if (self._adaptive_time_budget_secs is not None and
+          elapsed_secs >= self._adaptive_time_budget_secs):
+        logging.info("Time budget of %.1f seconds used up after %d examples.",
+                     self._adaptive_time_budget_secs, builder.num_examples)
+        return
+
+  def _generate_fake_dsets(self, plan, eval_tasks, real_dset, telemetry):
+    """Returns a list of `EvalDataSample`s with generated images."""
+    num_averaging_runs = plan.num_averaging_runs
+    num_test_examples = plan.num_examples
+    num_batches = int(np.ceil(num_test_examples / self._batch_size))
+    fake_dsets = []
+    for i in range(num_averaging_runs):
+      # Only the first fake data set keeps images.
+      max_images = plan.max_fake_images if i == 0 else 0
+      if self._streaming:
+        logging.info("Generating fake data set %d/%d and computing its "
+                     "inception features.", i+1, num_averaging_runs)
+        if self._fused:
+          featurized_batches = eval_utils.generate_featurized_batches(
+              self._sess, self._fused_outputs, num_batches,
+              fetch_images=max_images != 0)
+        elif self._quantized is not None:
+          featurized_batches = eval_utils.inception_transform_batches(
+              eval_utils.generate_quantized_batches(
+                  self._sess, self._quantized, num_batches))
+        else:
+          featurized_batches = eval_utils.inception_transform_batches(
+              eval_utils.generate_fake_batches(
+                  self._sess, self._generated, num_batches))
+        # Sampling and computing the features are interleaved.
+        with eval_telemetry.stage(telemetry, "fake_sampling"):
+          if self._adaptive_chunk_size is None:
+            fake_dset = eval_utils.build_eval_data_sample(
+                featurized_batches,
+                num_examples=num_test_examples,
+                max_images=max_images,
+                keep_features=plan.keep_fake_activations,
+                keep_logits=plan.keep_fake_logits)
+          else:
+            builder = eval_utils.EvalDataSampleBuilder(
+                num_test_examples,
+                max_images=max_images,
+                keep_features=plan.keep_fake_activations,
+                keep_logits=plan.keep_fake_logits)
+            self._sample_adaptively(
+                featurized_batches, builder, eval_tasks, real_dset)
+            fake_dset = builder.build()
         fake_dsets.append(fake_dset)
-        logging.info("Computing inception features for generated data %d/%d.",
-                     i+1, num_averaging_runs)
-        activations, logits = eval_utils.inception_transform_np(
-            fake_dset.images, batch_size)
-        fake_dset.set_inception_features(
-            activations=activations, logits=logits)
-        fake_dset.set_num_examples(num_test_examples)
-        if i != 0:
-          # Free up some memory by releasing additional fake data samples.
-          # For ImageNet128 50k images are ~9 GiB. This will blow up metrics
-          # (such as fractal dimension) if num_averaging_runs > 1.
-          fake_dset.discard_images()
-
-  real_dset = eval_utils.EvalDataSample(
-      eval_utils.get_real_images(
-          dataset=dataset, num_examples=num_test_examples))
-  logging.info("Getting Inception features for real images.")
-  real_dset.activations, _ = eval_utils.inception_transform_np(
-      real_dset.images, batch_size)
-  real_dset.set_num_examples(num_test_examples)
+        continue
+      logging.info("Generating fake data set %d/%d.", i+1, num_averaging_runs)
+      with eval_telemetry.stage(telemetry, "fake_sampling"):
+        images = eval_utils.sample_fake_dataset(
+            self._sess, self._generated, num_batches,
+            quantized=self._quantized)
+      logging.info("Computing inception features for generated data %d/%d.",
+                   i+1, num_averaging_runs)
+      with eval_telemetry.stage(telemetry, "fake_featurization"):
+        fake_dset = eval_utils.build_eval_data_sample(
+            eval_utils.inception_transform_batches(
+                images[start:start + self._batch_size]
+                for start in range(0, num_test_examples, self._batch_size)),
+            num_examples=num_test_examples,
+            max_images=0,
+            keep_features=plan.keep_fake_activations,
+            keep_logits=plan.keep_fake_logits)
+      # Only keep the images that the tasks read. For ImageNet128 50k images
+      # are ~9 GiB.
+      if max_images is None:
+        fake_dset.images = images[:num_test_examples]
+      elif max_images > 0:
+        # Copy the slice so that the other images are freed.
+        fake_dset.images = images[:min(max_images, num_test_examples)].copy()
+      fake_dsets.append(fake_dset)
+    return fake_dsets
+
+  def generate(self, eval_tasks, num_averaging_runs, telemetry=None):
+    """Samples from the generator and computes the Inception features.
+
+    This is the part of `evaluate()` that requires the session and the current
+    weights.
+
+    Args:
+      eval_tasks: List of objects that inherit from EvalTask.
+      num_averaging_runs: Number of fake data sets to generate.
+      telemetry: Optional `EvalTelemetry` to record the stages. The time spent
+        in the Inception featurizer is recorded as "inception_featurization"
+        (this overlaps with the sampling stages when streaming).
+
+    Returns:
+      Tuple (fake_dsets, real_dset) with a list of `num_averaging_runs`
+      `EvalDataSample`s for generated images and the `EvalDataSample` for
+      real images. See `compute_task_results()`.
+
+    Raises:
+      NanFoundError: If generator output has any NaNs.
+    """
+    plan = plan_evaluation(
+        eval_tasks, num_averaging_runs,
+        num_examples=self._dataset.eval_test_samples,
+        max_fake_images=self._max_fake_images if self._streaming else None)
+    _log_plan(plan, eval_tasks)
+    featurizer = eval_utils.get_inception_featurizer()
+    featurizer_secs = featurizer.get_stats()["total_time_secs"]
+    # The real data set is needed first to monitor adaptive evaluations.
+    real_dset_plan = (plan.num_examples, plan.keep_real_images,
+                      plan.keep_real_activations, plan.keep_real_logits)
+    if self._real_dset is None or self._real_dset_plan != real_dset_plan:
+      with eval_telemetry.stage(telemetry, "real_loading"):
+        self._real_dset = _get_real_dset(
+            self._dataset, plan.num_examples, self._batch_size,
+            dtype=self._images_dtype,
+            keep_images=plan.keep_real_images,
+            keep_activations=plan.keep_real_activations,
+            keep_logits=plan.keep_real_logits)
+      self._real_dset_plan = real_dset_plan
+    # Make sure that the same latent variables (and the same host-side random
+    # samples, e.g. of the kept images) are used for each evaluation.
+    self._reset_latents()
+    np.random.seed(42)
+    with self._graph.as_default():
+      fake_dsets = self._generate_fake_dsets(
+          plan, eval_tasks, self._real_dset, telemetry)
+    featurizer_stats = featurizer.get_stats()
+    logging.info("Inception featurizer stats: %s", featurizer_stats)
+    if telemetry is not None:
+      telemetry.add(
+          "inception_featurization",
+          wall_secs=featurizer_stats["total_time_secs"] - featurizer_secs)
+    return fake_dsets, self._real_dset
+
+  def evaluate(self, eval_tasks, num_averaging_runs, telemetry=None):
+    """Evaluates the generator with the current weights.
+
+    Args:
+      eval_tasks: List of objects that inherit from EvalTask.
+      num_averaging_runs: Determines how many times each metric is computed.
+      telemetry: Optional `EvalTelemetry` to record the stages.
+
+    Returns:
+      Dict[Text, float] with all the computed results.
+
+    Raises:
+      NanFoundError: If generator output has any NaNs.
+    """
+    if not eval_tasks:
+      logging.error("Task list is empty, returning.")
+      return
+    fake_dsets, real_dset = self.generate(
+        eval_tasks, num_averaging_runs, telemetry=telemetry)
+    return compute_task_results(
+        eval_tasks, fake_dsets, real_dset, telemetry=telemetry)
+
+  def close(self):
+    self._sess.close()
+
+
+def _get_task_runs(task, fake_dsets, real_dset):
+  """Returns functions that together compute the results of `task`.
+
+  Each function returns a list of result dictionaries. Concatenating their
+  outputs gives the results for `fake_dsets` in order. Tasks that override
+  `run_after_session_on_all()` to share work between the fake data sets are a
+  single run. Otherwise every fake data set is a run of its own.
+
+  Args:
+    task: Object that inherits from EvalTask.
+    fake_dsets: List of `EvalDataSample`s with generated images.
+    real_dset: `EvalDataSample` with real images.
+
+  Returns:
+    List of functions without arguments.
+  """
+  run_after_session_on_all = six.get_unbound_function(
+      type(task).run_after_session_on_all)
+  if run_after_session_on_all is not six.get_unbound_function(
+      eval_task.EvalTask.run_after_session_on_all):
+    return [lambda: task.run_after_session_on_all(fake_dsets, real_dset)]
+  return [lambda fake_dset=fake_dset: [task.run_after_session(fake_dset,
+                                                              real_dset)]
+          for fake_dset in fake_dsets]
+
+
+def _summarize_task_results(task_results_dicts):
+  """Returns the mean, std and list of the results for each key."""
+  result_statistics = {}
+  for key in task_results_dicts[0].keys():
+    scores_for_key = np.array([d[key] for d in task_results_dicts])
+    mean, std = np.mean(scores_for_key), np.std(scores_for_key)
+    scores_as_string = "_".join([str(x) for x in scores_for_key])
+    result_statistics[key + "_mean"] = mean
+    result_statistics[key + "_std"] = std
+    result_statistics[key + "_list"] = scores_as_string
+  return result_statistics
 
-  # Run all the tasks and update the result dictionary with the task statistics.
+
+@gin.configurable("compute_task_results", whitelist=["num_threads"])
+def compute_task_results(eval_tasks, fake_dsets, real_dset, num_threads=1,
+                         telemetry=None):
+  """Runs the evaluation tasks and averages their results.
+
+  This does not need the generator and can run concurrently with generating
+  samples for the next checkpoint.
+
+  With `num_threads` > 1 the tasks, and the runs of a task for the different
+  fake data sets, are executed concurrently. They share the (read-only)
+  images and Inception features of the data sets without copying them. The
+  NumPy and TensorFlow kernels doing the work release the GIL. Results are
+  merged in the order of `eval_tasks` and `fake_dsets`, so they don't depend
+  on the scheduling.
+
+  Args:
+    eval_tasks: List of objects that inherit from EvalTask.
+    fake_dsets: List of `EvalDataSample`s with generated images. Each task is
+      run for every element and the results are averaged.
+    real_dset: `EvalDataSample` with real images.
+    num_threads: Number of task runs to execute concurrently.
+    telemetry: Optional `EvalTelemetry`. Each task is recorded as stage
+      "task_<class name>".
+
+  Returns:
+    Dict[Text, float] with all the computed results.
+  """
+  task_indices = []
+  runs = []
+  for i, task in enumerate(eval_tasks):
+    task_runs = _get_task_runs(task, fake_dsets, real_dset)
+    task_indices.extend([i] * len(task_runs))
+    runs.extend(task_runs)
+
+  def execute(run_index):
+    stage_name = eval_telemetry.get_task_stage(
+        eval_tasks[task_indices[run_index]])
+    with eval_telemetry.stage(telemetry, stage_name):
+      return runs[run_index]()
+
+  if num_threads > 1 and len(runs) > 1:
+    logging.info("Running %d task runs with %d threads.", len(runs),
+                 num_threads)
+    pool = multiprocessing.pool.ThreadPool(min(num_threads, len(runs)))
+    try:
+      # map() returns the outputs in the order of `runs`.
+      outputs = pool.map(execute, range(len(runs)))
+    finally:
+      pool.close()
+  else:
+    outputs = [execute(i) for i in range(len(runs))]
+
+  # Update the result dictionary with the statistics of each task.
+  task_results_dicts = [[] for _ in eval_tasks]
+  for i, output in zip(task_indices, outputs):
+    task_results_dicts[i].extend(output)
   result_dict = {}
-  for task in eval_tasks:
-    task_results_dicts = [
-        task.run_after_session(fake_dset, real_dset)
-        for fake_dset in fake_dsets
-    ]
-    # Average the score for each key.
-    result_statistics = {}
-    for key in task_results_dicts[0].keys():
-      scores_for_key = np.array([d[key] for d in task_results_dicts])
-      mean, std = np.mean(scores_for_key), np.std(scores_for_key)
-      scores_as_string = "_".join([str(x) for x in scores_for_key])
-      result_statistics[key + "_mean"] = mean
-      result_statistics[key + "_std"] = std
-      result_statistics[key + "_list"] = scores_as_string
+  for task, results in zip(eval_tasks, task_results_dicts):
+    result_statistics = _summarize_task_results(results)
     logging.info("Computed results for task %s: %s", task, result_statistics)
-
     result_dict.update(result_statistics)
   return result_dict
+
+
+def evaluate_tfhub_module(module_spec, eval_tasks, use_tpu,
+                          num_averaging_runs):
+  """Evaluate model at given checkpoint_path.
+
+  Options for sampling and computing the Inception features are configured
+  for `GeneratorEvaluator`.
+
+  Args:
+    module_spec: string, path to a TF hub module.
+    eval_tasks: List of objects that inherit from EvalTask.
+    use_tpu: Whether to use TPUs.
+    num_averaging_runs: Determines how many times each metric is computed.
+
+  Returns:
+    Dict[Text, float] with all the computed results.
+
+  Raises:
+    NanFoundError: If generator output has any NaNs.
+  """
+  evaluator = GeneratorEvaluator(module_spec, use_tpu=use_tpu)
+  try:
+    return evaluator.evaluate(eval_tasks, num_averaging_runs)
+  finally:
+    evaluator.close()
@@ -29,15 +29,19 @@ from absl.testing import parameterized
 from compare_gan import datasets
 from compare_gan import eval_gan_lib
 from compare_gan import eval_utils
+from compare_gan.architectures import arch_ops
 from compare_gan.gans import consts as c
 from compare_gan.gans.modular_gan import ModularGAN
+from compare_gan.metrics import eval_task
 from compare_gan.metrics import fid_score
 from compare_gan.metrics import fractal_dimension
 from compare_gan.metrics import inception_score
+from compare_gan.metrics import kid_score
 from compare_gan.metrics import ms_ssim_score
 
 import gin
 import mock
+import numpy as np
 import tensorflow as tf
 
 FLAGS = flags.FLAGS
@@ -65,6 +69,34 @@ def create_fake_inception_graph():
   return fake_inception.as_graph_def()
 
 
+def _build_generator_with_accumulators():
+  """Returns a function that samples from a tiny generator with accumulators.
+
+  The i-th sample only depends on i, so accumulating the batch norm moments
+  gives the same result however the batches are split into session runs.
+  """
+  counter = tf.Variable(0, dtype=tf.int64, trainable=False, name="counter")
+  def sample_fn():
+    step = tf.assign_add(counter, 1)
+    z = tf.random.stateless_normal(
+        [8, 4], tf.stack([tf.constant(0, tf.int64), step]))
+    with tf.variable_scope("generator", reuse=tf.AUTO_REUSE):
+      mean, variance = tf.nn.moments(z, axes=[0])
+      mean, variance = arch_ops._accumulated_moments_for_inference(
+          mean, variance, is_training=False)
+    return (z - mean) / tf.sqrt(variance + 1e-3)
+  return sample_fn
+
+
+class _InSessionTask(eval_task.EvalTask):
+
+  def requirements(self):
+    return eval_task.EvalRequirements(in_session=True)
+
+  def run_after_session(self, fake_dset, real_dset):
+    raise NotImplementedError()
+
+
 class EvalGanLibTest(parameterized.TestCase, tf.test.TestCase):
 
   def setUp(self):
@@ -75,13 +107,8 @@ class EvalGanLibTest(parameterized.TestCase, tf.test.TestCase):
         eval_utils, "get_inception_graph_def").start()
     self.mock_get_graph.return_value = create_fake_inception_graph()
 
-  @parameterized.parameters(c.ARCHITECTURES)
-  @flagsaver.flagsaver
-  def test_end2end_checkpoint(self, architecture):
-    """Takes real GAN (trained for 1 step) and evaluate it."""
-    if architecture in {c.RESNET_STL_ARCH, c.RESNET30_ARCH}:
-      # RESNET_STL_ARCH and RESNET107_ARCH do not support CIFAR image shape.
-      return
+  def _export_module(self, architecture):
+    """Trains a GAN for 1 step and exports it as TF Hub module."""
     gin.bind_parameter("dataset.name", "cifar10")
     dataset = datasets.get_dataset("cifar10")
     options = {
@@ -103,7 +130,16 @@ class EvalGanLibTest(parameterized.TestCase, tf.test.TestCase):
     checkpoint_path = os.path.join(model_dir, "model.ckpt-1")
     module_spec = gan.as_module_spec()
     module_spec.export(export_path, checkpoint_path=checkpoint_path)
+    return export_path
 
+  @parameterized.parameters(c.ARCHITECTURES)
+  @flagsaver.flagsaver
+  def test_end2end_checkpoint(self, architecture):
+    """Takes real GAN (trained for 1 step) and evaluate it."""
+    if architecture in {c.RESNET_STL_ARCH, c.RESNET30_ARCH}:
+      # RESNET_STL_ARCH and RESNET107_ARCH do not support CIFAR image shape.
+      return
+    export_path = self._export_module(architecture)
     eval_tasks = [
         fid_score.FIDScoreTask(),
         fractal_dimension.FractalDimensionTask(),
@@ -119,6 +155,165 @@ class EvalGanLibTest(parameterized.TestCase, tf.test.TestCase):
         required_key = "%s_%s" % (score, stats)
         self.assertIn(required_key, result_dict, "Missing: %s." % required_key)
 
+  @parameterized.named_parameters([
+      ("Streaming", {"evaluate.streaming": True}),
+      ("StreamingWithBoundedImages", {"evaluate.streaming": True,
+                                      "evaluate.max_fake_images": 50}),
+      ("Fused", {"evaluate.fused": True}),
+      ("StreamingUint8", {"evaluate.streaming": True,
+                          "evaluate.uint8_images": True}),
+      ("FusedUint8", {"evaluate.fused": True, "evaluate.uint8_images": True}),
+      ("Adaptive", {"evaluate.adaptive_chunk_size": 256,
+                    "evaluate.adaptive_tolerance": 0.5}),
+  ])
+  @flagsaver.flagsaver
+  def test_end2end_checkpoint_streaming(self, bindings):
+    export_path = self._export_module(c.RESNET_CIFAR_ARCH)
+    for key, value in bindings.items():
+      gin.bind_parameter(key, value)
+    eval_tasks = [
+        fid_score.FIDScoreTask(),
+        fractal_dimension.FractalDimensionTask(),
+        inception_score.InceptionScoreTask(),
+    ]
+    result_dict = eval_gan_lib.evaluate_tfhub_module(
+        export_path, eval_tasks, use_tpu=False, num_averaging_runs=2)
+    tf.logging.info("result_dict: %s", result_dict)
+    for score in ["fid_score", "fractal_dimension", "inception_score"]:
+      for stats in ["mean", "std", "list"]:
+        required_key = "%s_%s" % (score, stats)
+        self.assertIn(required_key, result_dict, "Missing: %s." % required_key)
+
+  @parameterized.parameters(False, True)
+  @flagsaver.flagsaver
+  def test_generate_uses_same_latents(self, restore):
+    module_spec = self._export_module(c.RESNET_CIFAR_ARCH)
+    checkpoint_path = os.path.join(
+        os.path.dirname(module_spec), "model.ckpt-1")
+    eval_tasks = [ms_ssim_score.MultiscaleSSIMTask()]
+    evaluator = eval_gan_lib.GeneratorEvaluator(module_spec, use_tpu=False)
+    try:
+      if restore:
+        evaluator.restore(checkpoint_path)
+      fake_dsets, _ = evaluator.generate(eval_tasks, num_averaging_runs=1)
+      if restore:
+        evaluator.restore(checkpoint_path)
+      fake_dsets_again, _ = evaluator.generate(
+          eval_tasks, num_averaging_runs=1)
+    finally:
+      evaluator.close()
+    self.assertAllEqual(fake_dsets[0].images, fake_dsets_again[0].images)
+
+  def test_bn_accumulation_loop_matches_per_batch_updates(self):
+    sidecar_prefix = os.path.join(self.get_temp_dir(), "bn_accumulators")
+    accumulators = []
+    for use_loop in [False, True]:
+      with tf.Graph().as_default():
+        sample_fn = _build_generator_with_accumulators()
+        generated = sample_fn()
+        accumulation_loop = None
+        if use_loop:
+          accumulation_loop = eval_gan_lib._build_bn_accumulation_loop(
+              sample_fn)
+        variables = {v.op.name: v
+                     for v in eval_gan_lib._get_bn_accumulator_variables()}
+        with tf.Session() as sess:
+          sess.run(tf.global_variables_initializer())
+          # 10 batches in runs of 3, 3, 3 and 1 batches with the loop.
+          eval_gan_lib._prepare_bn_accumulators(
+              sess, generated, accumulation_loop,
+              sidecar_prefix=sidecar_prefix if use_loop else None,
+              num_accu_examples=80, examples_per_run=24)
+          accumulators.append(sess.run(variables))
+          # The second time the accumulators are loaded from the sidecar.
+          if use_loop:
+            sess.run(tf.global_variables_initializer())
+            eval_gan_lib._prepare_bn_accumulators(
+                sess, generated, accumulation_loop,
+                sidecar_prefix=sidecar_prefix,
+                num_accu_examples=80, examples_per_run=24)
+            accumulators.append(sess.run(variables))
+    self.assertTrue(tf.gfile.Exists(sidecar_prefix + "-80.npz"))
+    per_batch, in_graph, loaded = accumulators
+    self.assertEqual(sorted(per_batch), [
+        "generator/accu/accu_counter", "generator/accu/accu_mean",
+        "generator/accu/accu_variance"])
+    self.assertAllClose(per_batch["generator/accu/accu_counter"], 10.0)
+    for name, value in per_batch.items():
+      self.assertAllClose(in_graph[name], value)
+      self.assertAllClose(loaded[name], value)
+
+  def test_plan_evaluation_for_moments_only(self):
+    plan = eval_gan_lib.plan_evaluation(
+        [fid_score.FIDScoreTask(), inception_score.InceptionScoreTask()],
+        num_averaging_runs=3, num_examples=100)
+    self.assertEqual(plan, eval_gan_lib.EvalPlan(
+        num_averaging_runs=3, num_examples=100, max_fake_images=0,
+        keep_fake_activations=False, keep_fake_logits=False,
+        keep_real_images=False, keep_real_activations=False,
+        keep_real_logits=False))
+
+  def test_plan_evaluation_combines_requirements(self):
+    plan = eval_gan_lib.plan_evaluation(
+        [kid_score.KIDScoreTask(),
+         ms_ssim_score.MultiscaleSSIMTask(),
+         fractal_dimension.FractalDimensionTask(use_inception_features=True)],
+        num_averaging_runs=1, num_examples=100, max_fake_images=50)
+    self.assertEqual(plan.max_fake_images, 50)
+    self.assertTrue(plan.keep_fake_activations)
+    self.assertFalse(plan.keep_fake_logits)
+    self.assertFalse(plan.keep_real_images)
+    self.assertTrue(plan.keep_real_activations)
+    self.assertFalse(plan.keep_real_logits)
+
+  def test_plan_evaluation_rejects_in_session_tasks(self):
+    with self.assertRaises(ValueError):
+      eval_gan_lib.plan_evaluation(
+          [_InSessionTask()], num_averaging_runs=1, num_examples=100)
+
+  def test_compute_task_results_with_threads(self):
+    np.random.seed(0)
+    real_dset = eval_utils.EvalDataSample(None)
+    real_dset.set_inception_features(
+        activations=np.random.normal(size=(200, 10)), logits=None)
+    fake_dsets = []
+    for i in range(3):
+      fake_dset = eval_utils.EvalDataSample(None)
+      fake_dset.set_inception_features(
+          activations=np.random.normal(size=(200, 10)) * (1.0 + 0.1 * i),
+          logits=np.random.normal(size=(200, 5)))
+      fake_dsets.append(fake_dset)
+    eval_tasks = [
+        fid_score.FIDScoreTask(),
+        inception_score.InceptionScoreTask(),
+        fractal_dimension.FractalDimensionTask(use_inception_features=True),
+    ]
+    expected = eval_gan_lib.compute_task_results(
+        eval_tasks, fake_dsets, real_dset)
+    result = eval_gan_lib.compute_task_results(
+        eval_tasks, fake_dsets, real_dset, num_threads=4)
+    self.assertEqual(result, expected)
+    self.assertEqual(len(result["fid_score_list"].split("_")), 3)
+
+  def test_sample_adaptively_with_small_chunks(self):
+    np.random.seed(0)
+    real_dset = eval_utils.EvalDataSample(None)
+    real_dset.set_inception_features(
+        activations=np.random.normal(size=(2048, 10)), logits=None)
+    # KID with 2048 real examples needs at least 4 fake examples.
+    evaluator = eval_gan_lib.GeneratorEvaluator.__new__(
+        eval_gan_lib.GeneratorEvaluator)
+    evaluator._adaptive_chunk_size = 2
+    evaluator._adaptive_tolerance = 0.01
+    evaluator._adaptive_time_budget_secs = None
+    featurized_batches = [
+        (None, np.random.normal(size=(2, 10)), np.random.normal(size=(2, 5)))
+        for _ in range(10)]
+    builder = eval_utils.EvalDataSampleBuilder(20, max_images=0)
+    evaluator._sample_adaptively(
+        featurized_batches, builder, [kid_score.KIDScoreTask()], real_dset)
+    self.assertEqual(builder.num_examples, 20)
+
 
 if __name__ == "__main__":
   tf.test.main()
@@ -0,0 +1,214 @@
+# coding=utf-8
+# Copyright 2018 Google LLC & Hwalsuk Lee.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Timing and resource telemetry for the stages of an evaluation.
+
+An `EvalTelemetry` object records the wall time, CPU time and peak resident
+set size (RSS) of each stage of evaluating a checkpoint (e.g. exporting the
+module, updating batch norm accumulators, sampling, computing Inception
+features and running each task). `as_dict()` flattens the records into keys
+"telemetry/<stage>/<metric>" which are stored next to the scores of the
+checkpoint. `format_summary_table()` renders them for one or many
+checkpoints.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import contextlib
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import six
+
+try:
+  import resource  # pylint: disable=g-import-not-at-top
+except ImportError:
+  # Not available on Windows. Peak RSS is not recorded there.
+  resource = None
+
+
+_PREFIX = "telemetry/"
+_METRICS = ("wall_secs", "cpu_secs", "peak_rss_mib")
+
+# Stages recorded while evaluating a checkpoint. Passing them (and the stages
+# of the tasks, see `get_task_stage()`) to `EvalTelemetry` gives the same keys
+# for every checkpoint, even if some stages are skipped.
+EVAL_STAGES = (
+    "prepare", "export", "build_graph", "restore", "bn_accumulation",
+    "fake_sampling", "fake_featurization", "real_loading",
+    "inception_featurization", "score")
+
+
+def get_task_stage(task):
+  """Returns the name of the stage for running `task`."""
+  return "task_" + type(task).__name__
+
+
+def _get_cpu_secs():
+  """Returns the user and system CPU time of the process (all threads)."""
+  times = os.times()
+  return times[0] + times[1]
+
+
+def _get_peak_rss_mib():
+  """Returns the peak RSS of the process in MiB or None if unavailable."""
+  if resource is None:
+    return None
+  peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # ru_maxrss is in bytes on macOS and in KiB elsewhere.
+  if sys.platform == "darwin":
+    return peak_rss / 2.0**20
+  return peak_rss / 2.0**10
+
+
+class EvalTelemetry(object):
+  """Wall time, CPU time and peak RSS of the stages of an evaluation.
+
+  CPU time is measured for the whole process (including the threads of
+  TensorFlow), so stages that run concurrently include each other's CPU time.
+  Peak RSS is the high-water mark of the process at the end of the stage.
+  Stages that are recorded several times (e.g. a task that runs for several
+  fake data sets) accumulate wall and CPU time.
+
+  Stages can be recorded from several threads.
+  """
+
+  def __init__(self, stages=()):
+    """Creates a new `EvalTelemetry`.
+
+    Args:
+      stages: Names of stages that are always part of `as_dict()`. Metrics
+        that were not recorded for them are "".
+    """
+    self._lock = threading.Lock()
+    self._stages = collections.OrderedDict((name, {}) for name in stages)
+
+  def add(self, name, wall_secs, cpu_secs=None, peak_rss_mib=None):
+    """Adds a measurement for stage `name`.
+
+    Args:
+      name: Name of the stage.
+      wall_secs: Wall time in seconds.
+      cpu_secs: Optional CPU time in seconds.
+      peak_rss_mib: Optional peak RSS in MiB.
+    """
+    with self._lock:
+      stage = self._stages.setdefault(name, {})
+      stage["wall_secs"] = stage.get("wall_secs", 0.0) + wall_secs
+      if cpu_secs is not None:
+        stage["cpu_secs"] = stage.get("cpu_secs", 0.0) + cpu_secs
+      if peak_rss_mib is not None:
+        stage["peak_rss_mib"] = max(stage.get("peak_rss_mib", 0.0),
+                                    peak_rss_mib)
+
+  @contextlib.contextmanager
+  def stage(self, name):
+    """Context manager that records the code it wraps as stage `name`."""
+    start_time = time.time()
+    start_cpu_secs = _get_cpu_secs()
+    try:
+      yield
+    finally:
+      self.add(name,
+               wall_secs=time.time() - start_time,
+               cpu_secs=_get_cpu_secs() - start_cpu_secs,
+               peak_rss_mib=_get_peak_rss_mib())
+
+  def as_dict(self):
+    """Returns the measurements as dictionary "telemetry/<stage>/<metric>".
+
+    Every stage has all metrics. Metrics that were not recorded are "".
+    """
+    with self._lock:
+      return {
+          "{}{}/{}".format(_PREFIX, name, metric): stage.get(metric, "")
+          for name, stage in six.iteritems(self._stages)
+          for metric in _METRICS
+      }
+
+
+@contextlib.contextmanager
+def stage(telemetry, name):
+  """Like `EvalTelemetry.stage()` but does nothing if `telemetry` is None."""
+  if telemetry is None:
+    yield
+  else:
+    with telemetry.stage(name):
+      yield
+
+
+def split_results(result_dict):
+  """Splits a result dictionary into scores and telemetry.
+
+  Args:
+    result_dict: Dictionary with scores and (optionally) the keys of
+      `EvalTelemetry.as_dict()`.
+
+  Returns:
+    Tuple (scores, telemetry) of dictionaries.
+  """
+  scores = {}
+  telemetry = {}
+  for key, value in six.iteritems(result_dict):
+    if key.startswith(_PREFIX):
+      telemetry[key] = value
+    else:
+      scores[key] = value
+  return scores, telemetry
+
+
+def format_summary_table(results):
+  """Returns a text table with the telemetry of one or more evaluations.
+
+  Each row is a stage with the mean wall and CPU time and the maximum peak RSS
+  over the evaluations that recorded the stage.
+
+  Args:
+    results: List of dictionaries that contain the keys of
+      `EvalTelemetry.as_dict()`, e.g. the results stored by a `TaskManager`.
+      Other keys are ignored.
+
+  Returns:
+    String.
+  """
+  values = collections.defaultdict(list)
+  for result_dict in results:
+    for key, value in six.iteritems(split_results(result_dict)[1]):
+      if value is None or value == "":
+        continue
+      name, metric = key[len(_PREFIX):].rsplit("/", 1)
+      values[(name, metric)].append(float(value))
+  names = sorted({name for name, _ in values})
+  name_width = max([len("stage")] + [len(name) for name in names])
+  header = ["stage".ljust(name_width)] + [m.rjust(12) for m in _METRICS]
+  lines = [" ".join(header)]
+  for name in names:
+    row = [name.ljust(name_width)]
+    for metric in _METRICS:
+      metric_values = values.get((name, metric))
+      if not metric_values:
+        row.append("-".rjust(12))
+      elif metric == "peak_rss_mib":
+        row.append("{:12.1f}".format(np.max(metric_values)))
+      else:
+        row.append("{:12.3f}".format(np.mean(metric_values)))
+    lines.append(" ".join(row))
+  return "\n".join(lines)
@@ -0,0 +1,90 @@
+# coding=utf-8
+# Copyright 2018 Google LLC & Hwalsuk Lee.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the evaluation telemetry."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import time
+
+from compare_gan import eval_telemetry
+
+import tensorflow as tf
+
+
+class EvalTelemetryTest(tf.test.TestCase):
+
+  def testStageRecordsTimes(self):
+    telemetry = eval_telemetry.EvalTelemetry()
+    with telemetry.stage("sampling"):
+      time.sleep(0.01)
+    values = telemetry.as_dict()
+    self.assertGreaterEqual(values["telemetry/sampling/wall_secs"], 0.01)
+    self.assertGreaterEqual(values["telemetry/sampling/cpu_secs"], 0.0)
+    if eval_telemetry.resource is not None:
+      self.assertGreater(values["telemetry/sampling/peak_rss_mib"], 0.0)
+
+  def testStagesAccumulate(self):
+    telemetry = eval_telemetry.EvalTelemetry()
+    telemetry.add("task", wall_secs=1.0, cpu_secs=2.0, peak_rss_mib=10.0)
+    telemetry.add("task", wall_secs=0.5, peak_rss_mib=5.0)
+    self.assertEqual(telemetry.as_dict(), {
+        "telemetry/task/wall_secs": 1.5,
+        "telemetry/task/cpu_secs": 2.0,
+        "telemetry/task/peak_rss_mib": 10.0,
+    })
+
+  def testStagesWithoutMeasurements(self):
+    telemetry = eval_telemetry.EvalTelemetry(stages=["export", "task"])
+    telemetry.add("task", wall_secs=1.0)
+    self.assertEqual(telemetry.as_dict(), {
+        "telemetry/export/wall_secs": "",
+        "telemetry/export/cpu_secs": "",
+        "telemetry/export/peak_rss_mib": "",
+        "telemetry/task/wall_secs": 1.0,
+        "telemetry/task/cpu_secs": "",
+        "telemetry/task/peak_rss_mib": "",
+    })
+
+  def testStageWithoutTelemetry(self):
+    with eval_telemetry.stage(None, "sampling"):
+      pass
+
+  def testSplitResults(self):
+    scores, telemetry = eval_telemetry.split_results(
+        {"fid_score_mean": 3.0, "telemetry/task/wall_secs": 1.0})
+    self.assertEqual(scores, {"fid_score_mean": 3.0})
+    self.assertEqual(telemetry, {"telemetry/task/wall_secs": 1.0})
+
+  def testFormatSummaryTable(self):
+    table = eval_telemetry.format_summary_table([
+        {"fid_score_mean": 3.0,
+         "telemetry/real_loading/wall_secs": 1.0,
+         "telemetry/task_FIDScoreTask/wall_secs": 2.0,
+         "telemetry/task_FIDScoreTask/peak_rss_mib": 100.0},
+        {"telemetry/task_FIDScoreTask/wall_secs": "4.000",
+         "telemetry/task_FIDScoreTask/peak_rss_mib": 300.0},
+    ])
+    lines = table.split("\n")
+    self.assertEqual(len(lines), 3)
+    self.assertEqual(lines[1].split(), ["real_loading", "1.000", "-", "-"])
+    self.assertEqual(lines[2].split(),
+                     ["task_FIDScoreTask", "3.000", "-", "300.0"])
+
+
+if __name__ == "__main__":
+  tf.test.main()
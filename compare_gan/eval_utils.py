@@ -25,10 +25,16 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import hashlib
 import os
+import threading
+import time
 
 from absl import logging
 
+from compare_gan.metrics import running_stats
+
+import gin
 import numpy as np
 from six.moves import range
 import tensorflow as tf
@@ -42,11 +48,55 @@ INCEPTION_URL = "http://download.tensorflow.org/models/frozen_inception_v1_2015_
 INCEPTION_FROZEN_GRAPH = "inceptionv1_for_inception_score.pb"
 
 
-def get_inception_graph_def():
-  return tfgan.eval.get_graph_def_from_url_tarball(  # pylint: disable=unreachable
+# Memoized Inception `GraphDef`s by local cache path.
+_INCEPTION_GRAPH_DEFS = {}
+_INCEPTION_GRAPH_DEFS_LOCK = threading.Lock()
+
+
+def _load_inception_graph_def(cache_path):
+  """Loads the Inception `GraphDef` from `cache_path` or downloads it."""
+  if cache_path and tf.gfile.Exists(cache_path):
+    logging.info("Loading Inception graph from %s.", cache_path)
+    graph_def = tf.GraphDef()
+    with tf.gfile.Open(cache_path, "rb") as f:
+      graph_def.ParseFromString(f.read())
+    return graph_def
+  graph_def = tfgan.eval.get_graph_def_from_url_tarball(
       url=INCEPTION_URL,
       filename=INCEPTION_FROZEN_GRAPH,
       tar_filename=os.path.basename(INCEPTION_URL))
+  if cache_path:
+    logging.info("Saving Inception graph to %s.", cache_path)
+    tmp_path = "{}.tmp{}".format(cache_path, os.getpid())
+    with tf.gfile.Open(tmp_path, "wb") as f:
+      f.write(graph_def.SerializeToString())
+    tf.gfile.Rename(tmp_path, cache_path, overwrite=True)
+  return graph_def
+
+
+@gin.configurable("inception_graph", whitelist=["cache_path"])
+def get_inception_graph_def(cache_path=None):
+  """Returns the frozen Inception graph used for evaluation.
+
+  The graph is only loaded once per process.
+
+  Args:
+    cache_path: Optional path to a local copy of the frozen graph. If the file
+      doesn't exist the graph is downloaded and stored there.
+
+  Returns:
+    `tf.GraphDef`.
+  """
+  with _INCEPTION_GRAPH_DEFS_LOCK:
+    if cache_path not in _INCEPTION_GRAPH_DEFS:
+      _INCEPTION_GRAPH_DEFS[cache_path] = _load_inception_graph_def(cache_path)
+    return _INCEPTION_GRAPH_DEFS[cache_path]
+
+
+def get_inception_graph_hash():
+  """Returns a hash of the Inception graph used for evaluation."""
+  graph_def = get_inception_graph_def()
+  return hashlib.sha1(graph_def.SerializeToString()).hexdigest()
 
 
 class NanFoundError(Exception):
@@ -56,22 +106,37 @@ class NanFoundError(Exception):
 class EvalDataSample(object):
   """Helper class to hold images and Inception features for evaluation.
 
-  All properties are tensors. Images are in [0, 255].
+  All properties are tensors. Images are in [0, 255], either as float32 or as
+  uint8 (which needs 4x less memory; consumers convert them batch by batch).
+  `mean` and `cov` are the moments of the Inception activations if they were
+  precomputed.
+  `inception_score_stats` is a `RunningInceptionScore` for the logits if it
+  was accumulated.
   """
 
   def __init__(self, images):
     self.images = images
     self.activations = None
     self.logits = None
+    self.mean = None
+    self.cov = None
+    self.inception_score_stats = None
 
   def discard_images(self):
     logging.info("Deleting references to images: %s", self.images.shape)
-    del self.images
+    self.images = None
 
   def set_inception_features(self, activations, logits):
     self.activations = activations
     self.logits = logits
 
+  def set_moments(self, mean, cov):
+    self.mean = mean
+    self.cov = cov
+
+  def set_inception_score_stats(self, inception_score_stats):
+    self.inception_score_stats = inception_score_stats
+
   def set_num_examples(self, num_examples):
     if self.images is not None:
       assert self.images.shape[0] >= num_examples
@@ -87,7 +152,9 @@ class EvalDataSample(object):
 def get_real_images(dataset,
                     num_examples,
                     split=None,
-                    failure_on_insufficient_examples=True):
+                    failure_on_insufficient_examples=True,
+                    batch_size=64,
+                    dtype=np.float32):
   """Get num_examples images from the given dataset/split.
 
   Args:
@@ -98,6 +165,9 @@ def get_real_images(dataset,
     failure_on_insufficient_examples: If True raise an exception if the
       dataset/split does not images. Otherwise will log to error and return
       fewer images.
+    batch_size: Number of images to read per session run.
+    dtype: Data type of the returned images, np.float32 or np.uint8. Using
+      np.uint8 requires 4x less memory.
 
   Returns:
     4-D NumPy array with images with values in [0, 256].
@@ -107,27 +177,39 @@ def get_real_images(dataset,
         requested images and `failure_on_insufficient_examples` is True.
   """
   logging.info("Start loading real data.")
+  if dtype not in (np.float32, np.uint8):
+    raise ValueError("Unsupported dtype for real images: %s" % dtype)
+
+  def to_rgb(images, labels):
+    del labels
+    images *= 255.0
+    # In the case of a 1-channel dataset (like MNIST) convert it to 3 channels.
+    if images.shape[-1].value == 1:
+      images = tf.tile(images, [1, 1, 1, 3])
+    if dtype == np.uint8:
+      images = tf.cast(tf.round(images), tf.uint8)
+    return images
+
   with tf.Graph().as_default():
     ds = dataset.eval_input_fn(split=split)
-    # Get real images from the dataset. In the case of a 1-channel
-    # dataset (like MNIST) convert it to 3 channels.
-    next_batch = ds.make_one_shot_iterator().get_next()[0]
-    shape = [num_examples] + next_batch.shape.as_list()
-    is_single_channel = shape[-1] == 1
-    if is_single_channel:
-      shape[-1] = 3
-    real_images = np.empty(shape, dtype=np.float32)
+    ds = ds.take(num_examples).batch(batch_size)
+    ds = ds.map(to_rgb, num_parallel_calls=tf.contrib.data.AUTOTUNE)
+    ds = ds.prefetch(tf.contrib.data.AUTOTUNE)
+    next_batch = ds.make_one_shot_iterator().get_next()
+    real_images = np.empty([num_examples] + next_batch.shape.as_list()[1:],
+                           dtype=dtype)
+    num_read = 0
     with tf.Session() as sess:
-      for i in range(num_examples):
+      while num_read < num_examples:
         try:
           b = sess.run(next_batch)
-          b *= 255.0
-          if is_single_channel:
-            b = np.tile(b, [1, 1, 3])
-          real_images[i] = b
         except tf.errors.OutOfRangeError:
-          logging.error("Reached the end of dataset. Read: %d samples.", i)
+          logging.error("Reached the end of dataset. Read: %d samples.",
+                        num_read)
           break
+        real_images[num_read:num_read + b.shape[0]] = b
+        num_read += b.shape[0]
+  real_images = real_images[:num_read]
 
   if real_images.shape[0] != num_examples:
     if failure_on_insufficient_examples:
@@ -141,10 +223,22 @@ def get_real_images(dataset,
   return real_images
 
 
-def sample_fake_dataset(sess, generator, num_batches):
-  """Returns a generated data set as a NumPy array."""
-  logging.info("Generating a fake data set.")
-  samples = []
+def generate_fake_batches(sess, generator, num_batches):
+  """Yields batches of generated images as NumPy arrays.
+
+  Images are in [0, 255] and have 3 color channels.
+
+  Args:
+    sess: `tf.Session` in which `generator` is evaluated.
+    generator: Output tensor of the generator. Images are in [0, 1].
+    num_batches: Number of batches to generate.
+
+  Yields:
+    4-D NumPy arrays of shape [batch_size, H, W, 3].
+
+  Raises:
+    NanFoundError: If the generator output has any NaNs.
+  """
   for _ in range(num_batches):
     x = sess.run(generator)
     # If NaNs were generated, ignore this checkpoint and assign a very high
@@ -152,17 +246,353 @@ def sample_fake_dataset(sess, generator, num_batches):
     if np.isnan(x).any():
       logging.error("Detected NaN in fake_images! Returning NaN.")
       raise NanFoundError("Detected NaN in fake images.")
-    samples.append(x)
-  fake_images = np.concatenate(samples, axis=0)
-  fake_images *= 255.0
-  # Convert 1-channel datasets (like MNIST) to 3 channels.
-  if fake_images.shape[3] == 1:
-    fake_images = np.tile(fake_images, [1, 1, 1, 3])
+    x *= 255.0
+    # Convert 1-channel datasets (like MNIST) to 3 channels.
+    if x.shape[3] == 1:
+      x = np.tile(x, [1, 1, 1, 3])
+    yield x
+
+
+def quantize_generated(generated):
+  """Converts the generator output to uint8 images on the device.
+
+  Only a quarter of the bytes of the float32 images have to be copied to the
+  host.
+
+  Args:
+    generated: Output tensor of the generator. Images are in [0, 1].
+
+  Returns:
+    Dictionary with the tensors "images" (uint8 images in [0, 255] with 3
+    color channels) and "has_nan" (a boolean scalar which is True if the
+    generated images contain any NaNs).
+  """
+  _, valid_images, has_nan = _sanitize_generated(generated)
+  return {
+      "images": tf.cast(tf.round(valid_images), tf.uint8),
+      "has_nan": has_nan,
+  }
+
+
+def generate_quantized_batches(sess, quantized, num_batches):
+  """Yields batches of generated uint8 images as NumPy arrays.
+
+  Args:
+    sess: `tf.Session` in which the tensors are evaluated.
+    quantized: Dictionary as returned by `quantize_generated()`.
+    num_batches: Number of batches to generate.
+
+  Yields:
+    4-D uint8 NumPy arrays of shape [batch_size, H, W, 3].
+
+  Raises:
+    NanFoundError: If the generator output has any NaNs.
+  """
+  for _ in range(num_batches):
+    outputs = sess.run(quantized)
+    if outputs["has_nan"]:
+      logging.error("Detected NaN in fake_images! Returning NaN.")
+      raise NanFoundError("Detected NaN in fake images.")
+    yield outputs["images"]
+
+
+def sample_fake_dataset(sess, generator, num_batches, quantized=None):
+  """Returns a generated data set as a NumPy array.
+
+  Args:
+    sess: `tf.Session` in which `generator` is evaluated.
+    generator: Output tensor of the generator. Images are in [0, 1].
+    num_batches: Number of batches to generate.
+    quantized: Optional dictionary as returned by `quantize_generated()`. If
+      set the data set is sampled as uint8 images.
+
+  Returns:
+    4-D NumPy array with images in [0, 255].
+  """
+  logging.info("Generating a fake data set.")
+  if quantized is not None:
+    batches = generate_quantized_batches(sess, quantized, num_batches)
+  else:
+    batches = generate_fake_batches(sess, generator, num_batches)
+  fake_images = np.concatenate(list(batches), axis=0)
   logging.info("Done sampling a generated data set.")
   return fake_images
 
 
-def inception_transform(inputs):
+class ReservoirSample(object):
+  """Uniform random sample of fixed size from a stream of batches.
+
+  This is Algorithm R from "Random Sampling with a Reservoir", Vitter, 1985.
+  After adding n examples every example is in the sample with probability
+  min(1, max_size / n).
+  """
+
+  def __init__(self, max_size):
+    self._max_size = max_size
+    self._samples = None
+    self._num_seen = 0
+
+  def add(self, batch):
+    """Adds the examples in `batch` (along the first axis) to the stream."""
+    if self._samples is None:
+      self._samples = np.empty(
+          [self._max_size] + list(batch.shape[1:]), dtype=batch.dtype)
+    num_fill = max(0, min(len(batch), self._max_size - self._num_seen))
+    self._samples[self._num_seen:self._num_seen + num_fill] = batch[:num_fill]
+    # The t-th example of the stream replaces a random sample with
+    # probability max_size / (t + 1).
+    positions = np.arange(num_fill, len(batch))
+    slots = np.random.randint(0, self._num_seen + positions + 1)
+    for position, slot in zip(positions, slots):
+      if slot < self._max_size:
+        self._samples[slot] = batch[position]
+    self._num_seen += len(batch)
+
+  @property
+  def samples(self):
+    if self._samples is None:
+      return None
+    return self._samples[:min(self._num_seen, self._max_size)]
+
+
+class EvalDataSampleBuilder(object):
+  """Collects featurized batches into an `EvalDataSample` incrementally.
+
+  The batches are folded into the moments of the activations and the
+  Inception Score statistics as they arrive. Inception features and logits are
+  written into preallocated arrays if requested. Images are only kept if
+  requested, which bounds the memory used by the images independently of
+  `num_examples`. `snapshot()` gives the statistics of the examples collected
+  so far, e.g. to decide whether more examples are needed.
+  """
+
+  def __init__(self, num_examples, max_images=None, keep_features=True,
+               keep_logits=None):
+    """Creates a new `EvalDataSampleBuilder`.
+
+    Args:
+      num_examples: Maximum number of examples to collect. Additional examples
+        are ignored.
+      max_images: If None keep all images. Otherwise keep a uniform random
+        sample of at most `max_images` images (0 to keep no images).
+      keep_features: If False only keep the accumulated statistics but not the
+        activations of all examples.
+      keep_logits: Whether to keep the logits of all examples. Defaults to
+        `keep_features`.
+    """
+    if keep_logits is None:
+      keep_logits = keep_features
+    self._max_examples = num_examples
+    self._max_images = max_images
+    self._keep_features = keep_features
+    self._keep_logits = keep_logits
+    self._images = self._activations = self._logits = self._reservoir = None
+    self._moments = self._inception_score_stats = None
+    self._num_examples = 0
+
+  def _allocate(self, batch_images, batch_activations, batch_logits):
+    num_examples = self._max_examples
+    self._moments = running_stats.RunningMeanAndCovariance(
+        batch_activations.shape[1])
+    self._inception_score_stats = running_stats.RunningInceptionScore(
+        batch_logits.shape[1])
+    if self._keep_features:
+      self._activations = np.empty(
+          [num_examples] + list(batch_activations.shape[1:]),
+          dtype=batch_activations.dtype)
+    if self._keep_logits:
+      self._logits = np.empty(
+          [num_examples] + list(batch_logits.shape[1:]),
+          dtype=batch_logits.dtype)
+    if self._max_images is None:
+      self._images = np.empty(
+          [num_examples] + list(batch_images.shape[1:]),
+          dtype=batch_images.dtype)
+    elif self._max_images > 0:
+      self._reservoir = ReservoirSample(self._max_images)
+
+  @property
+  def num_examples(self):
+    """Number of examples collected so far."""
+    return self._num_examples
+
+  @property
+  def is_full(self):
+    return self._num_examples >= self._max_examples
+
+  def add(self, batch_images, batch_activations, batch_logits):
+    """Adds a batch, e.g. as returned by `inception_transform_batches()`."""
+    if self._moments is None:
+      self._allocate(batch_images, batch_activations, batch_logits)
+    offset = self._num_examples
+    n = min(batch_activations.shape[0], self._max_examples - offset)
+    self._moments.update(batch_activations[:n])
+    self._inception_score_stats.update(batch_logits[:n])
+    if self._activations is not None:
+      self._activations[offset:offset + n] = batch_activations[:n]
+    if self._logits is not None:
+      self._logits[offset:offset + n] = batch_logits[:n]
+    if self._images is not None:
+      self._images[offset:offset + n] = batch_images[:n]
+    if self._reservoir is not None:
+      self._reservoir.add(batch_images[:n])
+    self._num_examples += n
+
+  def _get_inception_score_stats(self):
+    return running_stats.RunningInceptionScore.from_state(
+        self._inception_score_stats.get_state())
+
+  def snapshot(self):
+    """Returns an `EvalDataSample` of the examples collected so far.
+
+    The sample has no images. The activations and logits (if kept) are views
+    that must not be modified.
+    """
+    n = self._num_examples
+    eval_dset = EvalDataSample(None)
+    eval_dset.set_inception_features(
+        activations=None if self._activations is None
+        else self._activations[:n],
+        logits=None if self._logits is None else self._logits[:n])
+    eval_dset.set_moments(mean=self._moments.mean.copy(),
+                          cov=self._moments.covariance)
+    eval_dset.set_inception_score_stats(self._get_inception_score_stats())
+    return eval_dset
+
+  def build(self):
+    """Returns the `EvalDataSample` with all examples collected so far.
+
+    If the builder is not full the arrays are copied, so the preallocated
+    memory for the missing examples is freed.
+    """
+    n = self._num_examples
+    def truncate(array):
+      if array is None or n == array.shape[0]:
+        return array
+      return array[:n].copy()
+    if self._reservoir is not None:
+      images = self._reservoir.samples
+    else:
+      images = truncate(self._images)
+    eval_dset = EvalDataSample(images)
+    eval_dset.set_inception_features(
+        activations=truncate(self._activations),
+        logits=truncate(self._logits))
+    eval_dset.set_moments(mean=self._moments.mean,
+                          cov=self._moments.covariance)
+    eval_dset.set_inception_score_stats(self._inception_score_stats)
+    return eval_dset
+
+
+def build_eval_data_sample(featurized_batches, num_examples, max_images=None,
+                           keep_features=True, keep_logits=None):
+  """Collects featurized batches into an `EvalDataSample`.
+
+  See `EvalDataSampleBuilder`.
+
+  Args:
+    featurized_batches: Iterable of tuples (images, activations, logits), e.g.
+      as returned by `inception_transform_batches()`.
+    num_examples: Number of examples to collect. Additional examples in the
+      last batch are ignored.
+    max_images: If None keep all images. Otherwise keep a uniform random
+      sample of at most `max_images` images (0 to keep no images).
+    keep_features: If False only keep the accumulated statistics but not the
+      activations of all examples.
+    keep_logits: Whether to keep the logits of all examples. Defaults to
+      `keep_features`.
+
+  Returns:
+    `EvalDataSample` with Inception features for `num_examples` examples.
+
+  Raises:
+    ValueError: If `featurized_batches` has less than `num_examples` examples.
+  """
+  builder = EvalDataSampleBuilder(
+      num_examples, max_images=max_images, keep_features=keep_features,
+      keep_logits=keep_logits)
+  for batch in featurized_batches:
+    builder.add(*batch)
+    if builder.is_full:
+      break
+  if not builder.is_full:
+    raise ValueError("Expected %d examples but got only %d." %
+                     (num_examples, builder.num_examples))
+  return builder.build()
+
+
+class ConvergenceMonitor(object):
+  """Decides whether the estimate of a metric has converged.
+
+  Estimates of FID, IS and KID from N examples behave like
+  value_inf + b / N plus noise. The bias of FID and IS is O(1/N) (see
+  "Effectively Unbiased FID and Inception Score and where to find them",
+  Chong and Forsyth [https://arxiv.org/abs/1911.07023]). KID is unbiased
+  (b = 0). After every new estimate value_inf and b are fitted by least
+  squares. The error of the last estimate is approximated by the remaining
+  bias |b / N| plus the standard deviation of the residuals of the fit. The
+  estimate has converged if this error is at most `tolerance` times
+  |value_inf|.
+  """
+
+  def __init__(self, tolerance, min_estimates=3):
+    """Creates a new `ConvergenceMonitor`.
+
+    Args:
+      tolerance: Relative tolerance for the error of the estimate.
+      min_estimates: Minimum number of estimates before the estimate can
+        converge. Must be at least 3 to estimate the noise.
+    """
+    if min_estimates < 3:
+      raise ValueError("min_estimates must be at least 3: %s" % min_estimates)
+    self._tolerance = tolerance
+    self._min_estimates = min_estimates
+    self._num_examples = []
+    self._values = []
+    self._extrapolated_value = None
+    self._error = None
+
+  def add(self, num_examples, value):
+    """Adds the estimate `value` computed from `num_examples` examples."""
+    self._num_examples.append(num_examples)
+    self._values.append(value)
+    if len(self._values) < 3:
+      return
+    inverse_num_examples = 1.0 / np.array(self._num_examples, dtype=np.float64)
+    a = np.stack([np.ones_like(inverse_num_examples), inverse_num_examples],
+                 axis=1)
+    values = np.array(self._values, dtype=np.float64)
+    (value_inf, bias_coefficient), _, _, _ = np.linalg.lstsq(
+        a, values, rcond=None)
+    residuals = values - np.dot(a, [value_inf, bias_coefficient])
+    noise = np.sqrt(np.sum(residuals**2) / (len(values) - 2))
+    self._extrapolated_value = value_inf
+    self._error = abs(bias_coefficient * inverse_num_examples[-1]) + noise
+
+  @property
+  def value(self):
+    """The last estimate."""
+    return self._values[-1] if self._values else None
+
+  @property
+  def extrapolated_value(self):
+    """The estimate for infinitely many examples or None."""
+    return self._extrapolated_value
+
+  @property
+  def error(self):
+    """The approximate error of the last estimate or None."""
+    return self._error
+
+  def has_converged(self):
+    if len(self._values) < self._min_estimates:
+      return False
+    return self._error <= self._tolerance * abs(self._extrapolated_value)
+
+
+def inception_transform(inputs, graph_def=None):
+  if graph_def is None:
+    graph_def = get_inception_graph_def()
   with tf.control_dependencies([
       tf.assert_greater_equal(inputs, 0.0),
       tf.assert_less_equal(inputs, 255.0)]):
@@ -171,10 +601,231 @@ def inception_transform(inputs):
       fn=tfgan.eval.preprocess_image, elems=inputs, back_prop=False)
   return tfgan.eval.run_inception(
       preprocessed_inputs,
-      graph_def=get_inception_graph_def(),
+      graph_def=graph_def,
       output_tensor=["pool_3:0", "logits:0"])
 
 
+def _sanitize_generated(generated):
+  """Scales generated images to [0, 255] and converts them to 3 channels.
+
+  Args:
+    generated: Output tensor of the generator. Images are in [0, 1].
+
+  Returns:
+    Tuple (images, valid_images, has_nan). `valid_images` has NaNs replaced
+    by 0 and is clipped to [0, 255].
+  """
+  images = generated * 255.0
+  # Convert 1-channel datasets (like MNIST) to 3 channels.
+  if images.shape[3].value == 1:
+    images = tf.tile(images, [1, 1, 1, 3])
+  has_nan = tf.reduce_any(tf.is_nan(images))
+  # The NaN check happens on the host after the batch was computed. Replace
+  # NaNs so that the range assertions in inception_transform() don't fail
+  # before that.
+  valid_images = tf.where(tf.is_nan(images), tf.zeros_like(images), images)
+  valid_images = tf.clip_by_value(valid_images, 0.0, 255.0)
+  return images, valid_images, has_nan
+
+
+def inception_transform_generated(generated, quantize=False):
+  """Adds the Inception network on top of the generator output.
+
+  This allows to sample and compute Inception features in a single graph
+  without copying the generated images to the host.
+
+  Args:
+    generated: Output tensor of the generator. Images are in [0, 1].
+    quantize: If True the images are rounded to uint8 before computing the
+      Inception features and are returned as uint8.
+
+  Returns:
+    Dictionary with the tensors "images" (generated images in [0, 255] with 3
+    color channels), "activations", "logits" and "has_nan" (a boolean scalar
+    which is True if the generated images contain any NaNs).
+  """
+  images, valid_images, has_nan = _sanitize_generated(generated)
+  if quantize:
+    images = tf.cast(tf.round(valid_images), tf.uint8)
+    valid_images = tf.cast(images, tf.float32)
+  activations, logits = inception_transform(valid_images)
+  return {
+      "images": images,
+      "activations": activations,
+      "logits": logits,
+      "has_nan": has_nan,
+  }
+
+
+def generate_featurized_batches(sess, fused_outputs, num_batches,
+                                fetch_images):
+  """Yields Inception features for batches of generated images.
+
+  Args:
+    sess: `tf.Session` in which the tensors are evaluated.
+    fused_outputs: Dictionary as returned by `inception_transform_generated()`.
+    num_batches: Number of batches to generate.
+    fetch_images: If True also fetch the generated images. Otherwise only the
+      features are copied to the host.
+
+  Yields:
+    Tuples (images, activations, logits). `images` is None if `fetch_images`
+    is False.
+
+  Raises:
+    NanFoundError: If the generator output has any NaNs.
+  """
+  fetches = {k: fused_outputs[k] for k in ["activations", "logits", "has_nan"]}
+  if fetch_images:
+    fetches["images"] = fused_outputs["images"]
+  for _ in range(num_batches):
+    outputs = sess.run(fetches)
+    if outputs["has_nan"]:
+      logging.error("Detected NaN in fake_images! Returning NaN.")
+      raise NanFoundError("Detected NaN in fake images.")
+    yield outputs.get("images"), outputs["activations"], outputs["logits"]
+
+
+class InceptionFeaturizer(object):
+  """Computes Inception features and logits for NumPy arrays of images.
+
+  The Inception graph is created once and the session is kept open, so the
+  same featurizer can be used for many calls without paying the setup cost
+  again. The featurizer accepts images of any size (they are resized to the
+  Inception input size) and inputs with any number of images.
+
+  Use `get_inception_featurizer()` to get the featurizer shared within the
+  process.
+  """
+
+  def __init__(self, graph_def=None, batch_size=64):
+    """Creates a new `InceptionFeaturizer`.
+
+    Args:
+      graph_def: Frozen Inception graph. Defaults to
+        `get_inception_graph_def()`.
+      batch_size: Maximum number of images per session run.
+    """
+    if graph_def is None:
+      graph_def = get_inception_graph_def()
+    self._graph_def = graph_def
+    self._batch_size = batch_size
+    self._graph = tf.Graph()
+    with self._graph.as_default():
+      # uint8 batches are fed to their own placeholder and converted in the
+      # graph, so they are never converted to float32 on the host.
+      self._uint8_inputs = tf.placeholder(
+          dtype=tf.uint8, shape=[None, None, None, 3])
+      self._inputs = tf.placeholder_with_default(
+          tf.cast(self._uint8_inputs, tf.float32), shape=[None, None, None, 3])
+      self._features_and_logits = inception_transform(
+          self._inputs, graph_def=graph_def)
+    self._sess = tf.Session(graph=self._graph)
+    self._lock = threading.Lock()
+    self._num_images = 0
+    self._num_batches = 0
+    self._total_time = 0.0
+
+  def _run(self, batch):
+    start_time = time.time()
+    if batch.dtype == np.uint8:
+      feed_dict = {self._uint8_inputs: batch}
+    else:
+      feed_dict = {self._inputs: batch}
+    activations, logits = self._sess.run(
+        self._features_and_logits, feed_dict=feed_dict)
+    with self._lock:
+      self._num_images += batch.shape[0]
+      self._num_batches += 1
+      self._total_time += time.time() - start_time
+    return activations, logits
+
+  @property
+  def graph_def(self):
+    return self._graph_def
+
+  def featurize(self, images, batch_size=None):
+    """Computes the Inception features and logits for a given NumPy array.
+
+    Args:
+      images: NumPy array of shape [-1, H, W, 3] with values in [0, 255]
+        (float32 or uint8).
+      batch_size: Optional batch size. Defaults to the batch size of the
+        featurizer.
+
+    Returns:
+      A tuple of NumPy arrays with Inception features and logits for each
+      input.
+    """
+    batch_size = batch_size or self._batch_size
+    features = []
+    logits = []
+    for start in range(0, images.shape[0], batch_size):
+      x = self._run(images[start:start + batch_size])
+      features.append(x[0])
+      logits.append(x[1])
+    return np.vstack(features), np.vstack(logits)
+
+  def featurize_batches(self, batches):
+    """Computes the Inception features and logits for a stream of batches.
+
+    Args:
+      batches: Iterable of NumPy arrays of shape [-1, H, W, 3].
+
+    Yields:
+      Tuples (images, activations, logits) for every batch in `batches`.
+    """
+    for batch in batches:
+      activations, logits = self.featurize(batch)
+      yield batch, activations, logits
+
+  def get_stats(self):
+    """Returns a dictionary with throughput counters."""
+    with self._lock:
+      return {
+          "num_images": self._num_images,
+          "num_batches": self._num_batches,
+          "total_time_secs": self._total_time,
+          "images_per_sec": self._num_images / max(self._total_time, 1e-12),
+      }
+
+  def close(self):
+    self._sess.close()
+
+
+_INCEPTION_FEATURIZER = None
+_INCEPTION_FEATURIZER_LOCK = threading.Lock()
+
+
+def get_inception_featurizer():
+  """Returns the `InceptionFeaturizer` shared within this process.
+
+  The featurizer is recreated if `get_inception_graph_def()` returns a
+  different graph (e.g. after changing the gin configuration).
+  """
+  global _INCEPTION_FEATURIZER
+  graph_def = get_inception_graph_def()
+  with _INCEPTION_FEATURIZER_LOCK:
+    if (_INCEPTION_FEATURIZER is None or
+        _INCEPTION_FEATURIZER.graph_def is not graph_def):
+      if _INCEPTION_FEATURIZER is not None:
+        _INCEPTION_FEATURIZER.close()
+      _INCEPTION_FEATURIZER = InceptionFeaturizer(graph_def=graph_def)
+    return _INCEPTION_FEATURIZER
+
+
+def reset_inception_featurizer():
+  """Closes the shared `InceptionFeaturizer`.
+
+  The next call of `get_inception_featurizer()` creates a new one.
+  """
+  global _INCEPTION_FEATURIZER
+  with _INCEPTION_FEATURIZER_LOCK:
+    if _INCEPTION_FEATURIZER is not None:
+      _INCEPTION_FEATURIZER.close()
+    _INCEPTION_FEATURIZER = None
+
+
 def inception_transform_np(inputs, batch_size):
   """Computes the inception features and logits for a given NumPy array.
 
@@ -188,19 +839,20 @@ def inception_transform_np(inputs, batch_size):
   Returns:
     A tuple of NumPy arrays with Inception features and logits for each input.
   """
-  with tf.Session(graph=tf.Graph()) as sess:
-    inputs_placeholder = tf.placeholder(
-        dtype=tf.float32, shape=[None] + list(inputs[0].shape))
-    features_and_logits = inception_transform(inputs_placeholder)
-    features = []
-    logits = []
-    num_batches = int(np.ceil(inputs.shape[0] / batch_size))
-    for i in range(num_batches):
-      input_batch = inputs[i * batch_size:(i + 1) * batch_size]
-      x = sess.run(
-          features_and_logits, feed_dict={inputs_placeholder: input_batch})
-      features.append(x[0])
-      logits.append(x[1])
-    features = np.vstack(features)
-    logits = np.vstack(logits)
-    return features, logits
+  return get_inception_featurizer().featurize(inputs, batch_size=batch_size)
+
+
+def inception_transform_batches(batches):
+  """Computes the Inception features and logits for a stream of batches.
+
+  Unlike `inception_transform_np()` this does not require all images to be in
+  memory.
+
+  Args:
+    batches: Iterable of NumPy arrays of shape [-1, H, W, 3].
+
+  Returns:
+    Iterator over tuples (images, activations, logits) for every batch in
+    `batches`.
+  """
+  return get_inception_featurizer().featurize_batches(batches)
@@ -0,0 +1,191 @@
+# coding=utf-8
+# Copyright 2018 Google LLC & Hwalsuk Lee.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the evaluation utilities."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from absl import flags
+from absl.testing import flagsaver
+from compare_gan import datasets
+from compare_gan import eval_utils
+from compare_gan import test_utils
+
+import mock
+import numpy as np
+from six.moves import range
+import tensorflow as tf
+
+FLAGS = flags.FLAGS
+
+
+def _featurized_batches(num_batches, batch_size):
+  for i in range(num_batches):
+    images = np.full([batch_size, 4, 4, 3], i, dtype=np.float32)
+    activations = np.full([batch_size, 8], i, dtype=np.float32)
+    logits = np.full([batch_size, 5], i, dtype=np.float32)
+    yield images, activations, logits
+
+
+class EvalUtilsTest(tf.test.TestCase):
+
+  def testReservoirSampleIsUniform(self):
+    np.random.seed(42)
+    counts = np.zeros(100)
+    for _ in range(2000):
+      reservoir = eval_utils.ReservoirSample(10)
+      for start in range(0, 100, 7):
+        reservoir.add(np.arange(start, min(start + 7, 100)))
+      self.assertEqual(reservoir.samples.shape, (10,))
+      counts[reservoir.samples] += 1
+    # Every example should be in the sample with probability 0.1.
+    self.assertAllClose(counts / 2000, np.full(100, 0.1), atol=0.03)
+
+  def testBuildEvalDataSampleKeepsAllImages(self):
+    eval_dset = eval_utils.build_eval_data_sample(
+        _featurized_batches(3, 4), num_examples=10)
+    self.assertEqual(eval_dset.images.shape, (10, 4, 4, 3))
+    self.assertEqual(eval_dset.activations.shape, (10, 8))
+    self.assertEqual(eval_dset.logits.shape, (10, 5))
+    self.assertAllEqual(eval_dset.activations[:, 0],
+                        [0, 0, 0, 0, 1, 1, 1, 1, 2, 2])
+
+  def testBuildEvalDataSampleWithBoundedImages(self):
+    eval_dset = eval_utils.build_eval_data_sample(
+        _featurized_batches(3, 4), num_examples=10, max_images=5)
+    self.assertEqual(eval_dset.images.shape, (5, 4, 4, 3))
+    self.assertEqual(eval_dset.activations.shape, (10, 8))
+
+  def testBuildEvalDataSampleWithoutImages(self):
+    eval_dset = eval_utils.build_eval_data_sample(
+        _featurized_batches(3, 4), num_examples=10, max_images=0)
+    self.assertIsNone(eval_dset.images)
+    self.assertEqual(eval_dset.logits.shape, (10, 5))
+
+  def testBuildEvalDataSampleWithoutLogits(self):
+    eval_dset = eval_utils.build_eval_data_sample(
+        _featurized_batches(3, 4), num_examples=10, max_images=0,
+        keep_logits=False)
+    self.assertEqual(eval_dset.activations.shape, (10, 8))
+    self.assertIsNone(eval_dset.logits)
+    self.assertEqual(eval_dset.inception_score_stats.num_examples, 10)
+
+  def testEvalDataSampleBuilderSnapshotAndEarlyBuild(self):
+    builder = eval_utils.EvalDataSampleBuilder(20, max_images=0)
+    for batch in _featurized_batches(2, 4):
+      builder.add(*batch)
+    snapshot = builder.snapshot()
+    self.assertEqual(snapshot.activations.shape, (8, 8))
+    self.assertEqual(snapshot.inception_score_stats.num_examples, 8)
+    for batch in _featurized_batches(1, 4):
+      builder.add(*batch)
+    self.assertFalse(builder.is_full)
+    # The snapshot does not change when more examples are added.
+    self.assertEqual(snapshot.inception_score_stats.num_examples, 8)
+    eval_dset = builder.build()
+    self.assertEqual(eval_dset.activations.shape, (12, 8))
+    self.assertEqual(eval_dset.logits.shape, (12, 5))
+    self.assertEqual(eval_dset.inception_score_stats.num_examples, 12)
+
+  def testConvergenceMonitor(self):
+    np.random.seed(0)
+    monitor = eval_utils.ConvergenceMonitor(tolerance=0.01)
+    for num_examples in [1000, 2000]:
+      monitor.add(num_examples, 20.0 + 3000.0 / num_examples)
+    self.assertFalse(monitor.has_converged())
+    self.assertIsNone(monitor.extrapolated_value)
+    for num_examples in [3000, 5000, 10000, 20000]:
+      monitor.add(num_examples, 20.0 + 3000.0 / num_examples +
+                  np.random.normal() * 0.01)
+    self.assertNear(monitor.extrapolated_value, 20.0, 0.05)
+    self.assertTrue(monitor.has_converged())
+    self.assertFalse(
+        eval_utils.ConvergenceMonitor(tolerance=0.001).has_converged())
+
+  def testBuildEvalDataSampleWithTooFewExamples(self):
+    with self.assertRaises(ValueError):
+      eval_utils.build_eval_data_sample(
+          _featurized_batches(2, 4), num_examples=10)
+
+  def testInceptionFeaturizerAcceptsArbitraryBatchSizes(self):
+    graph_def = test_utils.create_fake_inception_graph()
+    featurizer = eval_utils.InceptionFeaturizer(graph_def, batch_size=4)
+    try:
+      images = np.random.uniform(0, 255, size=(10, 32, 32, 3))
+      activations, logits = featurizer.featurize(images)
+      self.assertEqual(activations.shape, (10, 10))
+      self.assertEqual(logits.shape, (10, 10))
+      batch_activations, _ = featurizer.featurize(images[:7], batch_size=7)
+      self.assertAllClose(batch_activations, activations[:7])
+      stats = featurizer.get_stats()
+      self.assertEqual(stats["num_images"], 17)
+      self.assertEqual(stats["num_batches"], 4)
+    finally:
+      featurizer.close()
+
+  def testInceptionFeaturizerAcceptsUint8Images(self):
+    graph_def = test_utils.create_fake_inception_graph()
+    featurizer = eval_utils.InceptionFeaturizer(graph_def, batch_size=4)
+    try:
+      images = np.random.randint(0, 256, size=(6, 32, 32, 3)).astype(np.uint8)
+      activations, logits = featurizer.featurize(images)
+      expected_activations, expected_logits = featurizer.featurize(
+          images.astype(np.float32))
+      self.assertAllClose(activations, expected_activations)
+      self.assertAllClose(logits, expected_logits)
+    finally:
+      featurizer.close()
+
+  def testQuantizeGenerated(self):
+    with tf.Graph().as_default():
+      generated = tf.constant(
+          [[[[0.0]], [[0.5]]], [[[1.0]], [[0.2]]]], dtype=tf.float32)
+      quantized = eval_utils.quantize_generated(generated)
+      with tf.Session() as sess:
+        outputs = sess.run(quantized)
+    self.assertEqual(outputs["images"].dtype, np.uint8)
+    self.assertEqual(outputs["images"].shape, (2, 2, 1, 3))
+    self.assertAllEqual(outputs["images"][..., 0].ravel(), [0, 128, 255, 51])
+    self.assertFalse(outputs["has_nan"])
+
+  def testSharedInceptionFeaturizerIsReused(self):
+    graph_def = test_utils.create_fake_inception_graph()
+    with mock.patch.object(eval_utils, "get_inception_graph_def",
+                           return_value=graph_def):
+      featurizer = eval_utils.get_inception_featurizer()
+      self.assertIs(eval_utils.get_inception_featurizer(), featurizer)
+    eval_utils.reset_inception_featurizer()
+
+  @flagsaver.flagsaver
+  def testGetRealImagesConvertsToThreeChannels(self):
+    FLAGS.data_fake_dataset = True
+    dataset = datasets.get_dataset("mnist")
+    images = eval_utils.get_real_images(
+        dataset, num_examples=150, batch_size=64)
+    self.assertEqual(images.shape, (150, 28, 28, 3))
+    self.assertEqual(images.dtype, np.float32)
+    self.assertAllEqual(images[..., 0], images[..., 2])
+    self.assertLessEqual(images.max(), 255.0)
+    self.assertGreater(images.max(), 1.0)
+    images_uint8 = eval_utils.get_real_images(
+        dataset, num_examples=150, batch_size=64, dtype=np.uint8)
+    self.assertEqual(images_uint8.dtype, np.uint8)
+    self.assertAllClose(images_uint8, images, atol=0.5)
+
+
+if __name__ == "__main__":
+  tf.test.main()
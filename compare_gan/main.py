@@ -55,6 +55,12 @@ flags.DEFINE_multi_string(
 flags.DEFINE_string(
     "score_filename", "scores.csv",
     "Name of the CSV file with evaluation results model_dir.")
+flags.DEFINE_enum(
+    "score_format", "csv", ["csv", "sqlite"],
+    "Format for storing the evaluation results. With 'sqlite' the results "
+    "are stored in an SQLite database named like --score_filename but with "
+    "the extension .sqlite (and the --eval_worker_id, if set). The model_dir "
+    "must be on a local file system.")
 
 flags.DEFINE_integer(
     "num_eval_averaging_runs", 3,
@@ -62,6 +68,11 @@ flags.DEFINE_integer(
 flags.DEFINE_integer(
     "eval_every_steps", 5000,
     "Evaluate only checkpoints whose step is divisible by this integer")
+flags.DEFINE_string(
+    "eval_worker_id", None,
+    "Unique ID of this evaluation worker. If set multiple workers can run "
+    "continuous_eval on the same model_dir. Checkpoints are claimed through "
+    "lease files and each worker writes its own score file.")
 
 flags.DEFINE_bool("use_tpu", None, "Whether running on TPU or not.")
 
@@ -100,8 +111,14 @@ def _get_run_config(tf_random_seed=None,
 def _get_task_manager():
   """Returns a TaskManager for this experiment."""
   score_file = os.path.join(FLAGS.model_dir, FLAGS.score_filename)
+  if FLAGS.score_format == "sqlite":
+    return runner_lib.TaskManagerWithSqliteResults(
+        model_dir=FLAGS.model_dir,
+        db_path=os.path.splitext(score_file)[0] + ".sqlite",
+        worker_id=FLAGS.eval_worker_id)
   return runner_lib.TaskManagerWithCsvResults(
-      model_dir=FLAGS.model_dir, score_file=score_file)
+      model_dir=FLAGS.model_dir, score_file=score_file,
+      worker_id=FLAGS.eval_worker_id)
 
 
 def main(unused_argv):
@@ -24,13 +24,26 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import threading
+import time
+
 from absl import logging
 
 from compare_gan import datasets
+from compare_gan import eval_cache
 from compare_gan import eval_utils
 from compare_gan.metrics import eval_task
 
 import numpy as np
+from six.moves import range
+
+
+# Gin bindings that change the real images and must be part of the cache key.
+_REAL_DATA_GIN_BINDINGS = ("eval_imagenet_transform.crop_method",)
+
+# Real image pools of this process by (dataset name, split, num_examples).
+_REAL_IMAGE_POOLS = {}
+_REAL_IMAGE_POOLS_LOCK = threading.Lock()
 
 
 class AccuracyTask(eval_task.EvalTask):
@@ -39,30 +52,79 @@ class AccuracyTask(eval_task.EvalTask):
   def metric_list(self):
     return frozenset([
         "train_accuracy", "test_accuracy", "fake_accuracy", "train_d_loss",
-        "test_d_loss"
+        "test_d_loss", "accuracy_round_secs"
     ])
 
+  def requirements(self):
+    return eval_task.EvalRequirements(real_images=True, in_session=True)
+
   def run_in_session(self, options, sess, gan, real_images):
     del options
     return compute_accuracy_loss(sess, gan, real_images)
 
 
+def get_real_image_pool(dataset, split, num_examples):
+  """Returns a pool of real images that is shared across evaluations.
+
+  The images are read once per process. If the evaluation cache is enabled
+  (see `eval_cache.get_eval_cache()`) they are stored there as uint8 and
+  returned as a read-only memory map, so other processes and later runs don't
+  read the split again.
+
+  Args:
+    dataset: `ImageDataset` object.
+    split: Split of the dataset.
+    num_examples: Maximum number of images in the pool.
+
+  Returns:
+    uint8 NumPy array with up to `num_examples` images in [0, 255].
+  """
+  pool_key = (dataset.name, split, num_examples)
+  with _REAL_IMAGE_POOLS_LOCK:
+    if pool_key not in _REAL_IMAGE_POOLS:
+      def create_pool():
+        return {"images": eval_utils.get_real_images(
+            dataset=dataset,
+            num_examples=num_examples,
+            split=split,
+            failure_on_insufficient_examples=False,
+            dtype=np.uint8)}
+
+      cache = eval_cache.get_eval_cache()
+      if cache is None:
+        pool = create_pool()
+      else:
+        key_values = dict(
+            kind="real_image_pool",
+            dataset=dataset.name,
+            split=str(split),
+            num_examples=num_examples,
+            gin_bindings=eval_cache.get_gin_bindings(_REAL_DATA_GIN_BINDINGS))
+        pool = cache.get_or_create(
+            cache.key(**key_values), create_pool, metadata=key_values)
+      _REAL_IMAGE_POOLS[pool_key] = pool["images"]
+    return _REAL_IMAGE_POOLS[pool_key]
+
+
 def compute_accuracy_loss(sess,
                           gan,
-                          test_images,
+                          test_images=None,
                           max_train_examples=50000,
-                          num_repeat=5):
+                          num_repeat=5,
+                          num_test_examples=10000):
   """Compute discriminator's accuracy and loss on a given dataset.
 
   Args:
     sess: Tf.Session object.
     gan: Any AbstractGAN instance.
-    test_images: numpy array with test images.
+    test_images: numpy array with test images. If None, `num_test_examples`
+                 images from the pool of the "test" split are used.
     max_train_examples: How many "train" examples to get from the dataset.
                         In each round, some of them will be randomly selected
                         to evaluate train set accuracy.
     num_repeat: How many times to repreat the computation.
                 The mean of all the results is reported.
+    num_test_examples: Number of test images if `test_images` is None.
   Returns:
     Dict[Text, float] with all the computed scores.
 
@@ -71,11 +133,10 @@ def compute_accuracy_loss(sess,
                 training images returned by the dataset.
   """
   logging.info("Evaluating training and test accuracy...")
-  train_images = eval_utils.get_real_images(
-      dataset=datasets.get_dataset(),
-      num_examples=max_train_examples,
-      split="train",
-      failure_on_insufficient_examples=False)
+  dataset = datasets.get_dataset()
+  train_images = get_real_image_pool(dataset, "train", max_train_examples)
+  if test_images is None:
+    test_images = get_real_image_pool(dataset, "test", num_test_examples)
   if train_images.shape[0] < test_images.shape[0]:
     raise ValueError("num_train %d must be larger than num_test %d." %
                      (train_images.shape[0], test_images.shape[0]))
@@ -91,13 +152,14 @@ def compute_accuracy_loss(sess,
       "test_accuracy": [],
       "fake_accuracy": [],
       "train_d_loss": [],
-      "test_d_loss": []
+      "test_d_loss": [],
+      "accuracy_round_secs": [],
   }
 
-  for _ in range(num_repeat):
+  bs = gan.batch_size
+  for round_idx in range(num_repeat):
+    start_time = time.time()
     idx = np.random.choice(train_images.shape[0], test_images.shape[0])
-    bs = gan.batch_size
-    train_subset = [train_images[i] for i in idx]
     train_predictions, test_predictions, fake_predictions = [], [], []
     train_d_losses, test_d_losses = [], []
 
@@ -105,8 +167,11 @@ def compute_accuracy_loss(sess,
       z_sample = gan.z_generator(gan.batch_size, gan.z_dim)
       start_idx = i * bs
       end_idx = start_idx + bs
-      test_batch = test_images[start_idx : end_idx]
-      train_batch = train_subset[start_idx : end_idx]
+      test_batch = np.asarray(test_images[start_idx:end_idx], np.float32)
+      # Only the images of the current batch are read from the pool. Sorting
+      # the indices keeps the reads from a memory map local.
+      train_batch = np.asarray(
+          train_images[np.sort(idx[start_idx:end_idx])], np.float32)
 
       test_prediction, test_d_loss, fake_images = sess.run(
           [gan.discriminator_output, gan.d_loss, gan.fake_images],
@@ -138,6 +203,9 @@ def compute_accuracy_loss(sess,
     ret["fake_accuracy"].append(np.array(fake_predictions).mean())
     ret["train_d_loss"].append(np.mean(train_d_losses))
     ret["test_d_loss"].append(np.mean(test_d_losses))
+    ret["accuracy_round_secs"].append(time.time() - start_time)
+    logging.info("Accuracy round %d took %.2f seconds.", round_idx,
+                 ret["accuracy_round_secs"][-1])
 
   for key in ret:
     ret[key] = np.mean(ret[key])
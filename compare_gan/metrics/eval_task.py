@@ -24,6 +24,7 @@ from __future__ import division
 from __future__ import print_function
 
 import abc
+import collections
 
 from absl import flags
 import six
@@ -32,6 +33,48 @@ import tensorflow as tf
 FLAGS = flags.FLAGS
 
 
+# Data that an `EvalTask` reads. The moments of the Inception activations and
+# the Inception Score statistics are always accumulated (their size does not
+# depend on the number of examples) and need not be declared.
+#   fake_images: Whether the pixels of the generated images are read.
+#   fake_activations: Whether the Inception activations of each generated
+#     image are read.
+#   fake_logits: Whether the Inception logits of each generated image are read.
+#   real_images: Whether the pixels of the real images are read.
+#   real_activations: Whether the Inception activations of each real image are
+#     read.
+#   real_logits: Whether the Inception logits of each real image are read.
+#   in_session: Whether the task needs the generator in a session
+#     (`run_in_session()`) instead of the sampled data sets.
+#   num_fake_images: Maximum number of generated images that are read, None
+#     for all of them. Only used if `fake_images` is True.
+EvalRequirements = collections.namedtuple("EvalRequirements", [
+    "fake_images", "fake_activations", "fake_logits", "real_images",
+    "real_activations", "real_logits", "in_session", "num_fake_images"])
+EvalRequirements.__new__.__defaults__ = (False,) * 7 + (None,)
+
+
+def combine_requirements(requirements):
+  """Returns the `EvalRequirements` needed to run several tasks.
+
+  Args:
+    requirements: Iterable of `EvalRequirements`.
+
+  Returns:
+    `EvalRequirements` which requires every input that any element of
+    `requirements` requires.
+  """
+  requirements = list(requirements)
+  combined = {
+      field: any(getattr(r, field) for r in requirements)
+      for field in EvalRequirements._fields if field != "num_fake_images"
+  }
+  num_fake_images = [r.num_fake_images for r in requirements if r.fake_images]
+  if num_fake_images and None not in num_fake_images:
+    combined["num_fake_images"] = max(num_fake_images)
+  return EvalRequirements(**combined)
+
+
 @six.add_metaclass(abc.ABCMeta)
 class EvalTask(object):
   """Class that describes a single evaluation task.
@@ -53,6 +96,79 @@ class EvalTask(object):
     """
     return frozenset(self._LABEL)
 
+  def requirements(self):
+    """Declares the data that run_after_session() reads.
+
+    The evaluation only samples, featurizes and keeps what the tasks declare.
+    The default is derived from `requires_fake_images()` and
+    `requires_fake_features()` and assumes that all data of the real images is
+    read.
+
+    Returns:
+      `EvalRequirements`.
+    """
+    fake_features = self.requires_fake_features()
+    return EvalRequirements(
+        fake_images=self.requires_fake_images(),
+        fake_activations=fake_features,
+        fake_logits=fake_features,
+        real_images=True,
+        real_activations=True,
+        real_logits=True)
+
+  def convergence_metric(self):
+    """Name of the metric that adaptive evaluations monitor or None.
+
+    With adaptive sample sizes (see `GeneratorEvaluator`) the fake data sets
+    grow in chunks until the estimates of the monitored metrics converged.
+    After every chunk run_after_session() is called with the examples so far
+    (without images), so this should only be set for cheap metrics.
+
+    Returns:
+      String or None.
+    """
+    return None
+
+  def convergence_min_examples(self, real_dset):
+    """Minimum number of fake examples for computing `convergence_metric()`.
+
+    Adaptive evaluations only compute the metric once the fake data set has
+    at least this many examples.
+
+    Args:
+      real_dset: `EvalDataSample` with the real images.
+
+    Returns:
+      Integer.
+    """
+    del real_dset
+    return 2
+
+  def requires_fake_images(self):
+    """Whether run_after_session() reads the images of the fake data set.
+
+    Only used by the default `requirements()`. Tasks that only use Inception
+    features should return False. This allows the evaluation to drop the
+    generated images early.
+
+    Returns:
+      Boolean.
+    """
+    return True
+
+  def requires_fake_features(self):
+    """Whether run_after_session() reads the fake activations and logits.
+
+    Only used by the default `requirements()`. Tasks that only need the
+    moments of the activations and the Inception Score statistics (which are
+    accumulated while sampling) should return False. This allows the
+    evaluation to not keep the Inception features of all generated examples.
+
+    Returns:
+      Boolean.
+    """
+    return True
+
   def _create_session(self):
     try:
       target = FLAGS.master
@@ -74,3 +190,21 @@ class EvalTask(object):
       Dict with metric values. The keys must be contained in the set that
       "MetricList" method above returns.
     """
+
+  def run_after_session_on_all(self, fake_dsets, real_dset):
+    """Runs the task for several fake data sets.
+
+    Tasks that can share work between fake data sets (e.g. anything computed
+    from the real data set) can override this to process all of them at once.
+
+    Args:
+      fake_dsets: List of `EvalDataSample`s with fake images and inception
+        features.
+      real_dset: `EvalDataSample` with real images and inception features.
+
+    Returns:
+      List with a dictionary of metric values (see `run_after_session()`) for
+      each element of `fake_dsets`.
+    """
+    return [self.run_after_session(fake_dset, real_dset)
+            for fake_dset in fake_dsets]
@@ -15,19 +15,27 @@
 
 """Implementation of the Frechet Inception Distance.
 
-Implemented as a wrapper around the tf.contrib.gan library. The details can be
-found in "GANs Trained by a Two Time-Scale Update Rule Converge to a Local Nash
-Equilibrium", Heusel et al. [https://arxiv.org/abs/1706.08500].
+`FIDScoreTask` computes the score from the moments of the activations.
+`compute_fid_from_activations()` is a wrapper around the tf.contrib.gan
+library. The details can be found in "GANs Trained by a Two Time-Scale Update
+Rule Converge to a Local Nash Equilibrium", Heusel et al.
+[https://arxiv.org/abs/1706.08500].
 """
 
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import threading
+import weakref
+
 from absl import logging
 
 from compare_gan.metrics import eval_task
+from compare_gan.metrics import running_stats
 
+import numpy as np
+from six.moves import range
 import tensorflow as tf
 import tensorflow_gan as tfgan
 
@@ -41,18 +49,131 @@ class FIDScoreTask(eval_task.EvalTask):
 
   _LABEL = "fid_score"
 
+  def convergence_metric(self):
+    return self._LABEL
+
+  def requirements(self):
+    # Only the moments of the activations are used.
+    return eval_task.EvalRequirements()
+
   def run_after_session(self, fake_dset, real_dset):
-    logging.info("Calculating FID.")
-    with tf.Graph().as_default():
-      fake_activations = tf.convert_to_tensor(fake_dset.activations)
-      real_activations = tf.convert_to_tensor(real_dset.activations)
-      fid = tfgan.eval.frechet_classifier_distance_from_activations(
-          real_activations=real_activations,
-          generated_activations=fake_activations)
-      with self._create_session() as sess:
-        fid = sess.run(fid)
-      logging.info("Frechet Inception Distance: %.3f.", fid)
-      return {self._LABEL: fid}
+    return self.run_after_session_on_all([fake_dset], real_dset)[0]
+
+  def run_after_session_on_all(self, fake_dsets, real_dset):
+    logging.info("Calculating FID for %d fake data sets.", len(fake_dsets))
+    fake_moments = [get_moments(fake_dset) for fake_dset in fake_dsets]
+    fids = get_frechet_distance(real_dset).score_batch(
+        np.stack([mean for mean, _ in fake_moments]),
+        np.stack([cov for _, cov in fake_moments]))
+    logging.info("Frechet Inception Distances: %s.", fids)
+    return [{self._LABEL: float(fid)} for fid in fids]
+
+
+class FrechetDistance(object):
+  """Computes Frechet distances to a fixed reference Gaussian.
+
+  The Frechet distance between N(m1, C1) and N(m2, C2) is
+  ||m1 - m2||^2 + Tr(C1 + C2 - 2 * sqrt(C1 * C2)). The eigenvalues of C1 * C2
+  are the eigenvalues of the symmetric matrix S * C1 * S where S = sqrt(C2).
+  S is computed once from the symmetric eigendecomposition of the reference
+  covariance C2. Every score then only needs the eigenvalues of a symmetric
+  matrix instead of a general matrix square root.
+  """
+
+  def __init__(self, mean, cov):
+    """Creates a new `FrechetDistance`.
+
+    Args:
+      mean: NumPy array of shape [d] with the reference mean.
+      cov: NumPy array of shape [d, d] with the reference covariance.
+    """
+    self._mean = np.asarray(mean, dtype=np.float64)
+    cov = np.asarray(cov, dtype=np.float64)
+    self._trace_cov = np.trace(cov)
+    eigenvalues, eigenvectors = np.linalg.eigh(cov)
+    # The covariance is positive semi-definite. Clip negative eigenvalues from
+    # numerical errors.
+    sqrt_eigenvalues = np.sqrt(np.maximum(eigenvalues, 0.0))
+    self._sqrt_cov = np.dot(eigenvectors * sqrt_eigenvalues, eigenvectors.T)
+
+  def score(self, mean, cov):
+    """Returns the Frechet distance between N(mean, cov) and the reference."""
+    return float(self.score_batch(mean[None], cov[None])[0])
+
+  def score_batch(self, means, covs):
+    """Returns the Frechet distances for a batch of Gaussians.
+
+    Args:
+      means: NumPy array of shape [batch_size, d].
+      covs: NumPy array of shape [batch_size, d, d].
+
+    Returns:
+      NumPy array of shape [batch_size] with the Frechet distances.
+    """
+    means = np.asarray(means, dtype=np.float64)
+    covs = np.asarray(covs, dtype=np.float64)
+    products = np.matmul(np.matmul(self._sqrt_cov, covs), self._sqrt_cov)
+    # Symmetrize to remove asymmetries from rounding before eigvalsh().
+    products = (products + np.swapaxes(products, 1, 2)) / 2.0
+    eigenvalues = np.linalg.eigvalsh(products)
+    trace_sqrt_products = np.sum(np.sqrt(np.maximum(eigenvalues, 0.0)), axis=1)
+    diffs = means - self._mean
+    return (np.sum(diffs * diffs, axis=1) + np.trace(covs, axis1=1, axis2=2) +
+            self._trace_cov - 2.0 * trace_sqrt_products)
+
+
+# Cache of `FrechetDistance` objects for real data sets. Evaluating many
+# checkpoints against the same real data set only computes the
+# eigendecomposition once.
+_FRECHET_DISTANCES = weakref.WeakKeyDictionary()
+_FRECHET_DISTANCES_LOCK = threading.Lock()
+
+
+def get_frechet_distance(real_dset):
+  """Returns the (cached) `FrechetDistance` for an `EvalDataSample`."""
+  with _FRECHET_DISTANCES_LOCK:
+    if real_dset not in _FRECHET_DISTANCES:
+      _FRECHET_DISTANCES[real_dset] = FrechetDistance(*get_moments(real_dset))
+    return _FRECHET_DISTANCES[real_dset]
+
+
+def get_moments(dset, batch_size=1000):
+  """Returns the mean and covariance of the activations of an `EvalDataSample`.
+
+  Uses the precomputed moments if available. Otherwise the activations are
+  folded into a `RunningMeanAndCovariance` in batches.
+
+  Args:
+    dset: `EvalDataSample`.
+    batch_size: Number of activations per update.
+
+  Returns:
+    Tuple (mean, cov) of NumPy arrays.
+  """
+  if dset.mean is not None:
+    return dset.mean, dset.cov
+  moments = running_stats.RunningMeanAndCovariance(dset.activations.shape[1])
+  for start in range(0, dset.activations.shape[0], batch_size):
+    moments.update(dset.activations[start:start + batch_size])
+  return moments.mean, moments.covariance
+
+
+def compute_fid_from_moments(mean1, cov1, mean2, cov2):
+  """Returns the Frechet distance between two Gaussians.
+
+  d^2 = ||mean1 - mean2||^2 + Tr(cov1 + cov2 - 2 * sqrt(cov1 * cov2)).
+
+  Args:
+    mean1: NumPy array with the mean of the first Gaussian.
+    cov1: NumPy array with the covariance of the first Gaussian.
+    mean2: NumPy array with the mean of the second Gaussian.
+    cov2: NumPy array with the covariance of the second Gaussian.
+
+  Returns:
+    A float, the Frechet distance.
+  """
+  return FrechetDistance(mean2, cov2).score(
+      np.asarray(mean1), np.asarray(cov1))
 
 
 def compute_fid_from_activations(fake_activations, real_activations):
@@ -19,12 +19,28 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import time
+
 from compare_gan.metrics import fid_score as fid_score_lib
 
 import numpy as np
+import scipy.linalg
 import tensorflow as tf
 
 
+def _reference_fid(mean1, cov1, mean2, cov2):
+  """FID with a general matrix square root of cov1 * cov2."""
+  sqrt_cov, _ = scipy.linalg.sqrtm(cov1.dot(cov2), disp=False)
+  diff = mean1 - mean2
+  return (diff.dot(diff) + np.trace(cov1) + np.trace(cov2) -
+          2 * np.trace(np.real(sqrt_cov)))
+
+
+def _random_moments(num_features, num_examples, scale=1.0):
+  data = np.random.normal(size=(num_examples, num_features)) * scale
+  return np.mean(data, axis=0), np.cov(data, rowvar=False)
+
+
 class FIDScoreTest(tf.test.TestCase):
 
   def test_fid_computation(self):
@@ -39,5 +55,66 @@ class FIDScoreTest(tf.test.TestCase):
     result = fid_score_lib.compute_fid_from_activations(real_data, gen_data)
     self.assertNear(result, 89.091, 1e-4)
 
+  def test_fid_from_moments_matches_tfgan(self):
+    np.random.seed(0)
+    real_data = np.random.normal(size=(1000, 16))
+    gen_data = np.random.normal(size=(1000, 16)) * 1.5 + 0.3
+    expected = fid_score_lib.compute_fid_from_activations(gen_data, real_data)
+    result = fid_score_lib.compute_fid_from_moments(
+        np.mean(gen_data, axis=0), np.cov(gen_data, rowvar=False),
+        np.mean(real_data, axis=0), np.cov(real_data, rowvar=False))
+    self.assertNear(result, expected, 1e-6)
+
+  def test_frechet_distance_score_batch(self):
+    np.random.seed(0)
+    real_mean, real_cov = _random_moments(32, 500)
+    frechet_distance = fid_score_lib.FrechetDistance(real_mean, real_cov)
+    fake_moments = [_random_moments(32, 500, scale=1.0 + 0.1 * i)
+                    for i in range(3)]
+    scores = frechet_distance.score_batch(
+        np.stack([m for m, _ in fake_moments]),
+        np.stack([c for _, c in fake_moments]))
+    self.assertEqual(scores.shape, (3,))
+    for score, (mean, cov) in zip(scores, fake_moments):
+      self.assertNear(score, _reference_fid(mean, cov, real_mean, real_cov),
+                      1e-6)
+      self.assertNear(frechet_distance.score(mean, cov), score, 1e-9)
+
+  def test_frechet_distance_rank_deficient_covariance(self):
+    np.random.seed(0)
+    # Fewer examples than features gives singular covariance matrices.
+    real_mean, real_cov = _random_moments(64, 20)
+    fake_mean, fake_cov = _random_moments(64, 20, scale=2.0)
+    result = fid_score_lib.FrechetDistance(real_mean, real_cov).score(
+        fake_mean, fake_cov)
+    self.assertNear(
+        result, _reference_fid(fake_mean, fake_cov, real_mean, real_cov), 1e-4)
+
+
+class FrechetDistanceBenchmark(tf.test.Benchmark):
+  """Compares the cached FID engine with scipy.linalg.sqrtm."""
+
+  def benchmark_fid_2048_features(self, num_fake_sets=5):
+    np.random.seed(0)
+    real_mean, real_cov = _random_moments(2048, 4096)
+    fake_moments = [_random_moments(2048, 4096, scale=1.1)
+                    for _ in range(num_fake_sets)]
+
+    start_time = time.time()
+    for mean, cov in fake_moments:
+      _reference_fid(mean, cov, real_mean, real_cov)
+    sqrtm_time = time.time() - start_time
+
+    start_time = time.time()
+    fid_score_lib.FrechetDistance(real_mean, real_cov).score_batch(
+        np.stack([m for m, _ in fake_moments]),
+        np.stack([c for _, c in fake_moments]))
+    engine_time = time.time() - start_time
+
+    self.report_benchmark(
+        name="fid_2048_features", iters=num_fake_sets, wall_time=engine_time,
+        extras={"sqrtm_wall_time": sqrtm_time,
+                "speedup": sqrtm_time / max(engine_time, 1e-12)})
+
 if __name__ == "__main__":
   tf.test.main()
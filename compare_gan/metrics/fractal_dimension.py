@@ -23,6 +23,7 @@ from compare_gan.metrics import eval_task
 
 import numpy as np
 import scipy.spatial
+from six.moves import range
 
 
 class FractalDimensionTask(eval_task.EvalTask):
@@ -30,18 +31,75 @@ class FractalDimensionTask(eval_task.EvalTask):
 
   _LABEL = "fractal_dimension"
 
-  def run_after_session(self, options, eval_data_fake, eval_data_real=None):
-    print(eval_data_fake)
-    score = compute_fractal_dimension(eval_data_fake.images)
+  def __init__(self, use_inception_features=False, seed=42):
+    """Creates a new `FractalDimensionTask`.
+
+    Args:
+      use_inception_features: If True, the fractal dimension is computed on
+        the Inception features of the fake images instead of their pixels.
+      seed: Seed for choosing the random centers. Each run uses its own
+        random state, so results don't depend on other tasks running
+        concurrently.
+    """
+    self._use_inception_features = use_inception_features
+    self._seed = seed
+
+  def requirements(self):
+    return eval_task.EvalRequirements(
+        fake_images=not self._use_inception_features,
+        fake_activations=self._use_inception_features)
+
+  def run_after_session(self, fake_dset, real_dset):
+    del real_dset
+    random_state = np.random.RandomState(self._seed)
+    if self._use_inception_features:
+      score = compute_fractal_dimension(
+          fake_dset.activations, random_state=random_state)
+    else:
+      score = compute_fractal_dimension(
+          fake_dset.images, random_state=random_state)
     return {self._LABEL: score}
 
 
+def _get_sorted_distances(data, seeds, tile_size):
+  """Returns the sorted distances between all points in data and seeds.
+
+  The distances are computed for tiles of `tile_size` points, so besides the
+  num_points * num_seeds result only a tile of the data is converted to
+  float64 at a time.
+
+  Args:
+    data: NumPy array of shape [num_points, dim].
+    seeds: NumPy array of shape [num_seeds, dim].
+    tile_size: Number of points per tile.
+
+  Returns:
+    Sorted NumPy array of shape [num_points * num_seeds].
+  """
+  seeds = seeds.astype(np.float64)
+  distances = np.empty([data.shape[0], seeds.shape[0]])
+  for start in range(0, data.shape[0], tile_size):
+    tile = data[start:start + tile_size].astype(np.float64)
+    distances[start:start + tile.shape[0]] = scipy.spatial.distance.cdist(
+        tile, seeds)
+  distances = distances.ravel()
+  distances.sort()
+  return distances
+
+
 def compute_fractal_dimension(fake_images,
                               num_fd_seeds=100,
                               n_bins=1000,
-                              scale=0.1):
+                              scale=0.1,
+                              tile_size=1000,
+                              random_state=None):
   """Compute Fractal Dimension of fake_images.
 
+  Memory use is linear in the number of images times the number of seeds: the
+  distances to the seeds are computed in tiles and sorted once, and the number
+  of points N(r) within distance r of the seeds is read off the sorted
+  distances with a binary search for every bucket.
+
   Args:
     fake_images: an np array of datapoints, the dimensionality and scaling of
       images can be arbitrary
@@ -50,6 +108,10 @@ def compute_fractal_dimension(fake_images,
      n_bins: number of bins to split the range of distance values into
      scale: the scale of the y interval in the log-log plot for which we apply a
        linear regression fit
+     tile_size: number of datapoints for which the distances to the seeds are
+       computed at once
+     random_state: optional `np.random.RandomState` for choosing the random
+       centers. Defaults to the global NumPy random state.
 
   Returns:
     fractal dimension of the dataset.
@@ -61,13 +123,14 @@ def compute_fractal_dimension(fake_images,
   # In order to apply scipy function we need to flatten the number of dimensions
   # to 2
   fake_images = np.reshape(fake_images, (num_images, -1))
-  fake_images_subset = fake_images[np.random.randint(
+  if random_state is None:
+    random_state = np.random
+  fake_images_subset = fake_images[random_state.randint(
       num_images, size=num_fd_seeds)]
 
-  distances = scipy.spatial.distance.cdist(fake_images,
-                                           fake_images_subset).flatten()
-  min_distance = np.min(distances[np.nonzero(distances)])
-  max_distance = np.max(distances)
+  distances = _get_sorted_distances(fake_images, fake_images_subset, tile_size)
+  min_distance = distances[np.searchsorted(distances, 0, side="right")]
+  max_distance = distances[-1]
   buckets = min_distance * (
       (max_distance / min_distance)**np.linspace(0, 1, n_bins))
   # Create a table where first column corresponds to distances r
@@ -75,7 +138,7 @@ def compute_fractal_dimension(fake_images,
   # within distance r from the random seeds
   fd_result = np.zeros((n_bins - 1, 2))
   fd_result[:, 0] = buckets[1:]
-  fd_result[:, 1] = np.sum(np.less.outer(distances, buckets[1:]), axis=0)
+  fd_result[:, 1] = np.searchsorted(distances, buckets[1:], side="left")
 
   # We compute the slope of the log-log plot at the middle y value
   # which is stored in y_val; the linear regression fit is computed on
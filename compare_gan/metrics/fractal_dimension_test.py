@@ -19,6 +19,7 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+from compare_gan import eval_utils
 from compare_gan.metrics import fractal_dimension as fractal_dimension_lib
 
 import numpy as np
@@ -38,3 +39,29 @@ class FractalDimensionTest(tf.test.TestCase):
     self.assertAllClose(
         fractal_dimension_lib.compute_fractal_dimension(
             np.random.uniform(size=(10000, 2))), 2.0, atol=0.1)
+
+  def test_tile_size_does_not_change_result(self):
+    data = np.random.uniform(size=(2000, 3))
+    np.random.seed(1)
+    expected = fractal_dimension_lib.compute_fractal_dimension(
+        data, tile_size=2000)
+    np.random.seed(1)
+    result = fractal_dimension_lib.compute_fractal_dimension(
+        data, tile_size=77)
+    self.assertAllClose(result, expected)
+
+  def test_task_on_inception_features(self):
+    fake_dset = eval_utils.EvalDataSample(None)
+    fake_dset.set_inception_features(
+        np.random.uniform(size=(10000, 2)), None)
+    task = fractal_dimension_lib.FractalDimensionTask(
+        use_inception_features=True)
+    requirements = task.requirements()
+    self.assertFalse(requirements.fake_images)
+    self.assertTrue(requirements.fake_activations)
+    result = task.run_after_session(fake_dset, None)
+    self.assertAllClose(result["fractal_dimension"], 2.0, atol=0.1)
+
+
+if __name__ == "__main__":
+  tf.test.main()
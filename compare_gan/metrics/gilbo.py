@@ -40,7 +40,7 @@ import matplotlib.pyplot as plt  # pylint: disable=g-import-not-at-top
 import numpy as np
 from pstar import plist
 import scipy.misc
-import six.moves.cPickle as pickle
+import six
 import tensorflow as tf
 import tensorflow_probability as tfp
 
@@ -65,6 +65,9 @@ class GILBOTask(eval_task.EvalTask):
         "gilbo_self_consistency",
     ])
 
+  def requirements(self):
+    return eval_task.EvalRequirements(in_session=True)
+
   def run_in_session(self, options, sess, gan, eval_data_real):
     del eval_data_real
     result_dict = {}
@@ -103,7 +106,7 @@ def train_gilbo(gan, sess, outdir, checkpoint_path, dataset, options):
   Args:
     gan: GAN object.
     sess: tf.Session.
-    outdir: Output directory. A pickle file will be written there.
+    outdir: Output directory. .npz files will be written there.
     checkpoint_path: Path where gan"s checkpoints are written. Only used to
                      ensure that GILBO files are written to a unique
                      subdirectory of outdir.
@@ -167,6 +170,10 @@ def train_gilbo(gan, sess, outdir, checkpoint_path, dataset, options):
     regressor_vars = tf.contrib.framework.get_variables("gilbo/regressor")
     train_op = opt.minimize(-info, var_list=regressor_vars)
 
+    in_graph_loops = None
+    if options.get("gilbo_steps_per_run", 0) > 0:
+      in_graph_loops = _build_in_graph_loops(gan, z_dist, opt, regressor_vars)
+
   # Initialize the variables we just created.
   uninitialized = plist(tf.report_uninitialized_variables().eval())
   uninitialized_vars = uninitialized.apply(
@@ -182,10 +189,11 @@ def train_gilbo(gan, sess, outdir, checkpoint_path, dataset, options):
     # so we will just start training a fresh GILBO model.
     pass
   _train_gilbo(sess, gan, saver, learning_rate, gilbo_step, z_sample, avg_info,
-               z_pred_dist, train_op, outdir, options)
+               z_pred_dist, train_op, outdir, options, in_graph_loops)
 
   mean_eval_info = _eval_gilbo(sess, gan, z_sample, avg_info,
-                               dist_p1, dist_p2, fake_images, outdir, options)
+                               dist_p1, dist_p2, fake_images, outdir, options,
+                               in_graph_loops)
   # Collect encoded distributions on the training and eval set in order to do
   # kl-nearest-neighbors on generated samples and measure consistency.
   dataset = datasets.get_dataset(dataset)
@@ -212,8 +220,64 @@ def train_gilbo(gan, sess, outdir, checkpoint_path, dataset, options):
           mean_self_consistency)
 
 
+def _build_in_graph_loops(gan, z_dist, opt, regressor_vars):
+  """Builds loops running many GILBO steps per session run.
+
+  The prior is sampled in-graph and fed to a copy of the generator subgraph
+  (with gan.z replaced), so no samples are fetched to the host and fed back.
+  Must be called in the "gilbo" variable scope after the regressor and the
+  optimizer slots have been created.
+
+  Args:
+    gan: GAN object.
+    z_dist: Prior distribution.
+    opt: Optimizer of the regressor. Its slots are shared with the train op
+         built outside of the loop.
+    regressor_vars: Variables of the regressor.
+
+  Returns:
+    A dictionary with a "num_steps" placeholder and the "train_info" and
+    "eval_infos" tensors. "train_info" runs num_steps training steps and
+    returns the mean GILBO over the steps. "eval_infos" runs num_steps
+    evaluation steps and returns the GILBO of each step.
+  """
+  num_steps = tf.placeholder(tf.int32, shape=[], name="num_steps")
+  epsneg = np.finfo("float32").epsneg
+
+  def info_for_new_sample():
+    z = z_dist.sample()
+    fake_images = tf.contrib.graph_editor.graph_replace(
+        gan.fake_images, {gan.z: z})
+    with tf.variable_scope("regressor", reuse=True):
+      z_pred_dist = _build_regressor(fake_images, gan.z_dim)
+    z_clip = tf.clip_by_value(z, -(1 - epsneg), 1 - epsneg)
+    return z_pred_dist.log_prob(z_clip) - z_dist.log_prob(z_clip)
+
+  def train_step(step, info_sum):
+    info = info_for_new_sample()
+    train_op = opt.minimize(-info, var_list=regressor_vars)
+    with tf.control_dependencies([train_op]):
+      return step + 1, info_sum + tf.reduce_mean(info)
+
+  def eval_step(step, infos):
+    return step + 1, infos.write(step, tf.reduce_mean(info_for_new_sample()))
+
+  cond = lambda step, _: step < num_steps
+  _, info_sum = tf.while_loop(
+      cond, train_step, [tf.constant(0), tf.constant(0.0)], back_prop=False)
+  _, infos = tf.while_loop(
+      cond, eval_step, [tf.constant(0), tf.TensorArray(tf.float32, num_steps)],
+      back_prop=False)
+  return {
+      "num_steps": num_steps,
+      "train_info": info_sum / tf.cast(num_steps, tf.float32),
+      "eval_infos": infos.stack(),
+  }
+
+
 def _train_gilbo(sess, gan, saver, learning_rate, gilbo_step, z_sample,
-                 avg_info, z_pred_dist, train_op, outdir, options):
+                 avg_info, z_pred_dist, train_op, outdir, options,
+                 in_graph_loops=None):
 
   """Run the training process."""
   lr_scale = options.get("gilbo_lr_scale", 0.5)
@@ -222,6 +286,7 @@ def _train_gilbo(sess, gan, saver, learning_rate, gilbo_step, z_sample,
   min_ai_step_value = options.get("gilbo_min_ai_step_value", 0.5)
   max_train_cycles = options.get("gilbo_max_train_cycles", 50)
   train_steps_per_cycle = options.get("gilbo_train_steps_per_cycle", 10000)
+  steps_per_run = options.get("gilbo_steps_per_run", 0)
 
   ais = [0.0]  # average gilbos (i is for info)
   min_ai = -2.0
@@ -232,15 +297,23 @@ def _train_gilbo(sess, gan, saver, learning_rate, gilbo_step, z_sample,
 
     _save_gilbo(saver, sess, learning_rate, gilbo_step, i, lr, outdir)
     ai = 0.0
-    for j in range(train_steps_per_cycle):
-      if j % (train_steps_per_cycle // 10) == 0:
-        tf.logging.info("step:%d, gilbo:%.3f" % (j, ai))
-      samp = sess.run(z_sample)
-
-      _, z_info = sess.run(
-          [train_op, avg_info],
-          feed_dict={gan.z: samp, learning_rate: lr})
-      ai += (z_info - ai) / (j + 1)
+    if in_graph_loops:
+      for j in range(0, train_steps_per_cycle, steps_per_run):
+        num_steps = min(steps_per_run, train_steps_per_cycle - j)
+        z_info = sess.run(in_graph_loops["train_info"],
+                          feed_dict={in_graph_loops["num_steps"]: num_steps})
+        ai += (z_info - ai) * num_steps / (j + num_steps)
+        tf.logging.info("step:%d, gilbo:%.3f" % (j + num_steps, ai))
+    else:
+      for j in range(train_steps_per_cycle):
+        if j % (train_steps_per_cycle // 10) == 0:
+          tf.logging.info("step:%d, gilbo:%.3f" % (j, ai))
+        samp = sess.run(z_sample)
+
+        _, z_info = sess.run(
+            [train_op, avg_info],
+            feed_dict={gan.z: samp, learning_rate: lr})
+        ai += (z_info - ai) / (j + 1)
     tf.logging.info("cycle:%d gilbo:%.3f min next gilbo:%.3f learning rate:%.3f"
                     % (i, ai, min_ai, lr))
 
@@ -268,7 +341,7 @@ def _train_gilbo(sess, gan, saver, learning_rate, gilbo_step, z_sample,
 
 
 def _eval_gilbo(sess, gan, z_sample, avg_info, dist_p1, dist_p2, fake_images,
-                outdir, options):
+                outdir, options, in_graph_loops=None):
   """Evaluate GILBO on new data from the generative model.
 
   Args:
@@ -281,18 +354,32 @@ def _eval_gilbo(sess, gan, z_sample, avg_info, dist_p1, dist_p2, fake_images,
     dist_p2: Tensor for the second parameter of the distribution
              (e.g., concentration2 for a Beta distribution).
     fake_images: Tensor of images sampled from the GAN.
-    outdir: Output directory. A pickle file will be written there.
+    outdir: Output directory. A NumPy .npz file will be written there.
     options: Options dictionary.
+    in_graph_loops: Optional loops from `_build_in_graph_loops()`. If set, the
+                    steps after the ones whose outputs are saved are run
+                    in-graph.
 
   Returns:
-    The mean GILBO on the evaluation set. Also writes a pickle file saving
+    The mean GILBO on the evaluation set. Also writes an .npz file saving
     distribution parameters and generated images for later analysis.
   """
   eval_steps = options.get("gilbo_eval_steps", 10000)
+  steps_per_run = options.get("gilbo_steps_per_run", 0)
   z_infos = np.zeros(eval_steps, np.float32)
   z_dist_p1s, z_dist_p2s, z_fake_images = [], [], []
   mean_eval_info = 0
   for i in range(eval_steps):
+    if in_graph_loops and i * gan.batch_size >= 1000:
+      # The remaining steps don't save anything but the GILBO, run them
+      # in-graph.
+      for j in range(i, eval_steps, steps_per_run):
+        num_steps = min(steps_per_run, eval_steps - j)
+        z_infos[j:j + num_steps] = sess.run(
+            in_graph_loops["eval_infos"],
+            feed_dict={in_graph_loops["num_steps"]: num_steps})
+        tf.logging.info("eval step:%d gilbo:%3.1f" % (j, z_infos[j]))
+      break
     samp = sess.run(z_sample)
     if i * gan.batch_size < 1000:
       # Save the first 1000 distribution parameters and generated images for
@@ -311,12 +398,11 @@ def _eval_gilbo(sess, gan, z_sample, avg_info, dist_p1, dist_p2, fake_images,
   if eval_steps:
     mean_eval_info = np.mean(np.nan_to_num(z_infos))
     eval_dists = dict(
-        dist_p1=np.array(z_dist_p1s).reshape([-1, 64]),
-        dist_p2=np.array(z_dist_p2s).reshape([-1, 64]),
+        dist_p1=np.array(z_dist_p1s).reshape([-1, gan.z_dim]),
+        dist_p2=np.array(z_dist_p2s).reshape([-1, gan.z_dim]),
         images=np.array(z_fake_images).reshape(
             [-1] + list(z_fake_images[0].shape[1:])))
-    with tf.gfile.Open(os.path.join(outdir, "eval_dists.p"), "w") as f:
-      pickle.dump(eval_dists, f)
+    _save_arrays(eval_dists, os.path.join(outdir, "eval_dists.npz"))
     tf.logging.info("eval gilbo:%3.1f" % mean_eval_info)
 
   return mean_eval_info
@@ -348,8 +434,8 @@ def _run_gilbo_consistency(
     **unused_kw: Unused extra keyword args.
 
   Returns:
-    Symmetric consistency KL. Additionally saves distribution parameters as a
-    pickle as well as any requested images as pngs to outdir.
+    Symmetric consistency KL. Additionally saves distribution parameters as an
+    .npz file as well as any requested images as pngs to outdir.
   """
   with tf.variable_scope("gilbo"):
     with tf.variable_scope("regressor", reuse=True):
@@ -456,13 +542,20 @@ def _run_gilbo_consistency(
       consistency_rkl=np.reshape(consistency_rkls, [-1, gan.batch_size]),
       consistency_skl=np.reshape(consistency_skls, [-1, gan.batch_size]),
   )
-  with tf.gfile.Open(
-      os.path.join(outdir, "%s_consistency_dists.p" % mode), "w") as f:
-    pickle.dump(out_dists, f)
+  _save_arrays(out_dists,
+               os.path.join(outdir, "%s_consistency_dists.npz" % mode))
 
   return np.mean(consistency_skls)
 
 
+def _save_arrays(arrays, filename):
+  """Writes a dictionary of NumPy arrays as a compressed .npz file."""
+  buf = six.BytesIO()
+  np.savez_compressed(buf, **arrays)
+  with tf.gfile.Open(filename, "wb") as f:
+    f.write(buf.getvalue())
+
+
 def _save_image(img, filename):
   # If img is [H W] or [H W 1], stack into [H W 3] for scipy"s api.
   if len(img.shape) == 2 or img.shape[-1] == 1:
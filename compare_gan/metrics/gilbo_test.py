@@ -0,0 +1,148 @@
+# coding=utf-8
+# Copyright 2018 Google LLC & Hwalsuk Lee.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the GILBO score."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from compare_gan.metrics import gilbo
+
+import numpy as np
+import tensorflow as tf
+import tensorflow_probability as tfp
+
+
+_BATCH_SIZE = 4
+_Z_DIM = 3
+_NUM_STEPS = 2
+
+
+class _TinyGan(object):
+  """Generator with a single dense layer producing 16x16 images."""
+
+  def __init__(self):
+    self.batch_size = _BATCH_SIZE
+    self.z_dim = _Z_DIM
+    self.z = tf.placeholder(tf.float32, [_BATCH_SIZE, _Z_DIM], name="z")
+    with tf.variable_scope("generator"):
+      net = tf.layers.dense(self.z, 16 * 16)
+    self.fake_images = tf.reshape(
+        tf.nn.sigmoid(net), [_BATCH_SIZE, 16, 16, 1])
+
+
+class _FixedSamplePrior(object):
+  """Uniform prior whose samples are always `z`.
+
+  Makes the in-graph loops use the same samples as the feed_dict path.
+  """
+
+  def __init__(self, z):
+    ones = tf.ones((_BATCH_SIZE, _Z_DIM))
+    self._dist = tfp.distributions.Independent(
+        tfp.distributions.Uniform(-ones, ones), 1)
+    self._z = z
+
+  def sample(self):
+    return tf.constant(self._z)
+
+  def log_prob(self, z):
+    return self._dist.log_prob(z)
+
+
+class GilboTest(tf.test.TestCase):
+
+  def _build(self, z):
+    """Returns the tensors of the feed_dict path and the in-graph loops."""
+    tf.set_random_seed(42)
+    gan = _TinyGan()
+    prior = _FixedSamplePrior(z)
+    with tf.variable_scope("gilbo"):
+      with tf.variable_scope("regressor"):
+        z_pred_dist = gilbo._build_regressor(gan.fake_images, gan.z_dim)
+      info = z_pred_dist.log_prob(gan.z) - prior.log_prob(gan.z)
+      opt = tf.train.AdamOptimizer(1e-3)
+      regressor_vars = tf.contrib.framework.get_variables("gilbo/regressor")
+      train_op = opt.minimize(-info, var_list=regressor_vars)
+      self.optimizer_variables = opt.variables()
+      self.global_variables = tf.global_variables()
+      loops = gilbo._build_in_graph_loops(gan, prior, opt, regressor_vars)
+    return gan, tf.reduce_mean(info), train_op, regressor_vars, loops
+
+  def test_in_graph_loops_share_optimizer_variables(self):
+    z = np.zeros((_BATCH_SIZE, _Z_DIM), np.float32)
+    gan, _, train_op, _, loops = self._build(z)
+    # The loops must not create new slots or beta accumulators for Adam.
+    self.assertEqual(
+        set(v.name for v in tf.global_variables()),
+        set(v.name for v in self.global_variables))
+    opt_variables = [v for v in tf.global_variables()
+                     if "Adam" in v.name or "beta" in v.name]
+    self.assertNotEmpty(opt_variables)
+    self.assertEqual(set(v.name for v in opt_variables),
+                     set(v.name for v in self.optimizer_variables))
+    beta1_power = [v for v in self.optimizer_variables
+                   if "beta1_power" in v.name][0]
+    with tf.Session() as sess:
+      sess.run(tf.global_variables_initializer())
+      sess.run(train_op, feed_dict={gan.z: z})
+      after_outer_step = sess.run(beta1_power)
+      sess.run(loops["train_info"],
+               feed_dict={loops["num_steps"]: _NUM_STEPS})
+      after_loop = sess.run(beta1_power)
+    # Both the outer train op and the loop advance the same accumulator.
+    self.assertAllClose(after_loop, after_outer_step * 0.9**_NUM_STEPS)
+
+  def test_in_graph_eval_matches_feed_dict(self):
+    z = np.random.RandomState(0).uniform(
+        -0.9, 0.9, size=(_BATCH_SIZE, _Z_DIM)).astype(np.float32)
+    gan, avg_info, _, _, loops = self._build(z)
+    with tf.Session() as sess:
+      sess.run(tf.global_variables_initializer())
+      expected = sess.run(avg_info, feed_dict={gan.z: z})
+      infos = sess.run(loops["eval_infos"],
+                       feed_dict={loops["num_steps"]: _NUM_STEPS})
+    self.assertEqual(infos.shape, (_NUM_STEPS,))
+    self.assertAllClose(infos, [expected] * _NUM_STEPS, rtol=1e-5)
+
+  def test_in_graph_train_matches_feed_dict(self):
+    z = np.random.RandomState(0).uniform(
+        -0.9, 0.9, size=(_BATCH_SIZE, _Z_DIM)).astype(np.float32)
+    gan, avg_info, train_op, regressor_vars, loops = self._build(z)
+    with tf.Session() as sess:
+      sess.run(tf.global_variables_initializer())
+      variables = tf.global_variables()
+      initial_values = sess.run(variables)
+      train_info = sess.run(loops["train_info"],
+                            feed_dict={loops["num_steps"]: _NUM_STEPS})
+      in_graph_values = sess.run(regressor_vars)
+
+      for variable, value in zip(variables, initial_values):
+        variable.load(value, sess)
+      infos = []
+      for _ in range(_NUM_STEPS):
+        _, info = sess.run([train_op, avg_info], feed_dict={gan.z: z})
+        infos.append(info)
+      feed_dict_values = sess.run(regressor_vars)
+    self.assertAllClose(train_info, np.mean(infos), rtol=1e-5)
+    for in_graph_value, feed_dict_value in zip(in_graph_values,
+                                               feed_dict_values):
+      self.assertAllClose(in_graph_value, feed_dict_value, rtol=1e-4,
+                          atol=1e-6)
+
+
+if __name__ == "__main__":
+  tf.test.main()
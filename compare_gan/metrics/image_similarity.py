@@ -109,6 +109,26 @@ def _ssim_helper(x, y, reducer, max_val, compensation=1.0):
       possible allowed value and the minimum allowed value).
     compensation: Compensation factor. See above.
 
+  Returns:
+    A pair containing the luminance measure and the contrast-structure measure.
+  """
+  return _ssim_from_local_moments(
+      reducer(x), reducer(y), reducer(tf.square(x) + tf.square(y)),
+      reducer(x * y), max_val, compensation)
+
+
+def _ssim_from_local_moments(mean0, mean1, mean_squares, mean_product, max_val,
+                             compensation=1.0):
+  """Computes the SSIM measures from local averages. See `_ssim_helper()`.
+
+  Arguments:
+    mean0: Local averages of x.
+    mean1: Local averages of y.
+    mean_squares: Local averages of x ** 2 + y ** 2.
+    mean_product: Local averages of x * y.
+    max_val: The dynamic range.
+    compensation: Compensation factor.
+
   Returns:
     A pair containing the luminance measure and the contrast-structure measure.
   """
@@ -117,8 +137,6 @@ def _ssim_helper(x, y, reducer, max_val, compensation=1.0):
 
   # SSIM luminance measure is
   # (2 * mu_x * mu_y + c1) / (mu_x ** 2 + mu_y ** 2 + c1).
-  mean0 = reducer(x)
-  mean1 = reducer(y)
   num0 = mean0 * mean1 * 2.0
   den0 = tf.square(mean0) + tf.square(mean1)
   luminance = (num0 + c1) / (den0 + c1)
@@ -128,8 +146,8 @@ def _ssim_helper(x, y, reducer, max_val, compensation=1.0):
   # Note that `reducer` is a weighted sum with weight w_k, \sum_i w_i = 1, then
   #   cov_xy = \sum_i w_i (x_i - mu_x) (y_i - mu_y)
   #          = \sum_i w_i x_i y_i - (\sum_i w_i x_i) (\sum_j w_j y_j).
-  num1 = reducer(x * y) * 2.0
-  den1 = reducer(tf.square(x) + tf.square(y))
+  num1 = mean_product * 2.0
+  den1 = mean_squares
   c2 *= compensation
   cs = (num1 - num0 + c2) / (den1 - den0 + c2)
 
@@ -154,8 +172,67 @@ def f_special_gauss(size, sigma):
   return tf.reshape(g, shape=[size, size, 1, 1])
 
 
+def f_special_gauss_1d(size, sigma):
+  """Returns the 1-D factor of `f_special_gauss`.
+
+  The 2-D Gaussian kernel is the outer product of this kernel with itself, so
+  filtering with it is equivalent to filtering the rows and the columns with
+  this kernel.
+
+  Args:
+    size: Size of the kernel.
+    sigma: Width of the Gaussian.
+
+  Returns:
+    Tensor of shape [size].
+  """
+  size = tf.convert_to_tensor(size, tf.int32)
+  sigma = tf.convert_to_tensor(sigma)
+
+  coords = tf.cast(tf.range(size), sigma.dtype)
+  coords -= tf.cast(size - 1, sigma.dtype) / 2.0
+
+  g = tf.square(coords)
+  g *= -0.5 / tf.square(sigma)
+  return tf.nn.softmax(g)
+
+
+def _gaussian_reducer(filter_size, filter_sigma, num_channels, separable=True):
+  """Returns a function computing local averages with a Gaussian kernel.
+
+  Args:
+    filter_size: Integer tensor, the size of the kernel.
+    filter_sigma: Float tensor, the width of the Gaussian.
+    num_channels: Integer tensor, the number of color channels.
+    separable: If True, filters with two 1-D convolutions instead of one 2-D
+      convolution. This needs 2 * filter_size instead of filter_size ** 2
+      multiplications per pixel.
+
+  Returns:
+    Function mapping images of shape [..., H, W, C] to the local averages of
+    shape [..., H - filter_size + 1, W - filter_size + 1, C].
+  """
+  if separable:
+    kernel = f_special_gauss_1d(filter_size, filter_sigma)
+    kernels = [
+        tf.tile(tf.reshape(kernel, [-1, 1, 1, 1]), [1, 1, num_channels, 1]),
+        tf.tile(tf.reshape(kernel, [1, -1, 1, 1]), [1, 1, num_channels, 1]),
+    ]
+  else:
+    kernel = f_special_gauss(filter_size, filter_sigma)
+    kernels = [tf.tile(kernel, multiples=[1, 1, num_channels, 1])]
+
+  def reducer(x):  # pylint: disable=invalid-name
+    shape = tf.shape(x)
+    y = tf.reshape(x, shape=tf.concat([[-1], shape[-3:]], 0))
+    for k in kernels:
+      y = tf.nn.depthwise_conv2d(y, k, strides=[1] * 4, padding='VALID')
+    return tf.reshape(y, tf.concat([shape[:-3], tf.shape(y)[1:]], 0))
+  return reducer
+
+
 def _ssim_index_per_channel(
-    img1, img2, filter_size, filter_width, max_val=255.0):
+    img1, img2, filter_size, filter_width, max_val=255.0, separable=True):
   """Computes SSIM index between img1 and img2 per color channel.
 
   This function matches the standard SSIM implementation found at:
@@ -172,6 +249,7 @@ def _ssim_index_per_channel(
     filter_width: A float, the filter width of the Gaussian kernel used.
     max_val: the dynamic range of the images (i.e., the difference between the
       maximum the and minimum allowed values).
+    separable: Whether to filter with two 1-D convolutions.
 
   Returns:
     A pair of tensors containing batch-wise and channel-wise SSIM and
@@ -188,20 +266,13 @@ def _ssim_index_per_channel(
                  shape2[-3:-1]],
                 axis=0))
 
-  kernel = f_special_gauss(filter_size, filter_sigma)
-  kernel = tf.tile(kernel, multiples=[1, 1, shape1[-1], 1])
+  reducer = _gaussian_reducer(filter_size, filter_sigma, shape1[-1],
+                              separable=separable)
 
   # The correct compensation factor is `1.0 - tf.reduce_sum(tf.square(kernel))`,
   # but to match MATLAB implementation of MS-SSIM, we use 1.0 instead.
   compensation = 1.0
 
-
-  def reducer(x):  # pylint: disable=invalid-name
-    shape = tf.shape(x)
-    x = tf.reshape(x, shape=tf.concat([[-1], shape[-3:]], 0))
-    y = tf.nn.depthwise_conv2d(x, kernel, strides=[1] * 4, padding='VALID')
-    return tf.reshape(y, tf.concat([shape[:-3], tf.shape(y)[1:]], 0))
-
   luminance, cs = _ssim_helper(img1, img2, reducer, max_val, compensation)
 
   # Average over the second and the third from the last: height, width.
@@ -211,19 +282,42 @@ def _ssim_index_per_channel(
   return ssim, cs
 
 
+def _downscale(images):
+  """Halves the resolution of [N, H, W, C] images with 2x2 average pooling.
+
+  Odd heights and widths are first padded symmetrically at the end.
+
+  Args:
+    images: Image batch of rank 4.
+
+  Returns:
+    The downscaled image batch.
+  """
+  divisor = [1, 2, 2, 1]
+  remainder = tf.shape(images)[1:] % tf.constant(divisor[1:], dtype=tf.int32)
+  need_padding = tf.reduce_any(tf.not_equal(remainder, 0))
+  padding = tf.pad(tf.expand_dims(remainder, -1), [[1, 0], [1, 0]])
+  padded = tf.cond(need_padding,
+                   lambda: tf.pad(images, padding, mode='SYMMETRIC'),
+                   lambda: images)
+  return tf.nn.avg_pool(padded, ksize=divisor, strides=divisor, padding='VALID')
+
+
 # This must be a tuple (not a list) because tuples are immutable and we don't
 # want these to accidentally change.
 _MSSSIM_WEIGHTS = (.0448, 0.2856, 0.3001, 0.2363, 0.1333)
 
 
 def multiscale_ssim(
-    img1, img2, filter_size=11, filter_width=1.5, max_val=255.0):
+    img1, img2, filter_size=11, filter_width=1.5, max_val=255.0,
+    separable=True):
   """Computes MS-SSIM with power factors from Wang paper."""
   return _multiscale_ssim_helper(img1, img2,
                                  filter_size=filter_size,
                                  filter_width=filter_width,
                                  max_val=max_val,
-                                 power_factors=_MSSSIM_WEIGHTS)
+                                 power_factors=_MSSSIM_WEIGHTS,
+                                 separable=separable)
 
 
 def multiscale_ssim_unweighted(
@@ -237,7 +331,8 @@ def multiscale_ssim_unweighted(
 
 
 def _multiscale_ssim_helper(
-    img1, img2, filter_size, filter_width, power_factors, max_val=255.0):
+    img1, img2, filter_size, filter_width, power_factors, max_val=255.0,
+    separable=True):
   """Computes the MS-SSIM between img1 and img2.
 
   This function assumes that `img1` and `img2` are image batches, i.e. the last
@@ -254,6 +349,7 @@ def _multiscale_ssim_helper(
       being downsampled by 2.
     max_val: the dynamic range of the images (i.e., the difference between the
       maximum the and minimum allowed values).
+    separable: Whether to filter with two 1-D convolutions.
 
   Returns:
     A tensor containing batch-wise MS-SSIM measure. MS-SSIM has range [0, 1].
@@ -278,14 +374,6 @@ def _multiscale_ssim_helper(
     heads = [s[:-3] for s in shapes]
     tails = [s[-3:] for s in shapes]
 
-    divisor = [1, 2, 2, 1]
-    divisor_tensor = tf.constant(divisor[1:], dtype=tf.int32)
-
-    def do_pad(images, remainder):  # pylint: disable=invalid-name
-      padding = tf.expand_dims(remainder, -1)
-      padding = tf.pad(padding, [[1, 0], [1, 0]])
-      return [tf.pad(x, padding, mode='SYMMETRIC') for x in images]
-
     mcs = []
     for k in range(len(power_factors)):
       with tf.name_scope(None, 'Scale%d' % k, imgs):
@@ -295,20 +383,7 @@ def _multiscale_ssim_helper(
               tf.reshape(x, tf.concat([[-1], t], 0))
               for x, t in zip(imgs, tails)
           ]
-
-          remainder = tails[0] % divisor_tensor
-          need_padding = tf.reduce_any(tf.not_equal(remainder, 0))
-          # pylint: disable=cell-var-from-loop
-          padded = tf.cond(need_padding,
-                           lambda: do_pad(flat_imgs, remainder),
-                           lambda: flat_imgs)
-          # pylint: enable=cell-var-from-loop
-
-          downscaled = [
-              tf.nn.avg_pool(
-                  x, ksize=divisor, strides=divisor, padding='VALID')
-              for x in padded
-          ]
+          downscaled = [_downscale(x) for x in flat_imgs]
           tails = [x[1:] for x in tf.shape_n(downscaled)]
           imgs = [
               tf.reshape(x, tf.concat([h, t], 0))
@@ -319,7 +394,7 @@ def _multiscale_ssim_helper(
         ssim, cs = _ssim_index_per_channel(
             *imgs,
             filter_size=filter_size, filter_width=filter_width,
-            max_val=max_val)
+            max_val=max_val, separable=separable)
         mcs.append(tf.nn.relu(cs))
 
     # Remove the cs score for the last scale. In the MS-SSIM calculation,
@@ -331,3 +406,64 @@ def _multiscale_ssim_helper(
 
     ms_ssim = tf.reduce_mean(ms_ssim, [-1])  # Average over color channels.
     return ms_ssim
+
+
+def multiscale_ssim_for_pairs(
+    images, first, second, filter_size=11, filter_width=1.5, max_val=255.0,
+    power_factors=_MSSSIM_WEIGHTS):
+  """Computes the MS-SSIM between pairs of images from one batch.
+
+  This is equivalent to
+  `multiscale_ssim(tf.gather(images, first), tf.gather(images, second))`, but
+  the scale pyramid and the local means and second moments are computed once
+  per image instead of once per pair. Only the local averages of the products
+  of the image pairs are computed per pair. This is much cheaper when every
+  image takes part in many pairs, e.g. for all pairs of a batch.
+
+  Args:
+    images: Image batch of shape [N, H, W, C].
+    first: Integer tensor of shape [num_pairs] with indices into `images`.
+    second: Integer tensor of shape [num_pairs] with indices into `images`.
+    filter_size: An integer, the filter size of the Gaussian kernel used.
+    filter_width: A float, the filter width of the Gaussian kernel used.
+    max_val: the dynamic range of the images (i.e., the difference between the
+      maximum the and minimum allowed values).
+    power_factors: iterable of weightings for each of the scales.
+
+  Returns:
+    A tensor of shape [num_pairs] with the MS-SSIM of each pair.
+  """
+  images.get_shape().assert_has_rank(4)
+  with tf.name_scope(None, 'MS-SSIM-Pairs', [images, first, second]):
+    filter_sigma = tf.constant(filter_width, dtype=images.dtype)
+    mcs = []
+    for k in range(len(power_factors)):
+      with tf.name_scope(None, 'Scale%d' % k, [images]):
+        if k > 0:
+          images = _downscale(images)
+        shape = tf.shape(images)
+        size = tf.reduce_min(tf.stack([filter_size, shape[1], shape[2]]))
+        reducer = _gaussian_reducer(size, filter_sigma, shape[3])
+        # Per image local averages.
+        means = reducer(images)
+        mean_squares = reducer(tf.square(images))
+        # Per pair local averages.
+        mean_products = reducer(
+            tf.gather(images, first) * tf.gather(images, second))
+        luminance, cs = _ssim_from_local_moments(
+            tf.gather(means, first), tf.gather(means, second),
+            tf.gather(mean_squares, first) + tf.gather(mean_squares, second),
+            mean_products, max_val)
+        ssim = tf.reduce_mean(luminance * cs, [1, 2])
+        cs = tf.reduce_mean(cs, [1, 2])
+        mcs.append(tf.nn.relu(cs))
+
+    # Remove the cs score for the last scale. In the MS-SSIM calculation,
+    # we use the l(p) at the highest scale. l(p) * cs(p) is ssim(p).
+    mcs.pop()
+    mcs_and_ssim = tf.stack(mcs + [tf.nn.relu(ssim)], axis=-1)
+    # Take weighted geometric mean across the scale axis.
+    ms_ssim = tf.reduce_prod(tf.pow(mcs_and_ssim, power_factors), [-1])
+
+    ms_ssim = tf.reduce_mean(ms_ssim, [-1])  # Average over color channels.
+    return ms_ssim
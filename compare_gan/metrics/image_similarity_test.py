@@ -0,0 +1,128 @@
+# coding=utf-8
+# Copyright 2018 Google LLC & Hwalsuk Lee.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the image similarity metrics."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import time
+
+from compare_gan.metrics import image_similarity
+
+import numpy as np
+from six.moves import range
+import tensorflow as tf
+
+
+def _random_images(num_images, height, width, seed=0):
+  # Smooth random images give SSIM values in the interesting range.
+  images = np.random.RandomState(seed).uniform(
+      0, 255, size=(num_images, height // 4 + 1, width // 4 + 1, 3))
+  images = np.repeat(np.repeat(images, 4, axis=1), 4, axis=2)
+  return images[:, :height, :width].astype(np.float32)
+
+
+class ImageSimilarityTest(tf.test.TestCase):
+
+  def test_separable_gaussian_matches_2d_gaussian(self):
+    with self.test_session() as sess:
+      kernel_1d = image_similarity.f_special_gauss_1d(11, 1.5)
+      kernel_2d = image_similarity.f_special_gauss(11, 1.5)
+      kernel_1d, kernel_2d = sess.run([kernel_1d, kernel_2d])
+    self.assertAllClose(np.outer(kernel_1d, kernel_1d),
+                        kernel_2d[:, :, 0, 0], atol=1e-7)
+
+  def test_separable_ssim_matches_2d_ssim(self):
+    images = _random_images(4, 32, 32)
+    with self.test_session() as sess:
+      img1 = tf.constant(images[:2])
+      img2 = tf.constant(images[2:])
+      separable = image_similarity._ssim_index_per_channel(
+          img1, img2, filter_size=11, filter_width=1.5, separable=True)
+      full = image_similarity._ssim_index_per_channel(
+          img1, img2, filter_size=11, filter_width=1.5, separable=False)
+      separable, full = sess.run([separable, full])
+    self.assertAllClose(separable[0], full[0], atol=1e-5)
+    self.assertAllClose(separable[1], full[1], atol=1e-5)
+
+  def test_separable_multiscale_ssim_matches_2d_multiscale_ssim(self):
+    # 72x52 needs padding before downscaling at some scales.
+    images = _random_images(6, 72, 52)
+    with self.test_session() as sess:
+      img1 = tf.constant(images[:3])
+      img2 = tf.constant(images[3:])
+      separable, full = sess.run([
+          image_similarity.multiscale_ssim(img1, img2, separable=True),
+          image_similarity.multiscale_ssim(img1, img2, separable=False)])
+    self.assertAllClose(separable, full, atol=1e-5)
+
+  def test_multiscale_ssim_for_pairs_matches_multiscale_ssim(self):
+    images = _random_images(8, 64, 64)
+    first, second = np.triu_indices(8, k=1)
+    with self.test_session() as sess:
+      images = tf.constant(images)
+      expected = image_similarity.multiscale_ssim(
+          tf.gather(images, first), tf.gather(images, second),
+          separable=False)
+      result = image_similarity.multiscale_ssim_for_pairs(
+          images, first, second)
+      expected, result = sess.run([expected, result])
+    self.assertEqual(result.shape, (28,))
+    self.assertAllClose(result, expected, atol=1e-5)
+
+  def test_multiscale_ssim_for_identical_pairs_is_one(self):
+    images = _random_images(3, 64, 64)
+    with self.test_session() as sess:
+      result = sess.run(image_similarity.multiscale_ssim_for_pairs(
+          tf.constant(images), [0, 1, 2], [0, 1, 2]))
+    self.assertAllClose(result, [1.0, 1.0, 1.0], atol=1e-5)
+
+
+class MultiscaleSSIMBenchmark(tf.test.Benchmark):
+  """Compares all-pairs MS-SSIM of a batch with the previous implementation."""
+
+  def _time(self, sess, op, num_iters):
+    sess.run(op)
+    start_time = time.time()
+    for _ in range(num_iters):
+      sess.run(op)
+    return (time.time() - start_time) / num_iters
+
+  def benchmark_all_pairs_64x64(self, batch_size=64, num_iters=3):
+    images = _random_images(batch_size, 64, 64)
+    first, second = np.triu_indices(batch_size, k=1)
+    with tf.Graph().as_default(), tf.Session() as sess:
+      images = tf.constant(images)
+      pairs = [tf.gather(images, first), tf.gather(images, second)]
+      full_time = self._time(sess, tf.reduce_sum(
+          image_similarity.multiscale_ssim(*pairs, separable=False)),
+                             num_iters)
+      separable_time = self._time(sess, tf.reduce_sum(
+          image_similarity.multiscale_ssim(*pairs, separable=True)),
+                                  num_iters)
+      pyramid_time = self._time(sess, tf.reduce_sum(
+          image_similarity.multiscale_ssim_for_pairs(images, first, second)),
+                                num_iters)
+    self.report_benchmark(
+        name="all_pairs_64x64", iters=num_iters, wall_time=pyramid_time,
+        extras={"full_2d_wall_time": full_time,
+                "separable_wall_time": separable_time,
+                "speedup": full_time / max(pyramid_time, 1e-12)})
+
+
+if __name__ == "__main__":
+  tf.test.main()
@@ -15,8 +15,9 @@
 
 """Implementation of the Inception Score.
 
-Implemented as a wrapper around the tensorflow_gan library. The details can be
-found in "Improved Techniques for Training GANs", Salimans et al.
+Computed from accumulated statistics of the logits, see
+`running_stats.RunningInceptionScore`. The details can be found in "Improved
+Techniques for Training GANs", Salimans et al.
 [https://arxiv.org/abs/1606.03498].
 """
 
@@ -27,8 +28,8 @@ from __future__ import print_function
 from absl import logging
 
 from compare_gan.metrics import eval_task
-import tensorflow as tf
-import tensorflow_gan as tfgan
+from compare_gan.metrics import running_stats
+from six.moves import range
 
 
 class InceptionScoreTask(eval_task.EvalTask):
@@ -36,13 +37,37 @@ class InceptionScoreTask(eval_task.EvalTask):
 
   _LABEL = "inception_score"
 
+  def convergence_metric(self):
+    return self._LABEL
+
+  def requirements(self):
+    # Only the accumulated Inception Score statistics are used.
+    return eval_task.EvalRequirements()
+
   def run_after_session(self, fake_dset, real_dest):
     del real_dest
     logging.info("Computing inception score.")
-    with tf.Graph().as_default():
-      fake_logits = tf.convert_to_tensor(fake_dset.logits)
-      inception_score = tfgan.eval.classifier_score_from_logits(fake_logits)
-      with self._create_session() as sess:
-        inception_score = sess.run(inception_score)
-      logging.info("Inception score: %.3f", inception_score)
+    inception_score = get_inception_score_stats(fake_dset).score()
+    logging.info("Inception score: %.3f", inception_score)
     return {self._LABEL: inception_score}
+
+
+def get_inception_score_stats(dset, batch_size=1000):
+  """Returns a `RunningInceptionScore` for the logits of an `EvalDataSample`.
+
+  Uses the accumulated statistics if available. Otherwise the logits are
+  folded into a new `RunningInceptionScore` in batches.
+
+  Args:
+    dset: `EvalDataSample`.
+    batch_size: Number of logits per update.
+
+  Returns:
+    `RunningInceptionScore`.
+  """
+  if dset.inception_score_stats is not None:
+    return dset.inception_score_stats
+  stats = running_stats.RunningInceptionScore(dset.logits.shape[1])
+  for start in range(0, dset.logits.shape[0], batch_size):
+    stats.update(dset.logits[start:start + batch_size])
+  return stats
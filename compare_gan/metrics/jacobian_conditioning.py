@@ -50,6 +50,9 @@ class GeneratorConditionNumberTask(eval_task.EvalTask):
         self._CONDITION_NUMBER_STD
     ])
 
+  def requirements(self):
+    return eval_task.EvalRequirements(in_session=True)
+
   def run_in_session(self, options, sess, gan, real_images):
     del options, real_images
     result_dict = {}
@@ -85,36 +88,66 @@ def compute_generator_condition_number(sess, gan):
   return result_dict["metric_tensor"]["log_condition_number"]
 
 
-def compute_jacobian(xs, fx):
+def _jacobian_vector_product(xs, fx, vs):
+  """Computes the Jacobian-vector product (df/dx) vs.
+
+  Uses the double-gradient trick: for a dummy u with the shape of fx,
+  g(u) = tf.gradients(fx, xs, grad_ys=u) = (df/dx)^T u is linear in u, and its
+  gradient with respect to u in the direction vs is (df/dx) vs.
+
+  Args:
+    xs: input tensor.
+    fx: f(x) tensor.
+    vs: direction tensor with the shape of xs.
+
+  Returns:
+    Tensor with the shape of fx.
+  """
+  u = tf.zeros_like(fx)
+  g = tf.gradients(fx, xs, grad_ys=u)[0]
+  jvp = tf.gradients(g, u, grad_ys=vs)[0]
+  if jvp is None:
+    return tf.zeros_like(fx)
+  return jvp
+
+
+def compute_jacobian(xs, fx, parallel_iterations=10):
   """Computes df/dx matrix.
 
-  We assume x and fx are both batched, so the shape of the Jacobian is:
+  We assume x and fx are both batched and that the examples of the batch are
+  independent, so the shape of the Jacobian is:
   [fx.shape[0]] + fx.shape[1:] + xs.shape[1:]
 
-  This function computes the grads inside a TF loop so that we don't
-  end up storing many extra copies of the function we are taking the
-  Jacobian of.
+  The Jacobian is computed column by column with one forward-mode directional
+  derivative per dimension of x. For a generator this needs z_dim iterations
+  instead of one gradient per output pixel. The directions are processed
+  inside a TF loop so that we don't end up storing many extra copies of the
+  function we are taking the Jacobian of.
 
   Args:
-    xs: input tensor(s) of arbitrary shape.
-    fx: f(x) tensor of arbitrary shape.
+    xs: input tensor of shape [batch, x_dim].
+    fx: f(x) tensor of shape [batch, fx_dim].
+    parallel_iterations: Number of directions that are computed in parallel.
+      Bounds the memory use to this many Jacobian columns.
 
   Returns:
     df/dx tensor of shape [fx.shape[0], fx.shape[1], xs.shape[1]].
   """
-  # Declares an iterator and tensor array loop variables for the gradients.
-  n = fx.get_shape().as_list()[1]
-  loop_vars = [tf.constant(0, tf.int32), tf.TensorArray(xs.dtype, n)]
+  # Declares an iterator and tensor array loop variables for the columns.
+  n = xs.get_shape().as_list()[1]
+  loop_vars = [tf.constant(0, tf.int32), tf.TensorArray(fx.dtype, n)]
 
   def accumulator(j, result):
-    return (j + 1, result.write(j, tf.gradients(fx[:, j], xs)[0]))
+    vs = tf.ones_like(xs) * tf.one_hot(j, n, dtype=xs.dtype)
+    return (j + 1, result.write(j, _jacobian_vector_product(xs, fx, vs)))
 
-  # Iterates over all elements of the gradient and computes all partial
+  # Iterates over all dimensions of x and computes all directional
   # derivatives.
-  _, df_dxs = tf.while_loop(lambda j, _: j < n, accumulator, loop_vars)
+  _, df_dxs = tf.while_loop(lambda j, _: j < n, accumulator, loop_vars,
+                            parallel_iterations=parallel_iterations)
 
   df_dx = df_dxs.stack()
-  df_dx = tf.transpose(df_dx, perm=[1, 0, 2])
+  df_dx = tf.transpose(df_dx, perm=[1, 2, 0])
 
   return df_dx
 
@@ -122,19 +155,27 @@ def compute_jacobian(xs, fx):
 def _analyze_metric_tensor(metric_tensor):
   """Analyzes a metric tensor.
 
+  The metric tensor J^T J is symmetric positive semi-definite, so its
+  eigenvalues are computed with `eigvalsh`. The absolute values of the
+  eigenvalues are its singular values, which give the condition number and
+  the log determinant.
+
   Args:
     metric_tensor: A numpy array of shape [batch, dim, dim]
 
   Returns:
     A dict containing spectral statstics.
   """
-  # eigenvalues will have shape [batch, dim].
-  eigenvalues, _ = np.linalg.eig(metric_tensor)
+  # eigenvalues will have shape [batch, dim], in ascending order.
+  eigenvalues = np.linalg.eigvalsh(metric_tensor)
+  singular_values = np.abs(eigenvalues)
 
   # Shape [batch,].
-  condition_number = np.linalg.cond(metric_tensor)
-  log_condition_number = np.log(condition_number)
-  (_, logdet) = np.linalg.slogdet(metric_tensor)
+  with np.errstate(divide="ignore"):
+    log_singular_values = np.log(singular_values)
+  log_condition_number = (np.max(log_singular_values, axis=-1) -
+                          np.min(log_singular_values, axis=-1))
+  logdet = np.sum(log_singular_values, axis=-1)
 
   return {
       "eigenvalues": eigenvalues,
@@ -124,6 +124,17 @@ class JacobianConditioningTest(tf.test.TestCase):
     self.assertAllEqual(result_dict['log_condition_number'].shape,
                         [_BATCH_SIZE])
 
+  def test_analyze_metric_tensor_matches_general_routines(self):
+    jacobian = np.random.normal(0, 1, (_BATCH_SIZE, 20, 10))
+    metric_tensor = np.matmul(np.transpose(jacobian, [0, 2, 1]), jacobian)
+    result_dict = jacobian_conditioning._analyze_metric_tensor(metric_tensor)
+    self.assertAllClose(result_dict['log_condition_number'],
+                        np.log(np.linalg.cond(metric_tensor)))
+    self.assertAllClose(result_dict['logdet'],
+                        np.linalg.slogdet(metric_tensor)[1])
+    self.assertAllClose(np.sort(result_dict['eigenvalues'], axis=-1),
+                        np.sort(np.linalg.eigvals(metric_tensor).real, axis=-1))
+
   def test_analyze_jacobian(self):
     m = mock.patch.object(
         jacobian_conditioning, '_analyze_metric_tensor', new=lambda x: x)
@@ -24,10 +24,16 @@ from __future__ import division
 from __future__ import print_function
 
 import math
+import multiprocessing.pool
+import threading
+import weakref
+
+from absl import logging
 
 from compare_gan.metrics import eval_task
 
 import numpy as np
+from six.moves import range
 import tensorflow as tf
 
 
@@ -35,10 +41,193 @@ class KIDScoreTask(eval_task.EvalTask):
   """Evaluation task for the KID score."""
 
   _LABEL = "kid_score"
+  _STDERR_LABEL = "kid_score_stderr"
+
+  def metric_list(self):
+    return frozenset([self._LABEL, self._STDERR_LABEL])
+
+  def convergence_metric(self):
+    return self._LABEL
+
+  def convergence_min_examples(self, real_dset):
+    return get_kernel_inception_distance(real_dset).min_fake_examples()
+
+  def requirements(self):
+    return eval_task.EvalRequirements(
+        fake_activations=True, real_activations=True)
 
   def run_after_session(self, fake_dset, real_dset):
-    score = kid(fake_dset.activations, real_dset.activations)
-    return {self._LABEL: score}
+    score, stderr = get_kernel_inception_distance(real_dset).score(
+        fake_dset.activations, return_stderr=True)
+    logging.info("Kernel Inception Distance: %.5f (+- %.5f).", score, stderr)
+    return {self._LABEL: score, self._STDERR_LABEL: stderr}
+
+
+def _split_into_bins(num_examples, num_bins):
+  """Returns sizes of `num_bins` approximately-equally-sized blocks."""
+  bins = np.full(num_bins, int(math.ceil(num_examples / num_bins)))
+  bins[:(num_bins * bins[0]) - num_examples] -= 1
+  if bins.min() < 2:
+    raise ValueError("The KID needs at least 2 examples per block but got %d "
+                     "examples for %d blocks." % (num_examples, num_bins))
+  return bins
+
+
+def _polynomial_kernel_sums(x, y, dim, exclude_diagonal=False):
+  """Returns sum((x y^T / dim + 1)^3) in float64.
+
+  Args:
+    x: [n, dim] NumPy array.
+    y: [m, dim] NumPy array.
+    dim: Number of features.
+    exclude_diagonal: If True, x and y must be the same array and the diagonal
+      of the kernel matrix is not included in the sum.
+
+  Returns:
+    A float.
+  """
+  kernel = np.dot(x, y.T)
+  kernel /= dim
+  kernel += 1
+  kernel **= 3
+  total = np.sum(kernel, dtype=np.float64)
+  if exclude_diagonal:
+    total -= np.sum(np.diagonal(kernel), dtype=np.float64)
+  return total
+
+
+class KernelInceptionDistance(object):
+  """Unbiased block estimator of the KID to a fixed set of real activations.
+
+  This is a NumPy implementation of `kid()`. The kernel matrices are computed
+  block by block with BLAS (in float32 by default) and the blocks are
+  processed by a pool of threads. The real-real kernel terms do not depend on
+  the fake activations and are cached per number of blocks, so only the
+  real-fake and fake-fake terms are computed for every new set of fake
+  activations.
+  """
+
+  def __init__(self, real_activations, max_batch_size=1024, dtype=np.float32,
+               num_threads=4):
+    """Creates a new `KernelInceptionDistance`.
+
+    Args:
+      real_activations: [num_real, num_features] NumPy array with inception
+        features. Must be in random order.
+      max_batch_size: Maximum block size.
+      dtype: Type used for the kernel matrices. The block sums are accumulated
+        in float64.
+      num_threads: Number of threads computing blocks in parallel.
+    """
+    self._real_activations = np.asarray(real_activations, dtype=dtype)
+    self._max_batch_size = max_batch_size
+    self._dtype = dtype
+    self._num_threads = num_threads
+    # Mean over the off-diagonal real-real kernel values of each block, keyed
+    # by the number of blocks.
+    self._real_block_means = {}
+    self._lock = threading.Lock()
+
+  def _map_blocks(self, fn, num_bins):
+    if self._num_threads <= 1 or num_bins == 1:
+      return [fn(i) for i in range(num_bins)]
+    pool = multiprocessing.pool.ThreadPool(min(self._num_threads, num_bins))
+    try:
+      return pool.map(fn, range(num_bins))
+    finally:
+      pool.close()
+
+  def _get_real_block_means(self, num_bins):
+    with self._lock:
+      if num_bins not in self._real_block_means:
+        n_real, dim = self._real_activations.shape
+        inds_r = np.r_[0, np.cumsum(_split_into_bins(n_real, num_bins))]
+
+        def real_block_mean(i):
+          r = self._real_activations[inds_r[i]:inds_r[i + 1]]
+          m = r.shape[0]
+          return _polynomial_kernel_sums(
+              r, r, dim, exclude_diagonal=True) / (m * (m - 1))
+
+        self._real_block_means[num_bins] = np.array(
+            self._map_blocks(real_block_mean, num_bins))
+      return self._real_block_means[num_bins]
+
+  def min_fake_examples(self):
+    """Returns the minimum number of fake activations for `score()`."""
+    num_bins = int(math.ceil(
+        self._real_activations.shape[0] / self._max_batch_size))
+    return 2 * num_bins
+
+  def score(self, fake_activations, return_stderr=False):
+    """Returns the KID between the fake and the real activations.
+
+    Args:
+      fake_activations: [num_fake, num_features] NumPy array with inception
+        features. Must be in random order.
+      return_stderr: If true, also returns an estimate of the standard error.
+        This is nan if there are fewer than 5 blocks.
+
+    Returns:
+      KID score (and optionally std error) as floats.
+
+    Raises:
+      ValueError: If there are fewer than `min_fake_examples()` fake
+        activations.
+    """
+    fake_activations = np.asarray(fake_activations, dtype=self._dtype)
+    n_real, dim = self._real_activations.shape
+    n_gen, dim2 = fake_activations.shape
+    assert dim2 == dim
+
+    num_bins = int(math.ceil(max(n_real, n_gen) / self._max_batch_size))
+    inds_r = np.r_[0, np.cumsum(_split_into_bins(n_real, num_bins))]
+    inds_g = np.r_[0, np.cumsum(_split_into_bins(n_gen, num_bins))]
+    real_block_means = self._get_real_block_means(num_bins)
+
+    def fake_block_terms(i):
+      r = self._real_activations[inds_r[i]:inds_r[i + 1]]
+      g = fake_activations[inds_g[i]:inds_g[i + 1]]
+      m = r.shape[0]
+      n = g.shape[0]
+      mean_rg = _polynomial_kernel_sums(r, g, dim) / (m * n)
+      mean_gg = _polynomial_kernel_sums(
+          g, g, dim, exclude_diagonal=True) / (n * (n - 1))
+      return mean_gg - 2 * mean_rg
+
+    ests = real_block_means + np.array(
+        self._map_blocks(fake_block_terms, num_bins))
+    score = float(np.mean(ests))
+    if not return_stderr:
+      return score
+    if num_bins < 5:
+      return score, np.nan
+    return score, float(np.sqrt(np.var(ests) / num_bins))
+
+
+# Cache of `KernelInceptionDistance` objects for real data sets. Evaluating
+# many checkpoints against the same real data set only computes the real-real
+# kernel terms once.
+_KERNEL_INCEPTION_DISTANCES = weakref.WeakKeyDictionary()
+_KERNEL_INCEPTION_DISTANCES_LOCK = threading.Lock()
+
+
+def get_kernel_inception_distance(real_dset):
+  """Returns the (cached) `KernelInceptionDistance` for an `EvalDataSample`."""
+  with _KERNEL_INCEPTION_DISTANCES_LOCK:
+    if real_dset not in _KERNEL_INCEPTION_DISTANCES:
+      _KERNEL_INCEPTION_DISTANCES[real_dset] = KernelInceptionDistance(
+          real_dset.activations)
+    return _KERNEL_INCEPTION_DISTANCES[real_dset]
+
+
+def kid_np(fake_activations, real_activations, max_batch_size=1024,
+           dtype=np.float32, return_stderr=False, num_threads=4):
+  """NumPy version of `kid()`. See `KernelInceptionDistance`."""
+  return KernelInceptionDistance(
+      real_activations, max_batch_size=max_batch_size, dtype=dtype,
+      num_threads=num_threads).score(
+          fake_activations, return_stderr=return_stderr)
 
 
 def kid(fake_activations,
@@ -95,12 +284,8 @@ def kid(fake_activations,
 
   # split into largest approximately-equally-sized blocks
   n_bins = int(math.ceil(max(n_real, n_gen) / max_batch_size))
-  bins_r = np.full(n_bins, int(math.ceil(n_real / n_bins)))
-  bins_g = np.full(n_bins, int(math.ceil(n_gen / n_bins)))
-  bins_r[:(n_bins * bins_r[0]) - n_real] -= 1
-  bins_g[:(n_bins * bins_r[0]) - n_gen] -= 1
-  assert bins_r.min() >= 2
-  assert bins_g.min() >= 2
+  bins_r = _split_into_bins(n_real, n_bins)
+  bins_g = _split_into_bins(n_gen, n_bins)
 
   inds_r = tf.constant(np.r_[0, np.cumsum(bins_r)])
   inds_g = tf.constant(np.r_[0, np.cumsum(bins_g)])
@@ -127,7 +312,7 @@ def kid(fake_activations,
     g_s = inds_g[i]
     g_e = inds_g[i + 1]
     g = fake_activations[g_s:g_e]
-    n = tf.cast(r_e - r_s, dtype)
+    n = tf.cast(g_e - g_s, dtype)
 
     # Could probably do this a bit faster...
     k_rr = (tf.matmul(r, r, transpose_b=True) / dim_ + 1)**3
@@ -0,0 +1,102 @@
+# coding=utf-8
+# Copyright 2018 Google LLC & Hwalsuk Lee.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the KID score."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from compare_gan.metrics import kid_score as kid_score_lib
+
+import numpy as np
+import tensorflow as tf
+
+
+def _reference_kid(fake_activations, real_activations):
+  """Unbiased MMD^2 with the polynomial kernel, computed in a single block."""
+  dim = real_activations.shape[1]
+  def kernel(x, y):
+    return (np.dot(x, y.T) / dim + 1) ** 3
+  k_rr = kernel(real_activations, real_activations)
+  k_gg = kernel(fake_activations, fake_activations)
+  k_rg = kernel(real_activations, fake_activations)
+  m = real_activations.shape[0]
+  n = fake_activations.shape[0]
+  return ((np.sum(k_rr) - np.trace(k_rr)) / (m * (m - 1)) +
+          (np.sum(k_gg) - np.trace(k_gg)) / (n * (n - 1)) -
+          2 * np.mean(k_rg))
+
+
+class KIDScoreTest(tf.test.TestCase):
+
+  def setUp(self):
+    super(KIDScoreTest, self).setUp()
+    np.random.seed(0)
+    self.real_activations = np.random.normal(size=(1000, 16))
+    self.fake_activations = np.random.normal(size=(800, 16)) * 1.2 + 0.1
+
+  def test_kid_np_single_block_matches_reference(self):
+    result = kid_score_lib.kid_np(
+        self.fake_activations, self.real_activations, max_batch_size=1000,
+        dtype=np.float64)
+    expected = _reference_kid(self.fake_activations, self.real_activations)
+    self.assertNear(result, expected, 1e-8)
+
+  def test_kid_np_matches_tf(self):
+    with self.test_session() as sess:
+      expected, expected_stderr = sess.run(kid_score_lib.kid(
+          tf.constant(self.fake_activations),
+          tf.constant(self.real_activations),
+          max_batch_size=100,
+          return_stderr=True))
+    result, stderr = kid_score_lib.kid_np(
+        self.fake_activations, self.real_activations, max_batch_size=100,
+        dtype=np.float64, return_stderr=True)
+    self.assertNear(result, expected, 1e-8)
+    self.assertNear(stderr, expected_stderr, 1e-8)
+
+  def test_kid_np_float32(self):
+    result_64 = kid_score_lib.kid_np(
+        self.fake_activations, self.real_activations, max_batch_size=100,
+        dtype=np.float64)
+    result_32 = kid_score_lib.kid_np(
+        self.fake_activations, self.real_activations, max_batch_size=100)
+    self.assertNear(result_32, result_64, 1e-4)
+
+  def test_kernel_inception_distance_caches_real_blocks(self):
+    kernel_inception_distance = kid_score_lib.KernelInceptionDistance(
+        self.real_activations, max_batch_size=100, dtype=np.float64)
+    first = kernel_inception_distance.score(self.fake_activations)
+    second = kernel_inception_distance.score(self.fake_activations[::-1])
+    self.assertEqual(list(kernel_inception_distance._real_block_means), [10])
+    self.assertNear(first, kid_score_lib.kid_np(
+        self.fake_activations, self.real_activations, max_batch_size=100,
+        dtype=np.float64, num_threads=1), 1e-10)
+    self.assertNear(second, kid_score_lib.kid_np(
+        self.fake_activations[::-1], self.real_activations, max_batch_size=100,
+        dtype=np.float64, num_threads=1), 1e-10)
+
+  def test_kernel_inception_distance_with_too_few_fake_examples(self):
+    kernel_inception_distance = kid_score_lib.KernelInceptionDistance(
+        self.real_activations, max_batch_size=100)
+    self.assertEqual(kernel_inception_distance.min_fake_examples(), 20)
+    kernel_inception_distance.score(self.fake_activations[:20])
+    with self.assertRaises(ValueError):
+      kernel_inception_distance.score(self.fake_activations[:19])
+
+
+if __name__ == "__main__":
+  tf.test.main()
@@ -35,36 +35,134 @@ from six.moves import range
 import tensorflow as tf
 
 
+# Number of distinct pairs in 5 batches of 64 images.
+_DEFAULT_NUM_PAIRS = 5 * 64 * 63 // 2
+
+
 class MultiscaleSSIMTask(eval_task.EvalTask):
   """Task that computes MSSIMScore for generated images."""
 
   _LABEL = "ms_ssim"
 
-  def run_after_session(self, options, eval_data_fake, eval_data_real=None):
-    del options, eval_data_real
-    score = _compute_multiscale_ssim_score(eval_data_fake.images)
+  def __init__(self, num_pairs=_DEFAULT_NUM_PAIRS, pairs_per_step=256,
+               seed=42):
+    """Creates a new `MultiscaleSSIMTask`.
+
+    Args:
+      num_pairs: Number of distinct image pairs to average over.
+      pairs_per_step: Number of image pairs per session run. This bounds the
+        memory use independently of `num_pairs`.
+      seed: Seed for sampling the image pairs.
+    """
+    self._num_pairs = num_pairs
+    self._pairs_per_step = pairs_per_step
+    self._seed = seed
+
+  def requirements(self):
+    return eval_task.EvalRequirements(fake_images=True)
+
+  def run_after_session(self, fake_dset, real_dset):
+    del real_dset
+    score = compute_msssim_from_images(
+        fake_dset.images, num_pairs=self._num_pairs,
+        pairs_per_step=self._pairs_per_step, seed=self._seed)
     return {self._LABEL: score}
 
 
-def _compute_multiscale_ssim_score(fake_images):
-  """Compute ms-ssim score ."""
-  batch_size = 64
+def _get_unique_pairs(num_images, num_pairs, group_size, random_state):
+  """Samples pairs of distinct images.
+
+  The images are shuffled and split into groups of `group_size` images. All
+  pairs (i, j) with i < j within a group are used. This repeats with new
+  permutations until there are `num_pairs` pairs.
+
+  Args:
+    num_images: Number of images.
+    num_pairs: Number of pairs.
+    group_size: Number of images per group.
+    random_state: `np.random.RandomState` used to shuffle the images.
+
+  Returns:
+    Tuple of two NumPy arrays with `num_pairs` image indices each.
+  """
+  group_size = min(group_size, num_images)
+  assert group_size > 1
+  first, second = np.triu_indices(group_size, k=1)
+  firsts = []
+  seconds = []
+  num_selected = 0
+  while num_selected < num_pairs:
+    permutation = random_state.permutation(num_images)
+    for start in range(0, num_images - group_size + 1, group_size):
+      group = permutation[start:start + group_size]
+      firsts.append(group[first])
+      seconds.append(group[second])
+      num_selected += first.shape[0]
+      if num_selected >= num_pairs:
+        break
+  return (np.concatenate(firsts)[:num_pairs],
+          np.concatenate(seconds)[:num_pairs])
+
+
+def compute_msssim_from_images(images, num_pairs=_DEFAULT_NUM_PAIRS,
+                               group_size=64, pairs_per_step=256, seed=None):
+  """Computes the average MS-SSIM over pairs of distinct images.
+
+  Following section 5.3 of https://arxiv.org/pdf/1710.08446.pdf, the pairs are
+  taken from random batches of `group_size` images. By default this uses the
+  pairs of 5 such batches. Only pairs of distinct images are compared and
+  every pair is compared once. The pairs are fed from a `tf.data` pipeline in
+  chunks of `pairs_per_step`, so the memory use does not depend on
+  `num_pairs`. The images of a chunk are only downscaled and filtered once,
+  however many pairs of the chunk they take part in.
+
+  Args:
+    images: NumPy array of shape [num_images, H, W, C] in range [0..255].
+    num_pairs: Number of image pairs.
+    group_size: Size of the random batches from which the pairs are taken.
+    pairs_per_step: Number of pairs per session run.
+    seed: Optional seed for sampling the pairs.
+
+  Returns:
+    The average MS-SSIM score.
+  """
+  first, second = _get_unique_pairs(
+      images.shape[0], num_pairs, group_size, np.random.RandomState(seed))
+  num_pairs = first.shape[0]
+
+  def generate_pairs():
+    """Yields the images of a chunk of pairs and the pairs as local indices."""
+    for start in range(0, num_pairs, pairs_per_step):
+      end = start + pairs_per_step
+      chunk_size = first[start:end].shape[0]
+      indices, local_indices = np.unique(
+          np.concatenate([first[start:end], second[start:end]]),
+          return_inverse=True)
+      yield (images[indices], local_indices[:chunk_size],
+             local_indices[chunk_size:])
+
+  logging.info("Computing MS-SSIM score on %d image pairs...", num_pairs)
   with tf.Graph().as_default():
-    fake_images_batch = tf.train.shuffle_batch(
-        [tf.convert_to_tensor(fake_images, dtype=tf.float32)],
-        capacity=16*batch_size,
-        min_after_dequeue=8*batch_size,
-        num_threads=4,
-        enqueue_many=True,
-        batch_size=batch_size)
-
-    # Following section 5.3 of https://arxiv.org/pdf/1710.08446.pdf, we only
-    # evaluate 5 batches of the generated images.
-    eval_fn = compute_msssim(
-        generated_images=fake_images_batch, num_batches=5)
-    with tf.train.MonitoredTrainingSession() as sess:
-      score = eval_fn(sess)
-  return score
+    dataset = tf.data.Dataset.from_generator(
+        generate_pairs,
+        output_types=(tf.as_dtype(images.dtype), tf.int64, tf.int64),
+        output_shapes=(tf.TensorShape([None] + list(images.shape[1:])),
+                       tf.TensorShape([None]), tf.TensorShape([None])))
+    dataset = dataset.prefetch(2)
+    chunk_images, chunk_first, chunk_second = (
+        dataset.make_one_shot_iterator().get_next())
+    # The scale pyramid of each image in the chunk is computed once and shared
+    # by all pairs of the chunk.
+    score_sum = tf.reduce_sum(image_similarity.multiscale_ssim_for_pairs(
+        tf.cast(chunk_images, tf.float32), chunk_first, chunk_second))
+    total_score = 0.0
+    with tf.Session() as sess:
+      while True:
+        try:
+          total_score += sess.run(score_sum)
+        except tf.errors.OutOfRangeError:
+          break
+  return total_score / num_pairs
 
 
 def compute_msssim(generated_images, num_batches):
@@ -83,19 +181,11 @@ def compute_msssim(generated_images, num_batches):
   batch_size = int(generated_images.get_shape()[0])
   assert batch_size > 1
 
-  # Generate all possible image pairs from input set of imgs.
-  pair1 = tf.tile(generated_images, [batch_size, 1, 1, 1])
-  pair2 = tf.reshape(
-      tf.tile(generated_images, [1, batch_size, 1, 1]), [
-          batch_size * batch_size, generated_images.shape[1],
-          generated_images.shape[2], generated_images.shape[3]
-      ])
-
-  # Compute the mean of the scores (but ignore the 'identical' images - which
-  # should get 1.0 from the MultiscaleSSIM)
-  score = tf.reduce_sum(image_similarity.multiscale_ssim(pair1, pair2))
-  score -= batch_size
-  score = tf.div(score, batch_size * batch_size - batch_size)
+  # Generate all pairs of distinct images from the input set of images. Each
+  # unordered pair is used once.
+  first, second = np.triu_indices(batch_size, k=1)
+  score = tf.reduce_mean(image_similarity.multiscale_ssim_for_pairs(
+      generated_images, first, second))
 
   # Define a function which wraps some session.run calls to generate a large
   # number of images and compute multiscale ssim metric on them.
@@ -20,6 +20,7 @@ from __future__ import division
 from __future__ import print_function
 
 from compare_gan.metrics import ms_ssim_score
+import numpy as np
 import tensorflow as tf
 
 
@@ -39,6 +40,29 @@ class MsSsimScoreTest(tf.test.TestCase):
         result = metric(sess)
         self.assertNear(result, 0.989989, 0.001)
 
+  def test_from_images_on_one_vs_07_vs_zero_images(self):
+    images = np.stack([
+        np.ones([64, 64, 3]),
+        np.ones([64, 64, 3]) * 0.7,
+        np.zeros([64, 64, 3]),
+    ]).astype(np.float32)
+    result = ms_ssim_score.compute_msssim_from_images(
+        images, num_pairs=6, pairs_per_step=4)
+    self.assertNear(result, 0.989989, 0.001)
+
+  def test_get_unique_pairs(self):
+    first, second = ms_ssim_score._get_unique_pairs(
+        num_images=100, num_pairs=2000, group_size=10,
+        random_state=np.random.RandomState(0))
+    self.assertEqual(first.shape, (2000,))
+    self.assertEqual(second.shape, (2000,))
+    self.assertTrue(np.all(first != second))
+    # Each group of 10 images has 45 distinct pairs and each permutation of
+    # the 100 images has 10 groups.
+    epoch = set(zip(first[:450], second[:450]))
+    self.assertEqual(len(epoch), 450)
+    self.assertEqual(len(set(first[:45]) | set(second[:45])), 10)
+
 
 if __name__ == '__main__':
   tf.test.main()
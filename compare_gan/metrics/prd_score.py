@@ -34,6 +34,8 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import multiprocessing
+
 from matplotlib import pyplot as plt
 import numpy as np
 import sklearn.cluster
@@ -47,11 +49,17 @@ def compute_prd(eval_dist, ref_dist, num_angles=1001, epsilon=1e-10):
   algorithm in [arxiv.org/abs/1806.2281349]. The PRD will be computed for an
   equiangular grid of num_angles values between [0, pi/2].
 
+  Several PRD curves can be computed in one call by passing arrays of shape
+  [..., num_states]. The leading dimensions of eval_dist and ref_dist are
+  broadcast against each other.
+
   Args:
-    eval_dist: 1D NumPy array or list of floats with the probabilities of the
-               different states under the distribution to be evaluated.
-    ref_dist: 1D NumPy array or list of floats with the probabilities of the
-              different states under the reference distribution.
+    eval_dist: NumPy array or list of floats with the probabilities of the
+               different states under the distribution to be evaluated. The
+               last dimension contains the states.
+    ref_dist: NumPy array or list of floats with the probabilities of the
+              different states under the reference distribution. The last
+              dimension contains the states.
     num_angles: Number of angles for which to compute PRD. Must be in [3, 1e6].
                 The default value is 1001.
     epsilon: Angle for PRD computation in the edge cases 0 and pi/2. The PRD
@@ -59,10 +67,10 @@ def compute_prd(eval_dist, ref_dist, num_angles=1001, epsilon=1e-10):
              The default value is 1e-10.
 
   Returns:
-    precision: NumPy array of shape [num_angles] with the precision for the
-               different ratios.
-    recall: NumPy array of shape [num_angles] with the recall for the different
-            ratios.
+    precision: NumPy array of shape [..., num_angles] with the precision for
+               the different ratios.
+    recall: NumPy array of shape [..., num_angles] with the recall for the
+            different ratios.
 
   Raises:
     ValueError: If not 0 < epsilon <= 0.1.
@@ -81,17 +89,30 @@ def compute_prd(eval_dist, ref_dist, num_angles=1001, epsilon=1e-10):
   # Broadcast slopes so that second dimension will be states of the distribution
   slopes_2d = np.expand_dims(slopes, 1)
 
-  # Broadcast distributions so that first dimension represents the angles
-  ref_dist_2d = np.expand_dims(ref_dist, 0)
-  eval_dist_2d = np.expand_dims(eval_dist, 0)
+  # Broadcast distributions so that the second to last dimension represents
+  # the angles
+  ref_dist_2d = np.expand_dims(ref_dist, -2)
+  eval_dist_2d = np.expand_dims(eval_dist, -2)
 
   # Compute precision and recall for all angles in one step via broadcasting
-  precision = np.minimum(ref_dist_2d*slopes_2d, eval_dist_2d).sum(axis=1)
+  precision = np.minimum(ref_dist_2d*slopes_2d, eval_dist_2d).sum(axis=-1)
   recall = precision / slopes
+
+  # Handle numerical instabilities leading to precision/recall just above 1.
+  max_val = max(np.max(precision), np.max(recall))
+  if max_val > 1.001:
+    raise ValueError('Detected value > 1.001, this should not happen.')
+  precision = np.clip(precision, 0, 1)
+  recall = np.clip(recall, 0, 1)
   return precision, recall
 
 
-def _cluster_into_bins(eval_data, ref_data, num_clusters):
+def _histogram(labels, num_clusters):
+  return np.histogram(labels, bins=num_clusters, range=[0, num_clusters],
+                      density=True)[0]
+
+
+def _cluster_into_bins(eval_data, ref_data, num_clusters, random_state=None):
   """Clusters the union of the data points and returns the cluster distribution.
 
   Clusters the union of eval_data and ref_data into num_clusters using minibatch
@@ -102,6 +123,7 @@ def _cluster_into_bins(eval_data, ref_data, num_clusters):
     eval_data: NumPy array of data points from the distribution to be evaluated.
     ref_data: NumPy array of data points from the reference distribution.
     num_clusters: Number of cluster centers to fit.
+    random_state: Optional seed for the k-means initialization.
 
   Returns:
     Two NumPy arrays, each of size num_clusters, where i-th entry represents the
@@ -109,22 +131,64 @@ def _cluster_into_bins(eval_data, ref_data, num_clusters):
   """
 
   cluster_data = np.vstack([eval_data, ref_data])
-  kmeans = sklearn.cluster.MiniBatchKMeans(n_clusters=num_clusters, n_init=10)
+  kmeans = sklearn.cluster.MiniBatchKMeans(n_clusters=num_clusters, n_init=10,
+                                           random_state=random_state)
   labels = kmeans.fit(cluster_data).labels_
 
   eval_labels = labels[:len(eval_data)]
   ref_labels = labels[len(eval_data):]
 
-  eval_bins = np.histogram(eval_labels, bins=num_clusters,
-                           range=[0, num_clusters], density=True)[0]
-  ref_bins = np.histogram(ref_labels, bins=num_clusters,
-                          range=[0, num_clusters], density=True)[0]
+  eval_bins = _histogram(eval_labels, num_clusters)
+  ref_bins = _histogram(ref_labels, num_clusters)
   return eval_bins, ref_bins
 
 
+def _cluster_into_bins_star(args):
+  return _cluster_into_bins(*args)
+
+
+def _fit_kmeans(data, num_clusters, random_state):
+  kmeans = sklearn.cluster.MiniBatchKMeans(n_clusters=num_clusters, n_init=10,
+                                           random_state=random_state)
+  return kmeans.fit(data)
+
+
+def _fit_kmeans_star(args):
+  return _fit_kmeans(*args)
+
+
+def _map_runs(fn, args_list, num_processes):
+  """Applies fn to every element of args_list, optionally in a process pool."""
+  if num_processes is None or num_processes <= 1 or len(args_list) <= 1:
+    return [fn(args) for args in args_list]
+  pool = multiprocessing.Pool(min(num_processes, len(args_list)))
+  try:
+    return pool.map(fn, args_list)
+  finally:
+    pool.close()
+    pool.join()
+
+
+def _get_run_seeds(num_runs, seed):
+  """Returns one k-means seed per run.
+
+  Args:
+    num_runs: Number of runs.
+    seed: Optional seed. If None the seeds are drawn from the global NumPy
+      random state, so results are reproducible after `np.random.seed()`.
+
+  Returns:
+    NumPy array with `num_runs` seeds.
+  """
+  if seed is None:
+    return np.random.randint(2**31 - 1, size=num_runs)
+  return np.random.RandomState(seed).randint(2**31 - 1, size=num_runs)
+
+
 def compute_prd_from_embedding(eval_data, ref_data, num_clusters=20,
                                num_angles=1001, num_runs=10,
-                               enforce_balance=True):
+                               enforce_balance=True, seed=None,
+                               num_processes=1, dtype=np.float64):
   """Computes PRD data from sample embeddings.
 
   The points from both distributions are mixed and then clustered. This leads
@@ -145,6 +209,14 @@ def compute_prd_from_embedding(eval_data, ref_data, num_clusters=20,
     num_runs: Number of independent runs over which to average the PRD data.
     enforce_balance: If enabled, throws exception if eval_data and ref_data do
                      not have the same length. The default value is True.
+    seed: Optional seed from which the seeds of the runs are derived. If set,
+          the result does not depend on num_processes.
+    num_processes: Number of processes clustering the runs in parallel. Note
+                   that forking a process which uses a TensorFlow session is
+                   not safe. The default value is 1.
+    dtype: Type of the data points for clustering. Use np.float32 to halve the
+           memory and speed up k-means on large embeddings. The default value
+           is np.float64.
 
   Returns:
     precision: NumPy array of shape [num_angles] with the precision for the
@@ -163,20 +235,96 @@ def compute_prd_from_embedding(eval_data, ref_data, num_clusters=20,
         'points in ref_data %d. To disable this exception, set enforce_balance '
         'to False (not recommended).' % (len(eval_data), len(ref_data)))
 
-  eval_data = np.array(eval_data, dtype=np.float64)
-  ref_data = np.array(ref_data, dtype=np.float64)
-  precisions = []
-  recalls = []
-  for _ in range(num_runs):
-    eval_dist, ref_dist = _cluster_into_bins(eval_data, ref_data, num_clusters)
-    precision, recall = compute_prd(eval_dist, ref_dist, num_angles)
-    precisions.append(precision)
-    recalls.append(recall)
+  eval_data = np.array(eval_data, dtype=dtype)
+  ref_data = np.array(ref_data, dtype=dtype)
+  dists = _map_runs(
+      _cluster_into_bins_star,
+      [(eval_data, ref_data, num_clusters, run_seed)
+       for run_seed in _get_run_seeds(num_runs, seed)],
+      num_processes)
+  eval_dists = np.array([eval_dist for eval_dist, _ in dists])
+  ref_dists = np.array([ref_dist for _, ref_dist in dists])
+  precisions, recalls = compute_prd(eval_dists, ref_dists, num_angles)
   precision = np.mean(precisions, axis=0)
   recall = np.mean(recalls, axis=0)
   return precision, recall
 
 
+class ClusterCodebook(object):
+  """Cluster centers fitted on reference embeddings for PRD computation.
+
+  Unlike compute_prd_from_embedding(), which clusters the union of both
+  samples, the codebook clusters only the reference data, once for each run.
+  Computing PRD data for a new sample then only assigns its points to the
+  nearest cluster centers. This is much cheaper when many samples (e.g.
+  checkpoints) are compared against the same reference data, but the curves
+  are not identical to the ones of compute_prd_from_embedding().
+  """
+
+  def __init__(self, ref_data, num_clusters=20, num_runs=10, seed=None,
+               num_processes=1, dtype=np.float64):
+    """Fits the codebook.
+
+    Args:
+      ref_data: NumPy array of data points from the reference distribution.
+      num_clusters: Number of cluster centers to fit. The default value is 20.
+      num_runs: Number of independent clusterings over which to average the
+                PRD data. The default value is 10.
+      seed: Optional seed from which the seeds of the runs are derived.
+      num_processes: Number of processes fitting the runs in parallel. The
+                     default value is 1.
+      dtype: Type of the data points for clustering. The default value is
+             np.float64.
+    """
+    self._num_clusters = num_clusters
+    self._dtype = dtype
+    ref_data = np.array(ref_data, dtype=dtype)
+    self._kmeans = _map_runs(
+        _fit_kmeans_star,
+        [(ref_data, num_clusters, run_seed)
+         for run_seed in _get_run_seeds(num_runs, seed)],
+        num_processes)
+    self._ref_dists = np.array(
+        [_histogram(kmeans.labels_, num_clusters) for kmeans in self._kmeans])
+
+  @property
+  def num_runs(self):
+    return len(self._kmeans)
+
+  def get_eval_dists(self, eval_data):
+    """Returns the cluster distributions of eval_data for every run.
+
+    Args:
+      eval_data: NumPy array of data points.
+
+    Returns:
+      NumPy array of shape [num_runs, num_clusters].
+    """
+    eval_data = np.array(eval_data, dtype=self._dtype)
+    return np.array([_histogram(kmeans.predict(eval_data), self._num_clusters)
+                     for kmeans in self._kmeans])
+
+  def compute_prd(self, eval_data, num_angles=1001):
+    """Computes PRD data of eval_data with respect to the reference data.
+
+    Args:
+      eval_data: NumPy array of data points from the distribution to be
+                 evaluated. Should have the same number of points as the
+                 reference data.
+      num_angles: Number of angles for which to compute PRD. Must be in
+                  [3, 1e6]. The default value is 1001.
+
+    Returns:
+      precision: NumPy array of shape [num_angles] with the precision for the
+                 different ratios.
+      recall: NumPy array of shape [num_angles] with the recall for the
+              different ratios.
+    """
+    precisions, recalls = compute_prd(
+        self.get_eval_dists(eval_data), self._ref_dists, num_angles)
+    return np.mean(precisions, axis=0), np.mean(recalls, axis=0)
+
+
 def _prd_to_f_beta(precision, recall, beta=1, epsilon=1e-10):
   """Computes F_beta scores for the given precision/recall values.
 
@@ -75,6 +75,17 @@ class PRDTest(unittest.TestCase):
     with self.assertRaises(ValueError):
       prd.compute_prd([1], [1], num_angles=2.5)
 
+  def test_compute_prd_broadcasts_over_leading_dimensions(self):
+    eval_dists = np.array([[0.5, 0.5], [1, 0], [0, 1]])
+    ref_dist = np.array([1, 0])
+    precision, recall = prd.compute_prd(eval_dists, ref_dist, num_angles=11)
+    self.assertEqual(precision.shape, (3, 11))
+    self.assertEqual(recall.shape, (3, 11))
+    for i, eval_dist in enumerate(eval_dists):
+      expected = prd.compute_prd(eval_dist, ref_dist, num_angles=11)
+      np.testing.assert_almost_equal(precision[i], expected[0])
+      np.testing.assert_almost_equal(recall[i], expected[1])
+
   def test__cluster_into_bins(self):
     eval_data = np.zeros([5, 4])
     ref_data = np.ones([5, 4])
@@ -104,6 +115,45 @@ class PRDTest(unittest.TestCase):
           'compute_prd_from_embedding should not raise a ValueError when '
           'enforce_balance is set to False.')
 
+  def test_compute_prd_from_embedding_seed_is_deterministic(self):
+    np.random.seed(0)
+    eval_data = np.random.normal(size=(200, 4))
+    ref_data = np.random.normal(size=(200, 4)) + 0.5
+    result_1 = prd.compute_prd_from_embedding(
+        eval_data, ref_data, num_clusters=5, num_runs=3, seed=1)
+    result_2 = prd.compute_prd_from_embedding(
+        eval_data, ref_data, num_clusters=5, num_runs=3, seed=1,
+        num_processes=2)
+    np.testing.assert_almost_equal(result_1, result_2)
+
+  def test_compute_prd_from_embedding_follows_global_seed(self):
+    np.random.seed(0)
+    eval_data = np.random.normal(size=(200, 4))
+    ref_data = np.random.normal(size=(200, 4)) + 0.5
+    np.random.seed(1)
+    result_1 = prd.compute_prd_from_embedding(
+        eval_data, ref_data, num_clusters=5, num_runs=3)
+    np.random.seed(1)
+    result_2 = prd.compute_prd_from_embedding(
+        eval_data, ref_data, num_clusters=5, num_runs=3)
+    np.testing.assert_almost_equal(result_1, result_2)
+
+  def test_cluster_codebook(self):
+    np.random.seed(0)
+    ref_data = np.random.normal(size=(200, 4))
+    codebook = prd.ClusterCodebook(
+        ref_data, num_clusters=5, num_runs=3, seed=1, dtype=np.float32)
+    self.assertEqual(codebook.num_runs, 3)
+    eval_dists = codebook.get_eval_dists(ref_data)
+    self.assertEqual(eval_dists.shape, (3, 5))
+    np.testing.assert_almost_equal(eval_dists.sum(axis=1), [1, 1, 1])
+    # The reference data has the same distribution as itself.
+    precision, recall = codebook.compute_prd(ref_data, num_angles=11)
+    np.testing.assert_almost_equal([precision[5], recall[5]], [1, 1])
+    # A shifted sample ends up in few clusters at the border.
+    precision, recall = codebook.compute_prd(ref_data + 10, num_angles=11)
+    self.assertLess(max(precision[5], recall[5]), 1)
+
   def test__prd_to_f_beta_correct_computation(self):
     precision = np.array([1, 1, 0, 0, 0.5, 1, 0.5])
     recall = np.array([1, 0, 1, 0, 0.5, 0.5, 1])
@@ -0,0 +1,97 @@
+# coding=utf-8
+# Copyright 2018 Google LLC & Hwalsuk Lee.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Evaluation task for precision and recall of distributions (PRD).
+
+Details are available in "Assessing Generative Models via Precision and
+Recall", Sajjadi et al. [https://arxiv.org/abs/1806.00035]. The PRD curves are
+computed on the Inception activations and summarized as the maximum F_8 (recall)
+and F_1/8 (precision) scores.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import threading
+import weakref
+
+from absl import logging
+
+from compare_gan.metrics import eval_task
+from compare_gan.metrics import prd_score
+
+import numpy as np
+
+
+class PRDScoreTask(eval_task.EvalTask):
+  """Evaluation task for the PRD scores.
+
+  The cluster centers are fitted on the real activations once per real data
+  set (see `get_cluster_codebook()`). Each fake data set is only assigned to
+  the nearest centers.
+  """
+
+  _RECALL_LABEL = "prd_f_8"
+  _PRECISION_LABEL = "prd_f_1_8"
+
+  def __init__(self, num_clusters=20, num_runs=10, seed=42):
+    """Creates a new `PRDScoreTask`.
+
+    Args:
+      num_clusters: Number of cluster centers.
+      num_runs: Number of clusterings over which the PRD curves are averaged.
+      seed: Seed for the clusterings.
+    """
+    self._num_clusters = num_clusters
+    self._num_runs = num_runs
+    self._seed = seed
+
+  def metric_list(self):
+    return frozenset([self._RECALL_LABEL, self._PRECISION_LABEL])
+
+  def requirements(self):
+    return eval_task.EvalRequirements(
+        fake_activations=True, real_activations=True)
+
+  def run_after_session(self, fake_dset, real_dset):
+    codebook = get_cluster_codebook(
+        real_dset, num_clusters=self._num_clusters, num_runs=self._num_runs,
+        seed=self._seed)
+    precision, recall = codebook.compute_prd(fake_dset.activations)
+    f_8, f_1_8 = prd_score.prd_to_max_f_beta_pair(precision, recall, beta=8)
+    logging.info("PRD F_8: %.5f, F_1/8: %.5f.", f_8, f_1_8)
+    return {self._RECALL_LABEL: float(f_8), self._PRECISION_LABEL: float(f_1_8)}
+
+
+# Cache of `ClusterCodebook` objects for real data sets. Evaluating many
+# checkpoints against the same real data set only fits the clusters once.
+_CLUSTER_CODEBOOKS = weakref.WeakKeyDictionary()
+_CLUSTER_CODEBOOKS_LOCK = threading.Lock()
+
+
+def get_cluster_codebook(real_dset, num_clusters=20, num_runs=10, seed=42):
+  """Returns the (cached) `ClusterCodebook` for an `EvalDataSample`."""
+  with _CLUSTER_CODEBOOKS_LOCK:
+    codebooks = _CLUSTER_CODEBOOKS.setdefault(real_dset, {})
+    key = (num_clusters, num_runs, seed)
+    if key not in codebooks:
+      logging.info("Fitting %d x %d cluster centers for PRD on %d real "
+                   "examples.", num_runs, num_clusters,
+                   len(real_dset.activations))
+      codebooks[key] = prd_score.ClusterCodebook(
+          real_dset.activations, num_clusters=num_clusters,
+          num_runs=num_runs, seed=seed, dtype=np.float32)
+    return codebooks[key]
@@ -0,0 +1,73 @@
+# coding=utf-8
+# Copyright 2018 Google LLC & Hwalsuk Lee.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the PRD evaluation task."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from compare_gan import eval_utils
+from compare_gan.metrics import prd_score
+from compare_gan.metrics import prd_task
+
+import mock
+import numpy as np
+import tensorflow as tf
+
+
+def _dset(activations):
+  dset = eval_utils.EvalDataSample(None)
+  dset.set_inception_features(activations, None)
+  return dset
+
+
+class PRDTaskTest(tf.test.TestCase):
+
+  def test_task_fits_clusters_once_per_real_dset(self):
+    np.random.seed(0)
+    real_dset = _dset(np.random.normal(size=(500, 8)))
+    fake_dsets = [_dset(np.random.normal(size=(500, 8)) + shift)
+                  for shift in [0.0, 3.0]]
+    task = prd_task.PRDScoreTask(num_clusters=5, num_runs=2)
+    self.assertTrue(task.requirements().real_activations)
+    with mock.patch.object(prd_score, "ClusterCodebook",
+                           wraps=prd_score.ClusterCodebook) as codebook_cls:
+      results = [task.run_after_session(fake_dset, real_dset)
+                 for fake_dset in fake_dsets]
+    self.assertEqual(codebook_cls.call_count, 1)
+    self.assertEqual(set(results[0]), task.metric_list())
+    # Fake data close to the real data has higher precision and recall.
+    for label in task.metric_list():
+      self.assertGreater(results[0][label], results[1][label])
+
+  def test_task_matches_cluster_codebook(self):
+    np.random.seed(0)
+    real_dset = _dset(np.random.normal(size=(500, 8)))
+    fake_dset = _dset(np.random.normal(size=(500, 8)) + 0.5)
+    result = prd_task.PRDScoreTask(
+        num_clusters=5, num_runs=2, seed=1).run_after_session(
+            fake_dset, real_dset)
+    codebook = prd_score.ClusterCodebook(
+        real_dset.activations, num_clusters=5, num_runs=2, seed=1,
+        dtype=np.float32)
+    f_8, f_1_8 = prd_score.prd_to_max_f_beta_pair(
+        *codebook.compute_prd(fake_dset.activations), beta=8)
+    self.assertAllClose(result["prd_f_8"], f_8)
+    self.assertAllClose(result["prd_f_1_8"], f_1_8)
+
+
+if __name__ == "__main__":
+  tf.test.main()
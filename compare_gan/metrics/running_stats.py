@@ -0,0 +1,221 @@
+# coding=utf-8
+# Copyright 2018 Google LLC & Hwalsuk Lee.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Online accumulators for the statistics behind FID and Inception Score.
+
+Both accumulators consume batches as they are produced and use memory that is
+independent of the number of examples: O(d^2) for the covariance of d
+dimensional activations and O(num_classes) for the Inception Score. Their
+state is a dictionary of NumPy arrays and can be saved and restored to
+continue accumulating later.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import six
+import tensorflow as tf
+
+
+def _save_state(state, path):
+  buf = six.BytesIO()
+  np.savez(buf, **state)
+  with tf.gfile.Open(path, "wb") as f:
+    f.write(buf.getvalue())
+
+
+def _load_state(path):
+  with tf.gfile.Open(path, "rb") as f:
+    arrays = np.load(six.BytesIO(f.read()))
+    return {k: arrays[k] for k in arrays.files}
+
+
+class RunningMeanAndCovariance(object):
+  """Running mean and unbiased covariance of a stream of vectors.
+
+  Batches are merged with the pairwise update from "Updating Formulae and a
+  Pairwise Algorithm for Computing Sample Variances", Chan et al., 1979. The
+  sums of squared deviations are kept in float64 which avoids the
+  cancellation of the naive E[xx^T] - E[x]E[x]^T formula.
+  """
+
+  def __init__(self, num_features, num_examples=0, mean=None, m2=None):
+    """Creates a new accumulator.
+
+    Args:
+      num_features: Dimension of the vectors.
+      num_examples: Number of examples seen so far.
+      mean: Optional mean of the examples seen so far.
+      m2: Optional sum of the outer products of the deviations from the mean of
+        the examples seen so far.
+    """
+    self._num_examples = num_examples
+    if mean is None:
+      mean = np.zeros([num_features])
+    if m2 is None:
+      m2 = np.zeros([num_features, num_features])
+    self._mean = np.array(mean, dtype=np.float64)
+    self._m2 = np.array(m2, dtype=np.float64)
+
+  @classmethod
+  def from_moments(cls, mean, cov, num_examples):
+    """Creates an accumulator from a mean and unbiased covariance."""
+    return cls(mean.shape[0], num_examples=num_examples, mean=mean,
+               m2=np.asarray(cov) * (num_examples - 1))
+
+  @classmethod
+  def from_state(cls, state):
+    return cls(state["mean"].shape[0],
+               num_examples=int(state["num_examples"]),
+               mean=state["mean"], m2=state["m2"])
+
+  @classmethod
+  def load(cls, path):
+    return cls.from_state(_load_state(path))
+
+  def get_state(self):
+    return {
+        "num_examples": np.array(self._num_examples),
+        "mean": self._mean,
+        "m2": self._m2,
+    }
+
+  def save(self, path):
+    _save_state(self.get_state(), path)
+
+  def _merge(self, num_examples, mean, m2):
+    total = self._num_examples + num_examples
+    delta = mean - self._mean
+    self._m2 += m2 + np.outer(delta, delta) * (
+        self._num_examples * num_examples / total)
+    self._mean += delta * (num_examples / total)
+    self._num_examples = total
+
+  def update(self, batch):
+    """Adds a batch of shape [batch_size, num_features] to the statistics."""
+    if not batch.shape[0]:
+      return
+    batch = np.asarray(batch, dtype=np.float64)
+    mean = np.mean(batch, axis=0)
+    centered = batch - mean
+    self._merge(batch.shape[0], mean, np.dot(centered.T, centered))
+
+  def merge(self, other):
+    """Adds the statistics of another `RunningMeanAndCovariance`."""
+    if other.num_examples:
+      self._merge(other.num_examples, other.mean, other.get_state()["m2"])
+
+  @property
+  def num_examples(self):
+    return self._num_examples
+
+  @property
+  def mean(self):
+    return self._mean
+
+  @property
+  def covariance(self):
+    return self._m2 / max(self._num_examples - 1, 1)
+
+
+class RunningInceptionScore(object):
+  """Running Inception Score of a stream of logits.
+
+  For each split this keeps the number of examples, the sum of the class
+  probabilities and the sum of sum_y p(y|x) log p(y|x). The score of a split
+  is exp(E_x[KL(p(y|x) || p(y))]) which expands to
+  exp(E_x[sum_y p(y|x) log p(y|x)] - sum_y p(y) log p(y)).
+
+  Examples are assigned to splits round robin. With a single split this
+  matches `tfgan.eval.classifier_score_from_logits()`.
+  """
+
+  def __init__(self, num_classes, num_splits=1, num_examples=None,
+               sum_probs=None, sum_neg_entropy=None):
+    """Creates a new accumulator.
+
+    Args:
+      num_classes: Number of classes of the classifier.
+      num_splits: Number of splits.
+      num_examples: Optional array with the number of examples per split.
+      sum_probs: Optional [num_splits, num_classes] array with the sum of the
+        class probabilities per split.
+      sum_neg_entropy: Optional array with the sum of the negative entropies
+        of the class probabilities per split.
+    """
+    if num_examples is None:
+      num_examples = np.zeros([num_splits])
+    if sum_probs is None:
+      sum_probs = np.zeros([num_splits, num_classes])
+    if sum_neg_entropy is None:
+      sum_neg_entropy = np.zeros([num_splits])
+    self._num_examples = np.array(num_examples, dtype=np.int64)
+    self._sum_probs = np.array(sum_probs, dtype=np.float64)
+    self._sum_neg_entropy = np.array(sum_neg_entropy, dtype=np.float64)
+
+  @classmethod
+  def from_state(cls, state):
+    num_splits, num_classes = state["sum_probs"].shape
+    return cls(num_classes, num_splits=num_splits,
+               num_examples=state["num_examples"],
+               sum_probs=state["sum_probs"],
+               sum_neg_entropy=state["sum_neg_entropy"])
+
+  @classmethod
+  def load(cls, path):
+    return cls.from_state(_load_state(path))
+
+  def get_state(self):
+    return {
+        "num_examples": self._num_examples,
+        "sum_probs": self._sum_probs,
+        "sum_neg_entropy": self._sum_neg_entropy,
+    }
+
+  def save(self, path):
+    _save_state(self.get_state(), path)
+
+  def update(self, logits):
+    """Adds a batch of logits of shape [batch_size, num_classes]."""
+    logits = np.asarray(logits, dtype=np.float64)
+    logits = logits - np.max(logits, axis=1, keepdims=True)
+    log_probs = logits - np.log(np.sum(np.exp(logits), axis=1, keepdims=True))
+    probs = np.exp(log_probs)
+    neg_entropy = np.sum(probs * log_probs, axis=1)
+    num_splits = self._num_examples.shape[0]
+    offset = int(np.sum(self._num_examples))
+    splits = (offset + np.arange(logits.shape[0])) % num_splits
+    self._num_examples += np.bincount(splits, minlength=num_splits)
+    np.add.at(self._sum_probs, splits, probs)
+    self._sum_neg_entropy += np.bincount(
+        splits, weights=neg_entropy, minlength=num_splits)
+
+  @property
+  def num_examples(self):
+    return int(np.sum(self._num_examples))
+
+  def split_scores(self):
+    """Returns a NumPy array with the Inception Score of each split."""
+    num_examples = self._num_examples.astype(np.float64)
+    marginals = self._sum_probs / num_examples[:, None]
+    marginal_neg_entropy = np.sum(
+        marginals * np.log(np.maximum(marginals, 1e-300)), axis=1)
+    return np.exp(self._sum_neg_entropy / num_examples - marginal_neg_entropy)
+
+  def score(self):
+    """Returns the mean Inception Score over all splits."""
+    return float(np.mean(self.split_scores()))
@@ -0,0 +1,89 @@
+# coding=utf-8
+# Copyright 2018 Google LLC & Hwalsuk Lee.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the running statistics for FID and Inception Score."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+from compare_gan.metrics import running_stats
+
+import numpy as np
+from six.moves import range
+import tensorflow as tf
+import tensorflow_gan as tfgan
+
+
+class RunningStatsTest(tf.test.TestCase):
+
+  def testMeanAndCovarianceMatchNumPy(self):
+    np.random.seed(0)
+    # Large offset to check numerical stability.
+    activations = np.random.normal(size=(1000, 8)) * 3.0 + 1e4
+    moments = running_stats.RunningMeanAndCovariance(8)
+    for start in range(0, 1000, 64):
+      moments.update(activations[start:start + 64])
+    self.assertEqual(moments.num_examples, 1000)
+    self.assertAllClose(moments.mean, np.mean(activations, axis=0))
+    self.assertAllClose(moments.covariance, np.cov(activations, rowvar=False))
+
+  def testMergeAndRestore(self):
+    np.random.seed(0)
+    activations = np.random.normal(size=(300, 4))
+    moments = running_stats.RunningMeanAndCovariance.from_moments(
+        np.mean(activations[:100], axis=0),
+        np.cov(activations[:100], rowvar=False), num_examples=100)
+    path = os.path.join(self.get_temp_dir(), "moments.npz")
+    moments.save(path)
+    moments = running_stats.RunningMeanAndCovariance.load(path)
+    other = running_stats.RunningMeanAndCovariance(4)
+    other.update(activations[100:])
+    moments.merge(other)
+    self.assertAllClose(moments.covariance, np.cov(activations, rowvar=False))
+
+  def testInceptionScoreMatchesTfgan(self):
+    np.random.seed(0)
+    logits = np.random.normal(size=(500, 10)) * 3.0
+    stats = running_stats.RunningInceptionScore(10)
+    for start in range(0, 500, 64):
+      stats.update(logits[start:start + 64])
+    with tf.Graph().as_default():
+      expected = tfgan.eval.classifier_score_from_logits(
+          tf.convert_to_tensor(logits))
+      with self.session() as sess:
+        expected = sess.run(expected)
+    self.assertNear(stats.score(), expected, 1e-6)
+    path = os.path.join(self.get_temp_dir(), "inception_score.npz")
+    stats.save(path)
+    self.assertNear(
+        running_stats.RunningInceptionScore.load(path).score(), expected, 1e-6)
+
+  def testInceptionScoreWithSplits(self):
+    np.random.seed(0)
+    logits = np.random.normal(size=(90, 10))
+    stats = running_stats.RunningInceptionScore(10, num_splits=3)
+    stats.update(logits[:50])
+    stats.update(logits[50:])
+    for i, score in enumerate(stats.split_scores()):
+      expected = running_stats.RunningInceptionScore(10)
+      expected.update(logits[i::3])
+      self.assertNear(score, expected.score(), 1e-6)
+
+
+if __name__ == "__main__":
+  tf.test.main()
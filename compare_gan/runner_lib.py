@@ -19,15 +19,25 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
+import contextlib
 import csv
+import errno
+import json
+import multiprocessing.pool
 import os
 import re
+import socket
+import sqlite3
+import threading
 import time
+import uuid
 
 from absl import flags
 from absl import logging
 from compare_gan import datasets
 from compare_gan import eval_gan_lib
+from compare_gan import eval_telemetry
 from compare_gan import hooks
 from compare_gan.gans import utils
 from compare_gan.metrics import fid_score as fid_score_lib
@@ -111,11 +121,212 @@ def get_options_dict(batch_size=gin.REQUIRED,
   }
 
 
+@gin.configurable("eval_leases", whitelist=["lease_secs", "heartbeat_secs"])
+class CheckpointLeases(object):
+  """Coordinates evaluation workers through lease files in the model directory.
+
+  A worker claims a checkpoint by atomically creating the file
+  `<model_dir>/eval_leases/<checkpoint>.lease`. While the worker holds the
+  lease a background thread refreshes its modification time. Leases that
+  were not refreshed for `lease_secs` (e.g. because the worker died) expire
+  and can be claimed by another worker. Once the results are written the
+  lease becomes a `.done` file and the checkpoint is never claimed again.
+
+  Each lease file contains a unique owner token. A worker only refreshes or
+  completes a lease while the file still contains its token, so a worker
+  whose lease expired and was taken over never touches the new lease.
+
+  Lease files are created with O_EXCL and taken over with rename(). This
+  requires a file system with atomic operations (local or NFS), not a
+  blob store.
+  """
+
+  def __init__(self, model_dir, worker_id, lease_secs=900, heartbeat_secs=60):
+    self._lease_dir = os.path.join(model_dir, "eval_leases")
+    self._worker_id = str(worker_id)
+    self._lease_secs = lease_secs
+    self._heartbeat_secs = heartbeat_secs
+    # Maps the paths of the held leases to their owner tokens.
+    self._held = {}
+    self._lock = threading.Lock()
+    self._heartbeat = None
+    utils.check_folder(self._lease_dir)
+
+  def _path(self, checkpoint_path, suffix):
+    return os.path.join(
+        self._lease_dir, os.path.basename(checkpoint_path) + suffix)
+
+  def _create(self, lease_path):
+    """Atomically creates the lease file.
+
+    Args:
+      lease_path: Path of the lease file.
+
+    Returns:
+      The owner token written to the lease or None if the lease exists.
+    """
+    try:
+      fd = os.open(lease_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except OSError as e:
+      if e.errno == errno.EEXIST:
+        return None
+      raise
+    token = "{} {} {} {}".format(self._worker_id, socket.gethostname(),
+                                 os.getpid(), uuid.uuid4().hex)
+    with os.fdopen(fd, "w") as f:
+      f.write(token + "\n")
+    return token
+
+  def _read_token(self, lease_path):
+    """Returns the owner token of the lease or None if it does not exist."""
+    try:
+      with open(lease_path) as f:
+        return f.read().strip()
+    except (IOError, OSError):
+      return None
+
+  def _is_owner(self, lease_path, token):
+    """Returns True if the lease file exists and contains `token`."""
+    return self._read_token(lease_path) == token
+
+  def _drop(self, lease_path, token):
+    """Forgets a lease that was taken over by another worker."""
+    with self._lock:
+      if self._held.get(lease_path) != token:
+        return
+      del self._held[lease_path]
+    logging.warning("Worker %s lost lease %s to another worker.",
+                    self._worker_id, lease_path)
+
+  def _break_expired(self, lease_path):
+    """Removes the lease if it expired. Only one worker can succeed."""
+    token = self._read_token(lease_path)
+    try:
+      age = time.time() - os.path.getmtime(lease_path)
+    except OSError:
+      # Released in the meantime.
+      return
+    if age < self._lease_secs:
+      return
+    expired_path = "{}.expired-{}-{}".format(
+        lease_path, self._worker_id, os.getpid())
+    try:
+      os.rename(lease_path, expired_path)
+    except OSError:
+      # Another worker took over the lease first.
+      return
+    # Between checking the age and renaming, other workers might have broken
+    # the lease and claimed it again. Then the renamed lease is not the
+    # expired one and is put back (unless there is a new lease already).
+    renamed_age = time.time() - os.path.getmtime(expired_path)
+    if (renamed_age < self._lease_secs or
+        self._read_token(expired_path) != token):
+      try:
+        os.link(expired_path, lease_path)
+      except OSError:
+        logging.warning("Could not restore lease %s.", lease_path)
+      os.remove(expired_path)
+      return
+    logging.warning("Lease %s expired %.0f seconds ago.", lease_path,
+                    age - self._lease_secs)
+    os.remove(expired_path)
+
+  def is_done(self, checkpoint_path):
+    return os.path.exists(self._path(checkpoint_path, ".done"))
+
+  def acquire(self, checkpoint_path):
+    """Returns True if this worker claimed the checkpoint for evaluation."""
+    if self.is_done(checkpoint_path):
+      return False
+    lease_path = self._path(checkpoint_path, ".lease")
+    self._break_expired(lease_path)
+    token = self._create(lease_path)
+    if token is None:
+      return False
+    # Another worker that found the previous lease expired might have removed
+    # the new lease right away.
+    if not self._is_owner(lease_path, token):
+      return False
+    with self._lock:
+      self._held[lease_path] = token
+      if self._heartbeat is None:
+        self._heartbeat = threading.Thread(
+            target=self._refresh_leases, name="eval_lease_heartbeat")
+        self._heartbeat.daemon = True
+        self._heartbeat.start()
+    logging.info("Worker %s claimed %s.", self._worker_id, checkpoint_path)
+    return True
+
+  def holds(self, checkpoint_path):
+    """Returns True if this worker (still) holds the lease of the checkpoint."""
+    lease_path = self._path(checkpoint_path, ".lease")
+    with self._lock:
+      token = self._held.get(lease_path)
+    if token is None:
+      return False
+    if not self._is_owner(lease_path, token):
+      self._drop(lease_path, token)
+      return False
+    return True
+
+  def complete(self, checkpoint_path):
+    """Marks a claimed checkpoint as evaluated.
+
+    Does nothing if this worker does not hold the lease (anymore).
+
+    Args:
+      checkpoint_path: Path of the checkpoint passed to `acquire()`.
+    """
+    lease_path = self._path(checkpoint_path, ".lease")
+    with self._lock:
+      token = self._held.pop(lease_path, None)
+    if token is None:
+      return
+    if not self._is_owner(lease_path, token):
+      logging.warning("Worker %s lost lease %s to another worker.",
+                      self._worker_id, lease_path)
+      return
+    try:
+      os.rename(lease_path, self._path(checkpoint_path, ".done"))
+    except OSError:
+      logging.exception("Could not complete lease %s.", lease_path)
+
+  def refresh_leases(self):
+    """Refreshes the modification time of all leases held by this worker."""
+    with self._lock:
+      held = list(self._held.items())
+    for lease_path, token in held:
+      if not self._is_owner(lease_path, token):
+        self._drop(lease_path, token)
+        continue
+      try:
+        os.utime(lease_path, None)
+      except OSError:
+        logging.exception("Could not refresh lease %s.", lease_path)
+
+  def _refresh_leases(self):
+    while True:
+      time.sleep(self._heartbeat_secs)
+      self.refresh_leases()
+
+
 class TaskManager(object):
-  """Interface for managing a task."""
+  """Interface for managing a task.
 
-  def __init__(self, model_dir):
+  If `worker_id` is set multiple workers can evaluate the same model directory
+  concurrently. Each checkpoint is only evaluated by the worker that holds
+  its lease (see `CheckpointLeases`). Results for a checkpoint whose lease was
+  taken over by another worker are discarded.
+
+  Subclasses implement `_store_eval_result()`.
+  """
+
+  def __init__(self, model_dir, worker_id=None):
     self._model_dir = model_dir
+    self._worker_id = worker_id
+    self._leases = None
+    if worker_id is not None:
+      self._leases = CheckpointLeases(model_dir, worker_id)
 
   @property
   def model_dir(self):
@@ -129,11 +340,33 @@ class TaskManager(object):
     return tf.gfile.Exists(os.path.join(self.model_dir, "TRAIN_DONE"))
 
   def add_eval_result(self, checkpoint_path, result_dict, default_value):
+    """Stores the results unless another worker took over the checkpoint."""
+    if self._leases is not None and not self._leases.holds(checkpoint_path):
+      logging.warning("Discarding results for %s, the checkpoint was claimed "
+                      "by another worker.", checkpoint_path)
+      return
+    self._store_eval_result(checkpoint_path, result_dict, default_value)
+    if self._leases is not None:
+      self._leases.complete(checkpoint_path)
+
+  def _store_eval_result(self, checkpoint_path, result_dict, default_value):
+    """Stores the results. Implemented by subclasses."""
     pass
 
   def get_checkpoints_with_results(self):
     return set()
 
+  def _select_checkpoints_with_results(self, checkpoints):
+    """Returns the subset of `checkpoints` that have results.
+
+    Subclasses that can look up single checkpoints cheaply should override
+    this instead of reading all results.
+
+    Args:
+      checkpoints: Set of checkpoint paths.
+    """
+    return checkpoints & self.get_checkpoints_with_results()
+
   def unevaluated_checkpoints(self, timeout=0, eval_every_steps=None):
     """Generator for checkpoints without evaluation results.
 
@@ -147,13 +380,20 @@ class TaskManager(object):
       Path to checkpoints that have not yet been evaluated.
     """
     logging.info("Looking for checkpoints in %s", self._model_dir)
-    evaluated_checkpoints = self.get_checkpoints_with_results()
+    evaluated_checkpoints = set()
+    results_read = False
     last_eval = time.time()
     while True:
       unevaluated_checkpoints = []
       checkpoint_state = tf.train.get_checkpoint_state(self.model_dir)
       if checkpoint_state:
         checkpoints = set(checkpoint_state.all_model_checkpoint_paths)
+        # Other workers add results concurrently, so with leases the results
+        # are read on every poll.
+        if not results_read or self._leases is not None:
+          evaluated_checkpoints |= self._select_checkpoints_with_results(
+              checkpoints - evaluated_checkpoints)
+          results_read = True
         # Remove already evaluated checkpoints and sort ascending by step
         # number.
         unevaluated_checkpoints = checkpoints - evaluated_checkpoints
@@ -167,15 +407,28 @@ class TaskManager(object):
             "Found checkpoints: %s\nEvaluated checkpoints: %s\n"
             "Unevaluated checkpoints: %s", checkpoints, evaluated_checkpoints,
             unevaluated_checkpoints)
+      claimed_checkpoints = []
+      leased_by_others = False
       for checkpoint_path in unevaluated_checkpoints:
+        if self._leases is not None:
+          if self._leases.is_done(checkpoint_path):
+            evaluated_checkpoints.add(checkpoint_path)
+            continue
+          if not self._leases.acquire(checkpoint_path):
+            leased_by_others = True
+            continue
+        claimed_checkpoints.append(checkpoint_path)
         yield checkpoint_path
-      if unevaluated_checkpoints:
-        evaluated_checkpoints |= set(unevaluated_checkpoints)
+      if claimed_checkpoints:
+        evaluated_checkpoints |= set(claimed_checkpoints)
         last_eval = time.time()
         continue
       # No new checkpoints, timeout or stop if training finished. Otherwise
-      # wait 1 minute.
-      if time.time() - last_eval > timeout or self.is_training_done():
+      # wait 1 minute. Checkpoints leased by other workers are retried in case
+      # their leases expire.
+      if time.time() - last_eval > timeout:
+        break
+      if self.is_training_done() and not leased_by_others:
         break
       time.sleep(60)
 
@@ -183,59 +436,348 @@ class TaskManager(object):
     pass
 
 
+class _OperativeConfigs(object):
+  """Memoized access to the operative Gin configs in a model directory.
+
+  The model directory is only listed again if there is no config for the
+  requested step yet, and every config file is parsed once.
+  """
+
+  def __init__(self, model_dir):
+    self._model_dir = model_dir
+    self._config_steps = []
+    self._configs = {}
+    self._lock = threading.Lock()
+
+  def _list_config_steps(self):
+    saved_configs = tf.gfile.Glob(
+        os.path.join(self._model_dir, "operative_config-*.gin"))
+    get_step = lambda fn: int(re.findall(r"operative_config-(\d+).gin", fn)[0])
+    self._config_steps = sorted(get_step(fn) for fn in saved_configs)
+
+  def get_config_for_step(self, step):
+    """Returns the latest operative config for the global step as dictionary."""
+    step = int(step)
+    with self._lock:
+      if not self._config_steps or self._config_steps[-1] < step:
+        # A newer config might have been written since the last listing.
+        self._list_config_steps()
+      assert self._config_steps
+      last_config_step = [s for s in self._config_steps if s <= step][-1]
+      if last_config_step not in self._configs:
+        config_path = os.path.join(
+            self._model_dir,
+            "operative_config-{}.gin".format(last_config_step))
+        self._configs[last_config_step] = _parse_gin_config(config_path)
+      return self._configs[last_config_step]
+
+
 class TaskManagerWithCsvResults(TaskManager):
-  """Task Manager that writes results to a CSV file."""
+  """Task Manager that writes results to a CSV file.
 
-  def __init__(self, model_dir, score_file=None):
-    super(TaskManagerWithCsvResults, self).__init__(model_dir)
+  With multiple workers each worker writes to its own file
+  `<score_file without .csv>-<worker_id>.csv`.
+  """
+
+  def __init__(self, model_dir, score_file=None, worker_id=None):
+    super(TaskManagerWithCsvResults, self).__init__(
+        model_dir, worker_id=worker_id)
     if score_file is None:
       score_file = os.path.join(model_dir, "scores.csv")
+    self._score_files_pattern = None
+    if worker_id is not None:
+      root, ext = os.path.splitext(score_file)
+      self._score_files_pattern = "{}-*{}".format(root, ext)
+      score_file = "{}-{}{}".format(root, worker_id, ext)
     self._score_file = score_file
 
+    self._operative_configs = _OperativeConfigs(model_dir)
+
   def _get_config_for_step(self, step):
     """Returns the latest operative config for the global step as dictionary."""
-    saved_configs = tf.gfile.Glob(
-        os.path.join(self.model_dir, "operative_config-*.gin"))
-    get_step = lambda fn: int(re.findall(r"operative_config-(\d+).gin", fn)[0])
-    config_steps = [get_step(fn) for fn in saved_configs]
-    assert config_steps
-    last_config_step = sorted([s for s in config_steps if s <= step])[-1]
-    config_path = os.path.join(
-        self.model_dir, "operative_config-{}.gin".format(last_config_step))
-    return _parse_gin_config(config_path)
+    return self._operative_configs.get_config_for_step(step)
 
-  def add_eval_result(self, checkpoint_path, result_dict, default_value):
+  def _read_csv_header(self):
+    """Returns the field names of the score file or None if it is empty."""
+    if not tf.gfile.Exists(self._score_file):
+      return None
+    with tf.gfile.Open(self._score_file) as f:
+      return next(csv.reader(f), None)
+
+  def _store_eval_result(self, checkpoint_path, result_dict, default_value):
     step = os.path.basename(checkpoint_path).split("-")[-1]
     config = self._get_config_for_step(step)
-    csv_header = (
-        ["checkpoint_path", "step"] + sorted(result_dict) + sorted(config))
-    write_header = not tf.gfile.Exists(self._score_file)
-    if write_header:
-      with tf.gfile.Open(self._score_file, "w") as f:
-        writer = csv.DictWriter(f, fieldnames=csv_header, extrasaction="ignore")
-        writer.writeheader()
     row = dict(checkpoint_path=checkpoint_path, step=step, **config)
     for k, v in six.iteritems(result_dict):
       if isinstance(v, float):
         v = "{:.3f}".format(v)
       row[k] = v
-    with tf.gfile.Open(self._score_file, "a") as f:
-      writer = csv.DictWriter(f, fieldnames=csv_header, extrasaction="ignore")
-      writer.writerow(row)
+    # Rows are written with the columns of the existing header (missing keys
+    # are left empty). If the row has new keys the file is rewritten with the
+    # new columns appended to the header.
+    csv_header = self._read_csv_header()
+    if csv_header is not None and set(row).issubset(csv_header):
+      with tf.gfile.Open(self._score_file, "a") as f:
+        csv.DictWriter(f, fieldnames=csv_header).writerow(row)
+    else:
+      rows = []
+      if csv_header is None:
+        csv_header = (
+            ["checkpoint_path", "step"] + sorted(result_dict) + sorted(config))
+      else:
+        with tf.gfile.Open(self._score_file) as f:
+          rows = list(csv.DictReader(f))
+        csv_header += sorted(set(row) - set(csv_header))
+      with tf.gfile.Open(self._score_file, "w") as f:
+        writer = csv.DictWriter(f, fieldnames=csv_header)
+        writer.writeheader()
+        writer.writerows(rows + [row])
 
   def get_checkpoints_with_results(self):
-    if not tf.gfile.Exists(self._score_file):
-      return set()
-    with tf.gfile.Open(self._score_file) as f:
-      reader = csv.DictReader(f)
-      return {r["checkpoint_path"] for r in reader}
-    return set()
+    if self._score_files_pattern is None:
+      score_files = [self._score_file]
+    else:
+      score_files = tf.gfile.Glob(self._score_files_pattern)
+    checkpoints = set()
+    for score_file in score_files:
+      if not tf.gfile.Exists(score_file):
+        continue
+      with tf.gfile.Open(score_file) as f:
+        reader = csv.DictReader(f)
+        checkpoints |= {r["checkpoint_path"] for r in reader}
+    return checkpoints
+
+
+class TaskManagerWithSqliteResults(TaskManager):
+  """Task Manager that writes results to an SQLite database.
+
+  The database has one row per checkpoint (indexed by the checkpoint path)
+  with the results and the operative Gin config as JSON. Checking whether a
+  checkpoint was evaluated does not read all results and adding a result does
+  not rewrite any file. Use `export_csv()` or `to_dataframe()` to analyze the
+  results.
+
+  SQLite relies on file locks, so the database must be on a local file
+  system (not e.g. gs://). With multiple workers (see `CheckpointLeases`)
+  each worker writes to its own database
+  `<db_path without .sqlite>-<worker_id>.sqlite`. Use `merge()` to combine
+  the databases of all workers into one.
+  """
+
+  def __init__(self, model_dir, db_path=None, worker_id=None):
+    super(TaskManagerWithSqliteResults, self).__init__(
+        model_dir, worker_id=worker_id)
+    if db_path is None:
+      db_path = os.path.join(model_dir, "scores.sqlite")
+    if worker_id is not None:
+      root, ext = os.path.splitext(db_path)
+      db_path = "{}-{}{}".format(root, worker_id, ext)
+    self._db_path = db_path
+    self._operative_configs = _OperativeConfigs(model_dir)
+    utils.check_folder(os.path.dirname(db_path))
+    with self._connect() as conn:
+      conn.execute(
+          "CREATE TABLE IF NOT EXISTS results ("
+          "checkpoint_path TEXT PRIMARY KEY, "
+          "step INTEGER NOT NULL, "
+          "default_value REAL, "
+          "results TEXT NOT NULL, "
+          "config TEXT NOT NULL)")
+      conn.execute(
+          "CREATE INDEX IF NOT EXISTS results_step ON results (step)")
+
+  @contextlib.contextmanager
+  def _connect(self):
+    """Yields a connection and commits on success.
+
+    Connections are not shared since results can be read and written from
+    different threads (see `_run_pipelined()`).
+    """
+    conn = sqlite3.connect(self._db_path, timeout=60)
+    try:
+      with conn:
+        yield conn
+    finally:
+      conn.close()
+
+  def _store_eval_result(self, checkpoint_path, result_dict, default_value):
+    step = int(os.path.basename(checkpoint_path).split("-")[-1])
+    config = self._operative_configs.get_config_for_step(step)
+    results = {k: v.item() if isinstance(v, np.generic) else v
+               for k, v in six.iteritems(result_dict)}
+    with self._connect() as conn:
+      conn.execute(
+          "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+          (checkpoint_path, step, default_value,
+           json.dumps(results, sort_keys=True),
+           json.dumps(config, sort_keys=True)))
+
+  def has_result(self, checkpoint_path):
+    with self._connect() as conn:
+      row = conn.execute(
+          "SELECT 1 FROM results WHERE checkpoint_path = ?",
+          (checkpoint_path,)).fetchone()
+    return row is not None
+
+  def get_checkpoints_with_results(self):
+    with self._connect() as conn:
+      return {r[0] for r in conn.execute(
+          "SELECT checkpoint_path FROM results")}
+
+  def _select_checkpoints_with_results(self, checkpoints):
+    return {c for c in checkpoints if self.has_result(c)}
+
+  def merge(self, db_path):
+    """Adds the results from another database (e.g. of another worker).
+
+    Results for checkpoints that are in both databases are replaced.
 
+    Args:
+      db_path: Path of a database written by `TaskManagerWithSqliteResults`.
+    """
+    with self._connect() as conn:
+      conn.execute("ATTACH DATABASE ? AS other", (db_path,))
+      conn.execute(
+          "INSERT OR REPLACE INTO results SELECT * FROM other.results")
+
+  def get_results(self):
+    """Returns a list of dictionaries with the results ordered by step.
+
+    Each dictionary has the keys checkpoint_path, step, default_value, the
+    keys of the results and the keys of the operative config.
+    """
+    with self._connect() as conn:
+      rows = conn.execute(
+          "SELECT checkpoint_path, step, default_value, results, config "
+          "FROM results ORDER BY step").fetchall()
+    results = []
+    for checkpoint_path, step, default_value, result_json, config_json in rows:
+      row = dict(checkpoint_path=checkpoint_path, step=step,
+                 default_value=default_value)
+      row.update(json.loads(config_json))
+      row.update(json.loads(result_json))
+      results.append(row)
+    return results
+
+  def export_csv(self, csv_path):
+    """Writes all results to a CSV file like `TaskManagerWithCsvResults`."""
+    results = self.get_results()
+    fieldnames = ["checkpoint_path", "step", "default_value"]
+    fieldnames += sorted({k for row in results for k in row} - set(fieldnames))
+    with tf.gfile.Open(csv_path, "w") as f:
+      writer = csv.DictWriter(f, fieldnames=fieldnames)
+      writer.writeheader()
+      for row in results:
+        writer.writerow(row)
+
+  def get_telemetry_summary(self):
+    """Returns a table with the cost of each evaluation stage.
+
+    The wall and CPU times are averaged over all evaluated checkpoints. See
+    `eval_telemetry.format_summary_table()`.
+    """
+    return eval_telemetry.format_summary_table(self.get_results())
 
+  def to_dataframe(self):
+    """Returns the results as `pandas.DataFrame`."""
+    import pandas as pd  # pylint: disable=g-import-not-at-top
+    return pd.DataFrame(self.get_results())
+
+
+# Marks the end of the stream of prepared checkpoints in _run_pipelined().
+_END_OF_CHECKPOINTS = "end_of_checkpoints"
+
+
+def _prepare_checkpoints(prepare_fn, checkpoints, prepared_queue):
+  """Calls `prepare_fn` for all checkpoints and puts the results in a queue.
+
+  The last element in the queue is (_END_OF_CHECKPOINTS, exception) where
+  `exception` is None if all checkpoints were prepared.
+
+  Args:
+    prepare_fn: Function that takes a checkpoint path.
+    checkpoints: Iterable of checkpoint paths.
+    prepared_queue: `Queue` for tuples (checkpoint_path, prepared).
+  """
+  try:
+    for checkpoint_path in checkpoints:
+      prepared_queue.put((checkpoint_path, prepare_fn(checkpoint_path)))
+  except Exception as e:  # pylint: disable=broad-except
+    logging.exception("Failed to prepare checkpoints for evaluation.")
+    prepared_queue.put((_END_OF_CHECKPOINTS, e))
+    return
+  prepared_queue.put((_END_OF_CHECKPOINTS, None))
+
+
+def _run_pipelined(prepare_fn, score_fn, checkpoints, write_fn,
+                   num_scoring_threads, max_prepared_checkpoints):
+  """Prepares the next checkpoints while the current ones are scored.
+
+  `prepare_fn` runs on a background thread (one checkpoint at a time) and
+  `score_fn` on a pool of `num_scoring_threads` threads. Results are written
+  in the order of `checkpoints`. Bounded queues make sure that at most
+  `max_prepared_checkpoints` prepared checkpoints wait for scoring.
+
+  Args:
+    prepare_fn: Function that takes a checkpoint path and returns the input
+      for `score_fn`.
+    score_fn: Function that takes the output of `prepare_fn`.
+    checkpoints: Iterable of checkpoint paths.
+    write_fn: Function that takes a checkpoint path and the output of
+      `score_fn`. Only called from the calling thread.
+    num_scoring_threads: Number of threads for scoring.
+    max_prepared_checkpoints: Maximum number of prepared checkpoints waiting
+      for scoring.
+  """
+  prepared_queue = six.moves.queue.Queue(maxsize=max_prepared_checkpoints)
+  producer = threading.Thread(
+      target=_prepare_checkpoints,
+      args=(prepare_fn, checkpoints, prepared_queue),
+      name="prepare_checkpoints")
+  producer.daemon = True
+  producer.start()
+  pool = multiprocessing.pool.ThreadPool(num_scoring_threads)
+  pending = collections.deque()
+  def write_oldest():
+    checkpoint_path, async_result = pending.popleft()
+    write_fn(checkpoint_path, async_result.get())
+  try:
+    while True:
+      checkpoint_path, prepared = prepared_queue.get()
+      if checkpoint_path == _END_OF_CHECKPOINTS:
+        if prepared is not None:
+          raise prepared  # pylint: disable=raising-bad-type
+        break
+      pending.append(
+          (checkpoint_path, pool.apply_async(score_fn, (prepared,))))
+      while len(pending) > num_scoring_threads:
+        write_oldest()
+    while pending:
+      write_oldest()
+  finally:
+    pool.close()
+    pool.join()
+  producer.join()
+
+
+@gin.configurable("run_eval", whitelist=[
+    "export_modules", "pipelined", "num_scoring_threads",
+    "max_prepared_checkpoints"])
 def _run_eval(module_spec, checkpoints, task_manager, run_config,
-              use_tpu, num_averaging_runs):
+              use_tpu, num_averaging_runs, export_modules=True,
+              pipelined=False, num_scoring_threads=2,
+              max_prepared_checkpoints=1):
   """Evaluates the given checkpoints and add results to a result writer.
 
+  The evaluation of each checkpoint has two stages. Preparing a checkpoint
+  (exporting or restoring the weights, updating the batch norm accumulators,
+  sampling and computing Inception features) needs the generator. Scoring
+  (computing the metrics of all tasks) only needs the prepared samples.
+
+  The wall time, CPU time and peak RSS of every stage are recorded with an
+  `EvalTelemetry` and added to the results of the checkpoint (keys
+  "telemetry/<stage>/<metric>").
+
   Args:
     module_spec: `ModuleSpec` of the model.
     checkpoints: Generator for for checkpoint paths.
@@ -245,6 +787,16 @@ def _run_eval(module_spec, checkpoints, task_manager, run_config,
       currently ignored.
     use_tpu: Whether to use TPU for evaluation.
     num_averaging_runs: Determines how many times each metric is computed.
+    export_modules: If True export a TF Hub module for every checkpoint and
+      evaluate it. Otherwise the evaluation graph is only built once and the
+      generator weights of each checkpoint are restored into it.
+    pipelined: If True prepare the next checkpoint on a background thread
+      while the current checkpoints are scored.
+    num_scoring_threads: Only used if `pipelined` is True. Number of
+      checkpoints that are scored in parallel.
+    max_prepared_checkpoints: Only used if `pipelined` is True. Maximum number
+      of prepared checkpoints waiting to be scored. Prepared checkpoints hold
+      all Inception features (and possibly images) in memory.
   """
   # By default, we compute FID and Inception scores. Other tasks defined in
   # the metrics folder (such as the one in metrics/kid_score.py) can be added
@@ -254,28 +806,88 @@ def _run_eval(module_spec, checkpoints, task_manager, run_config,
       fid_score_lib.FIDScoreTask()
   ]
   logging.info("eval_tasks: %s", eval_tasks)
-
-  for checkpoint_path in checkpoints:
-    step = os.path.basename(checkpoint_path).split("-")[-1]
-    if step == 0:
-      continue
-    export_path = os.path.join(run_config.model_dir, "tfhub", str(step))
-    if not tf.gfile.Exists(export_path):
-      module_spec.export(export_path, checkpoint_path=checkpoint_path)
-    default_value = -1.0
+  # Record the same stages for every checkpoint so that all results have the
+  # same keys.
+  telemetry_stages = list(eval_telemetry.EVAL_STAGES) + [
+      eval_telemetry.get_task_stage(task) for task in eval_tasks]
+
+  evaluator = None
+  if not export_modules:
+    evaluator = eval_gan_lib.GeneratorEvaluator(module_spec, use_tpu=use_tpu)
+
+  def generate(checkpoint_path, telemetry):
+    """Returns the generated and real data sets or None if there were NaNs."""
+    if evaluator is None:
+      step = os.path.basename(checkpoint_path).split("-")[-1]
+      export_path = os.path.join(run_config.model_dir, "tfhub", str(step))
+      if not tf.gfile.Exists(export_path):
+        with telemetry.stage("export"):
+          module_spec.export(export_path, checkpoint_path=checkpoint_path)
     try:
-      result_dict = eval_gan_lib.evaluate_tfhub_module(
-          export_path, eval_tasks, use_tpu=use_tpu,
-          num_averaging_runs=num_averaging_runs)
+      if evaluator is not None:
+        evaluator.restore(checkpoint_path, telemetry=telemetry)
+        return evaluator.generate(
+            eval_tasks, num_averaging_runs, telemetry=telemetry)
+      module_evaluator = eval_gan_lib.GeneratorEvaluator(
+          export_path, use_tpu=use_tpu, telemetry=telemetry)
+      try:
+        return module_evaluator.generate(
+            eval_tasks, num_averaging_runs, telemetry=telemetry)
+      finally:
+        module_evaluator.close()
     except ValueError as nan_found_error:
-      result_dict = {}
       logging.exception(nan_found_error)
-      default_value = eval_gan_lib.NAN_DETECTED
-
-    logging.info("Evaluation result for checkpoint %s: %s (default value: %s)",
-                 checkpoint_path, result_dict, default_value)
+      return None
+
+  def prepare_checkpoint(checkpoint_path):
+    """Returns a tuple (prepared, telemetry), see `generate()`."""
+    telemetry = eval_telemetry.EvalTelemetry(stages=telemetry_stages)
+    with telemetry.stage("prepare"):
+      prepared = generate(checkpoint_path, telemetry)
+    return prepared, telemetry
+
+  def compute_results(prepared, telemetry):
+    """Returns a tuple (result_dict, default_value)."""
+    if prepared is None:
+      return {}, eval_gan_lib.NAN_DETECTED
+    try:
+      return eval_gan_lib.compute_task_results(
+          eval_tasks, *prepared, telemetry=telemetry), -1.0
+    except ValueError as nan_found_error:
+      logging.exception(nan_found_error)
+      return {}, eval_gan_lib.NAN_DETECTED
+
+  def score_checkpoint(prepared_and_telemetry):
+    """Returns a tuple (result_dict, default_value, telemetry)."""
+    prepared, telemetry = prepared_and_telemetry
+    with telemetry.stage("score"):
+      result_dict, default_value = compute_results(prepared, telemetry)
+    return result_dict, default_value, telemetry
+
+  def write_result(checkpoint_path, result):
+    result_dict, default_value, telemetry = result
+    logging.info("Evaluation result for checkpoint %s: %s (default value: "
+                 "%s)", checkpoint_path, result_dict, default_value)
+    result_dict = dict(result_dict)
+    result_dict.update(telemetry.as_dict())
+    logging.info("Evaluation cost for checkpoint %s:\n%s", checkpoint_path,
+                 eval_telemetry.format_summary_table([result_dict]))
     task_manager.add_eval_result(checkpoint_path, result_dict, default_value)
 
+  try:
+    if pipelined:
+      _run_pipelined(
+          prepare_checkpoint, score_checkpoint, checkpoints, write_result,
+          num_scoring_threads=num_scoring_threads,
+          max_prepared_checkpoints=max_prepared_checkpoints)
+    else:
+      for checkpoint_path in checkpoints:
+        write_result(checkpoint_path,
+                     score_checkpoint(prepare_checkpoint(checkpoint_path)))
+  finally:
+    if evaluator is not None:
+      evaluator.close()
+
 
 def run_with_schedule(schedule, run_config, task_manager, options, use_tpu,
                       num_eval_averaging_runs=1, eval_every_steps=-1):
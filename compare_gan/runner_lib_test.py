@@ -19,6 +19,7 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import csv
 import os
 
 from absl import flags
@@ -26,13 +27,13 @@ from absl import logging
 from absl.testing import flagsaver
 from absl.testing import parameterized
 
-from compare_gan import eval_gan_lib
 from compare_gan import runner_lib
 from compare_gan import test_utils
 from compare_gan.architectures import arch_ops
 from compare_gan.gans.modular_gan import ModularGAN
 
 import gin
+import mock
 import numpy as np
 from six.moves import range
 import tensorflow as tf
@@ -181,6 +182,232 @@ class RunnerLibTest(parameterized.TestCase, test_utils.CompareGanTestCase):
         "model.ckpt-1.meta", "operative_config-0.gin", "tfhub"]
     self.assertAllInSet(expected_files, tf.gfile.ListDirectory(model_dir))
 
+  @parameterized.named_parameters([
+      ("WithoutExport", False, False),
+      ("Pipelined", True, True),
+      ("PipelinedWithoutExport", False, True),
+  ])
+  def testTrainAndEvalWithEvalOptions(self, export_modules, pipelined):
+    gin.bind_parameter("dataset.name", "cifar10")
+    gin.bind_parameter("ModularGAN.g_use_ema", True)
+    gin.bind_parameter("run_eval.export_modules", export_modules)
+    gin.bind_parameter("run_eval.pipelined", pipelined)
+    options = {
+        "architecture": "resnet_cifar_arch",
+        "batch_size": 2,
+        "disc_iters": 1,
+        "gan_class": ModularGAN,
+        "lambda": 1,
+        "training_steps": 1,
+        "z_dim": 128,
+    }
+    model_dir = self._get_empty_model_dir()
+    run_config = tf.contrib.tpu.RunConfig(
+        model_dir=model_dir,
+        tpu_config=tf.contrib.tpu.TPUConfig(iterations_per_loop=1))
+    task_manager = runner_lib.TaskManagerWithCsvResults(model_dir)
+    runner_lib.run_with_schedule(
+        "eval_after_train",
+        run_config=run_config,
+        task_manager=task_manager,
+        options=options,
+        use_tpu=False,
+        num_eval_averaging_runs=1,
+        eval_every_steps=None)
+    self.assertEqual("tfhub" in tf.gfile.ListDirectory(model_dir),
+                     export_modules)
+    self.assertEqual(len(task_manager.get_checkpoints_with_results()), 2)
+
+  def testCheckpointLeases(self):
+    model_dir = self._get_empty_model_dir()
+    leases_a = runner_lib.CheckpointLeases(model_dir, "a", lease_secs=3600)
+    leases_b = runner_lib.CheckpointLeases(model_dir, "b", lease_secs=0)
+    checkpoint_path = os.path.join(model_dir, "model.ckpt-1")
+    self.assertTrue(leases_a.acquire(checkpoint_path))
+    # Leases only expire after lease_secs of the worker trying to claim it.
+    self.assertFalse(
+        runner_lib.CheckpointLeases(model_dir, "c").acquire(checkpoint_path))
+    # With lease_secs=0 every lease is expired immediately.
+    self.assertTrue(leases_b.acquire(checkpoint_path))
+    leases_b.complete(checkpoint_path)
+    self.assertTrue(leases_a.is_done(checkpoint_path))
+    self.assertFalse(leases_a.acquire(checkpoint_path))
+
+  def testCheckpointLeasesIgnoreLeasesTakenOver(self):
+    model_dir = self._get_empty_model_dir()
+    leases_a = runner_lib.CheckpointLeases(model_dir, "a")
+    leases_b = runner_lib.CheckpointLeases(model_dir, "b", lease_secs=0)
+    checkpoint_path = os.path.join(model_dir, "model.ckpt-1")
+    lease_path = os.path.join(model_dir, "eval_leases", "model.ckpt-1.lease")
+    self.assertTrue(leases_a.acquire(checkpoint_path))
+    self.assertTrue(leases_b.acquire(checkpoint_path))
+    with open(lease_path) as f:
+      token_b = f.read()
+    # Worker a lost its lease: it neither refreshes nor completes it.
+    leases_a.refresh_leases()
+    leases_a.complete(checkpoint_path)
+    self.assertFalse(leases_a.is_done(checkpoint_path))
+    with open(lease_path) as f:
+      self.assertEqual(f.read(), token_b)
+    leases_b.complete(checkpoint_path)
+    self.assertTrue(leases_b.is_done(checkpoint_path))
+
+  def testCheckpointLeasesRestoreLeaseTakenOverWhileBreaking(self):
+    model_dir = self._get_empty_model_dir()
+    leases_a = runner_lib.CheckpointLeases(model_dir, "a")
+    leases_c = runner_lib.CheckpointLeases(model_dir, "c")
+    checkpoint_path = os.path.join(model_dir, "model.ckpt-1")
+    self.assertTrue(leases_a.acquire(checkpoint_path))
+    # Worker c saw an old modification time, i.e. the lease of a previous
+    # owner, but renames the new lease of worker a.
+    getmtime = os.path.getmtime
+    stale_mtimes = [0.0]
+    def fake_getmtime(path):
+      return stale_mtimes.pop() if stale_mtimes else getmtime(path)
+    with mock.patch.object(os.path, "getmtime", side_effect=fake_getmtime):
+      self.assertFalse(leases_c.acquire(checkpoint_path))
+    self.assertTrue(leases_a.holds(checkpoint_path))
+    self.assertEqual(os.listdir(os.path.join(model_dir, "eval_leases")),
+                     ["model.ckpt-1.lease"])
+
+  def testTaskManagerDiscardsResultsOfLostLeases(self):
+    model_dir = self._get_empty_model_dir()
+    tf.gfile.MakeDirs(model_dir)
+    with tf.gfile.Open(os.path.join(model_dir, "operative_config-0.gin"),
+                       "w") as f:
+      f.write("")
+    task_manager = runner_lib.TaskManagerWithCsvResults(
+        model_dir, worker_id="a")
+    checkpoint_path = os.path.join(model_dir, "model.ckpt-1")
+    self.assertTrue(task_manager._leases.acquire(checkpoint_path))
+    leases_b = runner_lib.CheckpointLeases(model_dir, "b", lease_secs=0)
+    self.assertTrue(leases_b.acquire(checkpoint_path))
+    task_manager.add_eval_result(checkpoint_path, {"fid": 1.0}, -1.0)
+    self.assertEqual(task_manager.get_checkpoints_with_results(), set())
+    self.assertFalse(leases_b.is_done(checkpoint_path))
+
+  def testCheckpointLeasesCompleteWithoutLeaseFile(self):
+    model_dir = self._get_empty_model_dir()
+    leases = runner_lib.CheckpointLeases(model_dir, "a")
+    checkpoint_path = os.path.join(model_dir, "model.ckpt-1")
+    self.assertTrue(leases.acquire(checkpoint_path))
+    os.remove(os.path.join(model_dir, "eval_leases", "model.ckpt-1.lease"))
+    leases.complete(checkpoint_path)
+    self.assertFalse(leases.is_done(checkpoint_path))
+
+  def testTaskManagerWithCsvResultsForMultipleWorkers(self):
+    model_dir = self._get_empty_model_dir()
+    tf.gfile.MakeDirs(model_dir)
+    with tf.gfile.Open(os.path.join(model_dir, "operative_config-0.gin"),
+                       "w") as f:
+      f.write("")
+    task_managers = [
+        runner_lib.TaskManagerWithCsvResults(model_dir, worker_id=i)
+        for i in range(2)]
+    task_managers[0].add_eval_result(
+        os.path.join(model_dir, "model.ckpt-1"), {"fid": 1.0}, -1.0)
+    task_managers[1].add_eval_result(
+        os.path.join(model_dir, "model.ckpt-2"), {"fid": 2.0}, -1.0)
+    self.assertTrue(
+        tf.gfile.Exists(os.path.join(model_dir, "scores-0.csv")))
+    self.assertEqual(
+        task_managers[0].get_checkpoints_with_results(),
+        {os.path.join(model_dir, "model.ckpt-1"),
+         os.path.join(model_dir, "model.ckpt-2")})
+
+  def testTaskManagerWithCsvResultsKeepsColumnsForDifferentKeys(self):
+    model_dir = self._get_empty_model_dir()
+    tf.gfile.MakeDirs(model_dir)
+    with tf.gfile.Open(os.path.join(model_dir, "operative_config-0.gin"),
+                       "w") as f:
+      f.write("")
+    task_manager = runner_lib.TaskManagerWithCsvResults(model_dir)
+    task_manager.add_eval_result(
+        os.path.join(model_dir, "model.ckpt-1"),
+        {"fid": 1.0, "telemetry/real_loading/wall_secs": 5.0}, -1.0)
+    # Checkpoint without the real_loading stage but with a new stage.
+    task_manager.add_eval_result(
+        os.path.join(model_dir, "model.ckpt-2"),
+        {"fid": 2.0, "telemetry/export/wall_secs": 7.0}, -1.0)
+    with tf.gfile.Open(os.path.join(model_dir, "scores-0.csv")) as f:
+      rows = list(csv.DictReader(f))
+    self.assertEqual(len(rows), 2)
+    self.assertEqual(rows[0]["telemetry/real_loading/wall_secs"], "5.000")
+    self.assertEqual(rows[1]["step"], "2")
+    self.assertEqual(rows[1]["fid"], "2.000")
+    self.assertEqual(rows[1]["telemetry/real_loading/wall_secs"], "")
+    self.assertEqual(rows[1]["telemetry/export/wall_secs"], "7.000")
+    self.assertEqual(rows[0]["telemetry/export/wall_secs"], "")
+
+  def testTaskManagerWithSqliteResults(self):
+    model_dir = self._get_empty_model_dir()
+    tf.gfile.MakeDirs(model_dir)
+    with tf.gfile.Open(os.path.join(model_dir, "operative_config-0.gin"),
+                       "w") as f:
+      f.write("options.z_dim = 128\n")
+    task_manager = runner_lib.TaskManagerWithSqliteResults(model_dir)
+    checkpoint_path = os.path.join(model_dir, "model.ckpt-10")
+    self.assertFalse(task_manager.has_result(checkpoint_path))
+    task_manager.add_eval_result(
+        checkpoint_path, {"fid_score_mean": np.float32(3.5)}, -1.0)
+    self.assertTrue(task_manager.has_result(checkpoint_path))
+    self.assertEqual(task_manager.get_checkpoints_with_results(),
+                     {checkpoint_path})
+    results = task_manager.get_results()
+    self.assertEqual(len(results), 1)
+    self.assertEqual(results[0]["step"], 10)
+    self.assertEqual(results[0]["fid_score_mean"], 3.5)
+    self.assertEqual(results[0]["options.z_dim"], "128")
+    csv_path = os.path.join(model_dir, "export.csv")
+    task_manager.export_csv(csv_path)
+    with tf.gfile.Open(csv_path) as f:
+      self.assertEqual(len(list(csv.DictReader(f))), 1)
+
+  def testTaskManagerWithSqliteResultsForMultipleWorkers(self):
+    model_dir = self._get_empty_model_dir()
+    tf.gfile.MakeDirs(model_dir)
+    with tf.gfile.Open(os.path.join(model_dir, "operative_config-0.gin"),
+                       "w") as f:
+      f.write("")
+    task_managers = [
+        runner_lib.TaskManagerWithSqliteResults(model_dir, worker_id=i)
+        for i in range(2)]
+    for i, task_manager in enumerate(task_managers):
+      task_manager.add_eval_result(
+          os.path.join(model_dir, "model.ckpt-%d" % i), {"fid": 1.0}, -1.0)
+    self.assertEqual(task_managers[0].get_checkpoints_with_results(),
+                     {os.path.join(model_dir, "model.ckpt-0")})
+    task_managers[0].merge(os.path.join(model_dir, "scores-1.sqlite"))
+    self.assertEqual(
+        [r["step"] for r in task_managers[0].get_results()], [0, 1])
+
+  def testTaskManagerWithSqliteResultsTelemetrySummary(self):
+    model_dir = self._get_empty_model_dir()
+    tf.gfile.MakeDirs(model_dir)
+    with tf.gfile.Open(os.path.join(model_dir, "operative_config-0.gin"),
+                       "w") as f:
+      f.write("")
+    task_manager = runner_lib.TaskManagerWithSqliteResults(model_dir)
+    for step, wall_secs in [(1, 2.0), (2, 4.0)]:
+      task_manager.add_eval_result(
+          os.path.join(model_dir, "model.ckpt-%d" % step),
+          {"fid_score_mean": 3.5,
+           "telemetry/fake_sampling/wall_secs": wall_secs}, -1.0)
+    lines = task_manager.get_telemetry_summary().split("\n")
+    self.assertEqual(len(lines), 2)
+    self.assertEqual(lines[1].split(), ["fake_sampling", "3.000", "-", "-"])
+
+  def testRunPipelinedKeepsOrder(self):
+    results = []
+    runner_lib._run_pipelined(
+        prepare_fn=lambda x: 2 * x,
+        score_fn=lambda x: x + 1,
+        checkpoints=range(10),
+        write_fn=lambda c, r: results.append((c, r)),
+        num_scoring_threads=3,
+        max_prepared_checkpoints=2)
+    self.assertEqual(results, [(i, 2 * i + 1) for i in range(10)])
+
   def testTrainAndEvalWithSpectralNormAndEma(self):
     gin.bind_parameter("dataset.name", "cifar10")
     gin.bind_parameter("ModularGAN.g_use_ema", True)
@@ -232,13 +459,9 @@ class RunnerLibTest(parameterized.TestCase, test_utils.CompareGanTestCase):
         model_dir=model_dir,
         tpu_config=tf.contrib.tpu.TPUConfig(iterations_per_loop=1))
     task_manager = runner_lib.TaskManager(model_dir)
-    # Wrap _UpdateBnAccumulators to only perform one accumulator update step.
-    # Otherwise the test case would time out.
-    orig_update_bn_accumulators = eval_gan_lib._update_bn_accumulators
-    def mock_update_bn_accumulators(sess, generated, num_accu_examples):
-      del num_accu_examples
-      return orig_update_bn_accumulators(sess, generated, num_accu_examples=64)
-    eval_gan_lib._update_bn_accumulators = mock_update_bn_accumulators
+    # Only perform one accumulator update step. Otherwise the test case would
+    # time out.
+    gin.bind_parameter("bn_accumulators.num_accu_examples", 64)
     runner_lib.run_with_schedule(
         "eval_after_train",
         run_config=run_config,
@@ -247,12 +470,11 @@ class RunnerLibTest(parameterized.TestCase, test_utils.CompareGanTestCase):
         use_tpu=False,
         num_eval_averaging_runs=1,
         eval_every_steps=None)
-    expected_tfhub_files = [
-        "checkpoint", "model-with-accu.ckpt.data-00000-of-00001",
-        "model-with-accu.ckpt.index", "model-with-accu.ckpt.meta"]
-    self.assertAllInSet(
-        expected_tfhub_files,
-        tf.gfile.ListDirectory(os.path.join(model_dir, "tfhub/0")))
+    sidecar_path = os.path.join(model_dir, "tfhub/0/bn_accumulators-64.npz")
+    self.assertTrue(tf.gfile.Exists(sidecar_path))
+    with tf.gfile.Open(sidecar_path, "rb") as f:
+      accumulators = np.load(f)
+      self.assertNotEmpty(accumulators["names"])
 
 
 if __name__ == "__main__":